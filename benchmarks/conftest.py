@@ -0,0 +1,131 @@
+"""Fixtures for the benchmark suite
+
+Synthetic data is generated once per session. The size can be scaled with
+``--synthetic-scale`` (e.g. ``pytest benchmarks --synthetic-scale 10``).
+
+Besides the timings of pytest-benchmark, each benchmark records its
+throughput (features/s, MB/s) and the peak RSS of this process and of its
+child processes in ``extra_info``.
+"""
+
+import resource
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterator, List
+
+import pytest
+
+from benchmarks.synthetic import SyntheticSpec, write_xml, write_zip
+from mojxml.batch import FeatureBatch
+from mojxml.parse import ParseOptions, parse_batch
+from mojxml.reader import iter_content_xmls
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--synthetic-scale",
+        type=float,
+        default=1.0,
+        help="Scale factor of the number of 筆 in the synthetic data",
+    )
+
+
+@dataclass
+class SyntheticData:
+    """Paths of the generated data and their sizes"""
+
+    small_xml: Path
+    large_xml: Path
+    nested_zip: Path
+    # 展開後のXMLの合計サイズと、地物数 (include_chikugai=True の場合)
+    small_bytes: int
+    large_bytes: int
+    zip_xml_bytes: int
+    small_features: int
+    large_features: int
+    zip_features: int
+
+
+@pytest.fixture(scope="session")
+def synthetic(request, tmp_path_factory) -> SyntheticData:
+    scale = request.config.getoption("--synthetic-scale")
+    base = tmp_path_factory.mktemp("synthetic")
+    small = SyntheticSpec(num_fude=max(1, int(1000 * scale)))
+    large = SyntheticSpec(num_fude=max(1, int(5000 * scale)), seed=1)
+    member = SyntheticSpec(num_fude=max(1, int(1000 * scale)), seed=2)
+
+    write_xml(base / "small.xml", small)
+    write_xml(base / "large.xml", large)
+    write_zip(base / "nested.zip", 8, member)
+
+    options = ParseOptions(include_chikugai=True)
+    zip_contents = list(iter_content_xmls([base / "nested.zip"]))
+    return SyntheticData(
+        small_xml=base / "small.xml",
+        large_xml=base / "large.xml",
+        nested_zip=base / "nested.zip",
+        small_bytes=(base / "small.xml").stat().st_size,
+        large_bytes=(base / "large.xml").stat().st_size,
+        zip_xml_bytes=sum(len(c) for c in zip_contents),
+        small_features=small.num_fude,
+        large_features=large.num_fude,
+        zip_features=sum(len(parse_batch(c, options)) for c in zip_contents),
+    )
+
+
+@pytest.fixture(scope="session")
+def synthetic_batches(synthetic: SyntheticData) -> List[FeatureBatch]:
+    """Parsed batches of the nested zip, as input for the writers"""
+    options = ParseOptions(include_chikugai=True)
+    return [parse_batch(c, options) for c in iter_content_xmls([synthetic.nested_zip])]
+
+
+def _reset_peak_rss() -> None:
+    # Linux では VmHWM (最大RSS) をリセットできる
+    try:
+        Path("/proc/self/clear_refs").write_text("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb(who: int) -> float:
+    if who == resource.RUSAGE_SELF:
+        try:
+            for line in Path("/proc/self/status").read_text().splitlines():
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+    maxrss = resource.getrusage(who).ru_maxrss
+    # macOS ではバイト、Linux ではキロバイト単位
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+@pytest.fixture(autouse=True)
+def peak_rss(benchmark) -> Iterator[None]:
+    """Record the peak RSS during the benchmark
+
+    The peak of child processes is the highest among all the children that
+    have exited so far, as it cannot be reset.
+    """
+    _reset_peak_rss()
+    yield
+    benchmark.extra_info["peak_rss_mb"] = round(_peak_rss_mb(resource.RUSAGE_SELF), 1)
+    benchmark.extra_info["peak_rss_children_mb"] = round(
+        _peak_rss_mb(resource.RUSAGE_CHILDREN), 1
+    )
+
+
+@pytest.fixture
+def record_throughput(benchmark) -> Callable[[int, int], None]:
+    """Record features/s and MB/s from the mean time of the finished benchmark"""
+
+    def record(num_features: int, num_bytes: int) -> None:
+        if benchmark.disabled:
+            return
+        mean = benchmark.stats.stats.mean
+        benchmark.extra_info["features_per_s"] = round(num_features / mean, 1)
+        benchmark.extra_info["mb_per_s"] = round(num_bytes / mean / 1e6, 2)
+
+    return record
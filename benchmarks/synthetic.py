@@ -0,0 +1,316 @@
+"""Generate synthetic MOJ Map XML files for benchmarking
+
+The generated files follow the structure of the real data: points, curves
+and surfaces in 空間属性, then 基準点, 筆界点, 筆界線 and 筆 in 主題属性, and
+図郭 referring to their 筆. 筆 are laid out on a grid; each side of a 筆 is
+split into several curves, and some 筆 have an interior ring.
+
+Usage:
+    python -m benchmarks.synthetic OUTPUT_DIR --fude 10000 --files 8
+"""
+
+import io
+import random
+import zipfile
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Dict, List, Optional, TextIO, Tuple, Union
+
+import click
+
+_HEADER = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<地図 xmlns="http://www.moj.go.jp/MINJI/tizuxml" \
+xmlns:zmn="http://www.moj.go.jp/MINJI/tizuzumen" \
+xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" \
+xsi:schemaLocation="http://www.moj.go.jp/MINJI/tizuxml tizuxml.xsd">
+<version>ver1.0</version>
+<地図名>{map_name}</地図名>
+<市区町村コード>{city_code}</市区町村コード>
+<市区町村名>合成市</市区町村名>
+<座標系>{crs}</座標系>
+<測地系判別>測量</測地系判別>
+"""
+
+_CELL_SIZE = 10.0  # 筆の一辺 (m)
+_TILE_CELLS = 16  # 図郭の一辺に並ぶ筆の数
+
+
+@dataclass(frozen=True)
+class SyntheticSpec:
+    """Shape of a synthetic XML file"""
+
+    num_fude: int = 1000
+    # 筆の一辺を分割する曲線の数 (外周の頂点数は 4 * curves_per_side)
+    curves_per_side: int = 2
+    # 内周を持つ筆の割合
+    interior_ratio: float = 0.1
+    # 座標を直接持つ (点を参照しない) 曲線の割合
+    direct_ratio: float = 0.05
+    # 地番が「地区外」「別図」の筆の割合
+    chikugai_ratio: float = 0.01
+    crs: str = "公共座標9系"
+    city_code: str = "12103"
+    map_name: str = "synthetic"
+    seed: int = 0
+
+
+class _Writer:
+    def __init__(self, spec: SyntheticSpec) -> None:
+        self.spec = spec
+        self.rnd = random.Random(spec.seed)
+        self.points: List[Tuple[float, float]] = []  # (X: 北, Y: 東)
+        self.grid_points: Dict[Tuple[int, int], int] = {}
+        self.curves: List[Tuple[int, int]] = []
+        self.surfaces: List[List[List[int]]] = []
+        # ファイルごとに位置をずらす (平面直角座標系の原点付近)
+        self.origin = (
+            -42000.0 + self.rnd.uniform(-5000, 5000),
+            25000.0 + self.rnd.uniform(-5000, 5000),
+        )
+
+    def _grid_point(self, gx: int, gy: int) -> int:
+        key = (gx, gy)
+        index = self.grid_points.get(key)
+        if index is None:
+            step = _CELL_SIZE / self.spec.curves_per_side
+            jitter = step * 0.2
+            x = self.origin[0] + gy * step + self.rnd.uniform(-jitter, jitter)
+            y = self.origin[1] + gx * step + self.rnd.uniform(-jitter, jitter)
+            index = self.grid_points[key] = len(self.points)
+            self.points.append((round(x, 3), round(y, 3)))
+        return index
+
+    def _ring(self, point_indices: List[int]) -> List[int]:
+        curves: List[int] = []
+        for a, b in zip(point_indices, point_indices[1:] + point_indices[:1]):
+            curves.append(len(self.curves))
+            self.curves.append((a, b))
+        return curves
+
+    def build(self) -> Tuple[int, int]:
+        spec = self.spec
+        k = spec.curves_per_side
+        nx = max(1, int(spec.num_fude**0.5))
+        ny = -(-spec.num_fude // nx)
+        for n in range(spec.num_fude):
+            (i, j) = (n % nx, n // nx)
+            # 反時計回りに外周をたどる
+            boundary = (
+                [(i * k + s, j * k) for s in range(k)]
+                + [((i + 1) * k, j * k + s) for s in range(k)]
+                + [((i + 1) * k - s, (j + 1) * k) for s in range(k)]
+                + [(i * k, (j + 1) * k - s) for s in range(k)]
+            )
+            rings = [self._ring([self._grid_point(gx, gy) for gx, gy in boundary])]
+            if self.rnd.random() < spec.interior_ratio:
+                (x0, y0) = self.points[self._grid_point(i * k, j * k)]
+                hole = []
+                for dx, dy in ((3, 3), (3, 6), (6, 6), (6, 3)):
+                    hole.append(len(self.points))
+                    self.points.append((round(x0 + dx, 3), round(y0 + dy, 3)))
+                rings.append(self._ring(hole))
+            self.surfaces.append(rings)
+        return (nx, ny)
+
+    def write(self, out: TextIO) -> None:
+        spec = self.spec
+        (nx, ny) = self.build()
+        out.write(_HEADER.format(**vars(spec)))
+        out.write("<空間属性>\n")
+        for n, (x, y) in enumerate(self.points):
+            out.write(
+                f'<zmn:GM_Point id="P{n + 1:09d}"><zmn:GM_Point.position>'
+                f"<zmn:DirectPosition><zmn:X>{x:.3f}</zmn:X><zmn:Y>{y:.3f}</zmn:Y>"
+                "</zmn:DirectPosition></zmn:GM_Point.position></zmn:GM_Point>\n"
+            )
+        for n, (a, b) in enumerate(self.curves):
+            direct = self.rnd.random() < spec.direct_ratio
+            columns = "".join(self._column(p, direct) for p in (a, b))
+            out.write(
+                f'<zmn:GM_Curve id="C{n + 1:09d}">'
+                "<zmn:GM_OrientablePrimitive.orientation>+"
+                "</zmn:GM_OrientablePrimitive.orientation>"
+                f'<zmn:GM_OrientablePrimitive.primitive idref="C{n + 1:09d}"/>'
+                "<zmn:GM_Curve.segment><zmn:GM_LineString>"
+                f"<zmn:GM_LineString.controlPoint>{columns}"
+                "</zmn:GM_LineString.controlPoint>"
+                "</zmn:GM_LineString></zmn:GM_Curve.segment></zmn:GM_Curve>\n"
+            )
+        for n, rings in enumerate(self.surfaces):
+            boundaries = "".join(
+                f"<zmn:GM_SurfaceBoundary.{kind}><zmn:GM_Ring>"
+                + "".join(
+                    f'<zmn:GM_CompositeCurve.generator idref="C{c + 1:09d}"/>'
+                    for c in ring
+                )
+                + f"</zmn:GM_Ring></zmn:GM_SurfaceBoundary.{kind}>"
+                for kind, ring in zip(["exterior"] + ["interior"] * 3, rings)
+            )
+            out.write(
+                f'<zmn:GM_Surface id="F{n + 1:09d}"><zmn:GM_Surface.patch>'
+                "<zmn:GM_Polygon><zmn:GM_Polygon.boundary><zmn:GM_SurfaceBoundary>"
+                f"{boundaries}"
+                "</zmn:GM_SurfaceBoundary></zmn:GM_Polygon.boundary></zmn:GM_Polygon>"
+                "</zmn:GM_Surface.patch></zmn:GM_Surface>\n"
+            )
+        out.write("</空間属性>\n<主題属性>\n")
+        for n in range(0, len(self.points), 50):
+            out.write(
+                f"<基準点><名称>{n:06d}</名称>"
+                f'<形状 idref="P{n + 1:09d}"/>'
+                "<基準点種別>数値図根点（細部多角点）</基準点種別>"
+                "<埋標区分>埋標（その他）</埋標区分></基準点>\n"
+            )
+        for n in range(len(self.points)):
+            out.write(
+                f"<筆界点><点番名>{n + 1}</点番名>"
+                f'<形状 idref="P{n + 1:09d}"/></筆界点>\n'
+            )
+        for n in range(len(self.curves)):
+            out.write(
+                f'<筆界線><形状 idref="C{n + 1:09d}"/>'
+                "<線種別>筆界線</線種別></筆界線>\n"
+            )
+        for n in range(len(self.surfaces)):
+            out.write(self._fude(n))
+        out.write("</主題属性>\n")
+        self._write_zukaku(out, nx, ny)
+        out.write("</地図>\n")
+
+    def _column(self, point: int, direct: bool) -> str:
+        if direct:
+            (x, y) = self.points[point]
+            position = (
+                "<zmn:GM_Position.direct>"
+                f"<zmn:X>{x:.3f}</zmn:X><zmn:Y>{y:.3f}</zmn:Y>"
+                "</zmn:GM_Position.direct>"
+            )
+        else:
+            position = (
+                "<zmn:GM_Position.indirect>"
+                f'<zmn:GM_PointRef.point idref="P{point + 1:09d}"/>'
+                "</zmn:GM_Position.indirect>"
+            )
+        return f"<zmn:GM_PointArray.column>{position}</zmn:GM_PointArray.column>"
+
+    def _fude(self, n: int) -> str:
+        oaza = (n // 500) % 20 + 1
+        if self.rnd.random() < self.spec.chikugai_ratio:
+            chiban = self.rnd.choice(["地区外", "別図"])
+        else:
+            chiban = f"{n // 4 + 1}-{n % 4 + 1}"
+        return (
+            f'<筆 id="H{n + 1:09d}">'
+            f"<大字コード>{oaza:03d}</大字コード><丁目コード>000</丁目コード>"
+            "<小字コード>0000</小字コード><予備コード>00</予備コード>"
+            f"<大字名>合成町{oaza}</大字名><地番>{chiban}</地番>"
+            f'<形状 idref="F{n + 1:09d}"/>'
+            "<精度区分>甲一</精度区分><座標値種別>測量成果</座標値種別></筆>\n"
+        )
+
+    def _write_zukaku(self, out: TextIO, nx: int, ny: int) -> None:
+        size = _CELL_SIZE * _TILE_CELLS
+        for tj in range(0, ny, _TILE_CELLS):
+            for ti in range(0, nx, _TILE_CELLS):
+                x0 = self.origin[0] + tj * _CELL_SIZE
+                y0 = self.origin[1] + ti * _CELL_SIZE
+                corners = {
+                    "左下座標": (x0, y0),
+                    "左上座標": (x0 + size, y0),
+                    "右下座標": (x0, y0 + size),
+                    "右上座標": (x0 + size, y0 + size),
+                }
+                refs = "".join(
+                    f'<筆参照 idref="H{j * nx + i + 1:09d}"/>'
+                    for j in range(tj, min(tj + _TILE_CELLS, ny))
+                    for i in range(ti, min(ti + _TILE_CELLS, nx))
+                    if j * nx + i < self.spec.num_fude
+                )
+                out.write(
+                    f"<図郭><地図番号>S{tj:04d}-{ti:04d}</地図番号>"
+                    "<縮尺分母>500</縮尺分母><方位不明フラグ>false</方位不明フラグ>"
+                    + "".join(
+                        f"<{name}><zmn:X>{x:.3f}</zmn:X><zmn:Y>{y:.3f}</zmn:Y></{name}>"
+                        for name, (x, y) in corners.items()
+                    )
+                    + "<地図種類>法務局作成地図</地図種類>"
+                    "<地図分類>法第14条1項地図</地図分類>"
+                    "<地図材質>電磁的記録媒体</地図材質>"
+                    "<地図作成年月日><年>2021</年><月>1</月><日>15</日></地図作成年月日>"
+                    "<備付地図年月日><年>2021</年><月>3</月><日>12</日></備付地図年月日>"
+                    f"{refs}</図郭>\n"
+                )
+
+
+def generate_xml(spec: Optional[SyntheticSpec] = None) -> bytes:
+    """Generate the content of a synthetic XML file"""
+    out = io.StringIO()
+    _Writer(spec or SyntheticSpec()).write(out)
+    return out.getvalue().encode("utf-8")
+
+
+def write_xml(path: Union[str, Path], spec: Optional[SyntheticSpec] = None) -> None:
+    """Write a synthetic XML file"""
+    with open(path, "w", encoding="utf-8") as f:
+        _Writer(spec or SyntheticSpec()).write(f)
+
+
+def write_zip(
+    path: Union[str, Path],
+    num_files: int,
+    spec: Optional[SyntheticSpec] = None,
+) -> None:
+    """Write a distribution-like zip: an outer zip of zips each holding an XML
+
+    Each XML gets its own seed, so files differ in location and content.
+    """
+    spec = spec or SyntheticSpec()
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as outer:
+        for n in range(num_files):
+            name = f"{spec.city_code}-{n // 100:04d}-{n % 100 + 1}"
+            content = generate_xml(replace(spec, seed=spec.seed + n, map_name=name))
+            inner = io.BytesIO()
+            with zipfile.ZipFile(inner, "w", zipfile.ZIP_DEFLATED) as zf:
+                zf.writestr(name + ".xml", content)
+            outer.writestr(name + ".zip", inner.getvalue())
+
+
+@click.command()
+@click.argument("output_dir", type=click.Path(file_okay=False, path_type=Path))
+@click.option("--fude", default=1000, show_default=True, help="筆 per file")
+@click.option("--files", default=1, show_default=True, help="Number of files")
+@click.option("--curves-per-side", default=2, show_default=True)
+@click.option("--interior-ratio", default=0.1, show_default=True)
+@click.option("--crs", default="公共座標9系", show_default=True)
+@click.option("--zip", "as_zip", is_flag=True, help="Write a nested zip")
+@click.option("--seed", default=0, show_default=True)
+def main(
+    output_dir: Path,
+    fude: int,
+    files: int,
+    curves_per_side: int,
+    interior_ratio: float,
+    crs: str,
+    as_zip: bool,
+    seed: int,
+) -> None:
+    """Write synthetic MOJ Map XML files (or a nested zip) to OUTPUT_DIR"""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    spec = SyntheticSpec(
+        num_fude=fude,
+        curves_per_side=curves_per_side,
+        interior_ratio=interior_ratio,
+        crs=crs,
+        seed=seed,
+    )
+    if as_zip:
+        write_zip(output_dir / f"{spec.city_code}-synthetic.zip", files, spec)
+        return
+    for n in range(files):
+        name = f"{spec.city_code}-synthetic-{n + 1}.xml"
+        write_xml(output_dir / name, replace(spec, seed=seed + n, map_name=name))
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
@@ -0,0 +1,22 @@
+"""Benchmarks for the executors."""
+
+import pytest
+
+from mojxml.parse import ParseOptions
+from mojxml.process.executor import EXECUTOR_MAP
+from mojxml.reader import iter_content_sources
+
+
+@pytest.mark.parametrize("worker", list(EXECUTOR_MAP))
+def test_executor(benchmark, synthetic, record_throughput, worker):
+    """Parse every XML of a nested zip into batches."""
+    options = ParseOptions(include_chikugai=True)
+
+    def run():
+        executor = EXECUTOR_MAP[worker](options)
+        batches = executor.iter_batches(iter_content_sources([synthetic.nested_zip]))
+        return sum(len(batch) for batch in batches)
+
+    num_features = benchmark.pedantic(run, rounds=3, warmup_rounds=1)
+    assert num_features == synthetic.zip_features
+    record_throughput(num_features, synthetic.zip_xml_bytes)
@@ -0,0 +1,41 @@
+"""Benchmarks for parse.py and reader.py."""
+
+import pytest
+
+from mojxml.parse import ParseOptions, parse_raw
+from mojxml.reader import iter_content_xmls
+from mojxml.scan import scan_xml
+
+
+@pytest.mark.parametrize("size", ["small", "large"])
+def test_parse_raw(benchmark, synthetic, record_throughput, size):
+    """parse_raw() on a single XML file."""
+    path = getattr(synthetic, f"{size}_xml")
+    content = path.read_bytes()
+    options = ParseOptions(include_chikugai=True)
+
+    features = benchmark(parse_raw, content, options)
+    assert len(features) == getattr(synthetic, f"{size}_features")
+    record_throughput(len(features), len(content))
+
+
+def test_iter_content_xmls(benchmark, synthetic, record_throughput):
+    """Decompress every XML of a nested zip."""
+
+    def run():
+        return sum(len(c) for c in iter_content_xmls([synthetic.nested_zip]))
+
+    num_bytes = benchmark(run)
+    assert num_bytes == synthetic.zip_xml_bytes
+    record_throughput(synthetic.zip_features, num_bytes)
+
+
+@pytest.mark.parametrize("header_only", [False, True], ids=["full", "header"])
+def test_scan_xml(benchmark, synthetic, record_throughput, header_only):
+    """scan_xml() on a single XML file (no geometries are built)."""
+    content = synthetic.large_xml.read_bytes()
+
+    record = benchmark(scan_xml, content, header_only)
+    if not header_only:
+        assert record.num_fude == synthetic.large_features
+    record_throughput(synthetic.large_features, len(content))
@@ -0,0 +1,67 @@
+"""Benchmarks for the output writers."""
+
+import itertools
+
+import pytest
+
+from mojxml.process import WRITER_MAP
+
+_DRIVERS = {
+    "GeoJSON": ".geojson",
+    "GeoJSONSeq": ".geojsonl",
+    "GPKG": ".gpkg",
+    "FlatGeobuf": ".fgb",
+    "TopoJSON": ".topojson",
+    "MBTiles": ".mbtiles",
+}
+
+# 汎用の writer (OGR 経由) で計測する形式
+_OGR_DRIVERS = ["GeoJSON", "GeoJSONSeq", "GPKG", "FlatGeobuf"]
+
+# 特定の形式しか書き出せない writer
+_WRITER_DRIVERS = {
+    "geojsonseq": ["GeoJSONSeq"],
+    "topojson": ["TopoJSON"],
+    "tiles": ["MBTiles"],
+}
+
+_CASES = [
+    (writer, driver)
+    for writer in WRITER_MAP
+    for driver in _WRITER_DRIVERS.get(writer, _OGR_DRIVERS)
+]
+
+
+@pytest.mark.parametrize(("writer", "driver"), _CASES)
+def test_writer(
+    benchmark, synthetic, synthetic_batches, record_throughput, tmp_path, writer, driver
+):
+    """Write the parsed batches of a nested zip."""
+    if writer in ("arrow", "tiles"):
+        pytest.importorskip("pyarrow")
+        pytest.importorskip("pyogrio")
+    counter = itertools.count()
+
+    def run():
+        dst_path = tmp_path / f"output{next(counter)}{_DRIVERS[driver]}"
+        WRITER_MAP[writer](iter(synthetic_batches), dst_path, driver)
+        return dst_path
+
+    dst_path = benchmark.pedantic(run, rounds=3, warmup_rounds=1)
+    record_throughput(synthetic.zip_features, dst_path.stat().st_size)
+
+
+def test_geoparquet(
+    benchmark, synthetic, synthetic_batches, record_throughput, tmp_path
+):
+    """Write the parsed batches of a nested zip as GeoParquet."""
+    pytest.importorskip("pyarrow")
+    counter = itertools.count()
+
+    def run():
+        dst_path = tmp_path / f"output{next(counter)}.parquet"
+        WRITER_MAP["arrow"](iter(synthetic_batches), dst_path, None)
+        return dst_path
+
+    dst_path = benchmark.pedantic(run, rounds=3, warmup_rounds=1)
+    record_throughput(synthetic.zip_features, dst_path.stat().st_size)
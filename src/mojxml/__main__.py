@@ -1,18 +1,130 @@
 """Command line interface for mojxml"""
 
+import functools
 import logging
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 import click
 
 from .parse import ParseOptions
-from .process import files_to_ogr_file
-from .process.executor import EXECUTOR_MAP
+from .process import WRITER_MAP, files_to_ogr_file
+from .process.catalogue import files_to_catalogue
+from .process.executor import (
+    EXECUTOR_MAP,
+    START_METHODS,
+    BaseExecutor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    WorkerPoolExecutor,
+)
+from .process.geojsonseq import STDOUT
+from .process.hilbert import DEFAULT_MEMORY_BYTES, hilbert_sorted
+from .process.partition import (
+    PARTITION_KEYS,
+    UNMERGEABLE_WRITERS,
+    files_to_partitioned_output,
+)
+from .process.sharding import SHARD_KEYS, ShardSpec
+from .process.tiles import DEFAULT_MAX_ZOOM, DEFAULT_MIN_ZOOM, write_tiles
+from .process.writers import LAYER_WRITER_MAP, Writer
+from .schema import FUDE_LAYER, LAYERS
+from .stats import StatsCollector
+
+
+def _check_unsupported(option: str, others: Dict[str, bool]) -> None:
+    """Fail if any of the other options is given together with the option"""
+    for name, given in others.items():
+        if given:
+            raise click.BadParameter(f"not supported with {option}", param_hint=name)
+
+
+def _make_executor(
+    worker: str,
+    options: ParseOptions,
+    jobs: Optional[int] = None,
+    start_method: Optional[str] = None,
+    prefetch: Optional[int] = None,
+    ordered: bool = False,
+    profile_dir: Optional[Path] = None,
+    largest_first: bool = False,
+    split_bytes: Optional[int] = None,
+) -> BaseExecutor:
+    """Create the executor, passing the pool options only to worker pools"""
+    executor_cls = EXECUTOR_MAP[worker]
+    if profile_dir is not None and issubclass(executor_cls, ThreadPoolExecutor):
+        raise click.BadParameter(
+            "not supported with --worker thread", param_hint="--profile-dir"
+        )
+    if not issubclass(executor_cls, WorkerPoolExecutor):
+        return executor_cls(options, profile_dir=profile_dir)
+    pool_options: Dict[str, Any] = {
+        "max_workers": jobs,
+        "prefetch": prefetch,
+        "ordered": ordered,
+        "profile_dir": profile_dir,
+        "largest_first": largest_first,
+        "split_bytes": split_bytes,
+    }
+    if issubclass(executor_cls, ProcessPoolExecutor):
+        pool_options["start_method"] = start_method
+    elif start_method is not None:
+        raise click.BadParameter(
+            "only supported with --worker multiprocess", param_hint="--start-method"
+        )
+    return executor_cls(options, **pool_options)
+
+
+def _check_layers(layers: Sequence[str], writer: str, others: Dict[str, bool]) -> None:
+    """Fail if several layers are asked for with options not supporting them"""
+    if tuple(layers) == (FUDE_LAYER,):
+        return
+    if writer not in LAYER_WRITER_MAP:
+        raise click.BadParameter("not supported with --layer", param_hint="--writer")
+    _check_unsupported("--layer", others)
+
+
+def _parse_shard(shard: Optional[str], shard_by: str) -> Optional[ShardSpec]:
+    if shard is None:
+        return None
+    try:
+        return ShardSpec.parse(shard, shard_by)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--shard") from e
+
+
+def _resolve_writer(dst_file: Path, writer: str, partition_by: Optional[str]) -> str:
+    """Get the writer, which must be geojsonseq for stdout ("-")"""
+    if str(dst_file) != STDOUT:
+        return writer
+    _check_unsupported("DST_FILE -", {"--partition": partition_by is not None})
+    if writer not in ("fiona", "geojsonseq"):
+        raise click.BadParameter(
+            "only geojsonseq can write to stdout", param_hint="--writer"
+        )
+    return "geojsonseq"
+
+
+def _make_writer(
+    writer: str,
+    min_zoom: int,
+    max_zoom: int,
+    hilbert_sort: bool,
+    sort_memory: int,
+) -> Union[str, Writer]:
+    """Get the writer, wrapped to sort the features if asked"""
+    write: Union[str, Writer] = writer
+    if writer == "tiles":
+        write = functools.partial(write_tiles, min_zoom=min_zoom, max_zoom=max_zoom)
+    if hilbert_sort:
+        if isinstance(write, str):
+            write = WRITER_MAP[write]
+        write = hilbert_sorted(write, sort_memory * 1024 * 1024)
+    return write
 
 
 @click.command()
-@click.argument("dst_file", nargs=1, type=click.Path(dir_okay=False, path_type=Path))
+@click.argument("dst_file", nargs=1, type=click.Path(path_type=Path))
 @click.argument(
     "src_files",
     nargs=-1,
@@ -25,6 +137,159 @@ from .process.executor import EXECUTOR_MAP
     default="multiprocess",
     show_default=True,
 )
+@click.option(
+    "--layer",
+    "layers",
+    type=click.Choice(LAYERS),
+    multiple=True,
+    help="Layers to write, read in one pass (repeatable; default: 筆). "
+    "A .gpkg gets them all, other formats one file per layer "
+    "(DST_FILE for 筆, <stem>_<layer><suffix> for the others)",
+)
+@click.option(
+    "--writer",
+    type=click.Choice(list(WRITER_MAP.keys())),
+    default="fiona",
+    show_default=True,
+    help="Output writer (arrow: columnar, requires pyarrow/pyogrio; "
+    "geojsonseq: newline-delimited GeoJSON without OGR; "
+    "topojson: shared boundaries; tiles: .mbtiles/.pmtiles vector tiles)",
+)
+@click.option(
+    "--min-zoom",
+    type=click.IntRange(min=0, max=24),
+    default=DEFAULT_MIN_ZOOM,
+    show_default=True,
+    help="Minimum zoom level of vector tiles (--writer tiles)",
+)
+@click.option(
+    "--max-zoom",
+    type=click.IntRange(min=0, max=24),
+    default=DEFAULT_MAX_ZOOM,
+    show_default=True,
+    help="Maximum zoom level of vector tiles (--writer tiles)",
+)
+@click.option(
+    "--hilbert-sort",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Write the features in the order of a Hilbert curve, so that "
+    "spatial indexes and bbox queries touch fewer pages",
+)
+@click.option(
+    "--sort-memory",
+    type=click.IntRange(min=1),
+    default=DEFAULT_MEMORY_BYTES // (1024 * 1024),
+    show_default=True,
+    metavar="MB",
+    help="Features held in memory before spilling a sorted run to a temporary "
+    "file next to DST_FILE (--hilbert-sort)",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of workers (multiprocess/thread)",
+)
+@click.option(
+    "--start-method",
+    type=click.Choice(START_METHODS),
+    default=None,
+    help="How worker processes are started (default: that of the platform; "
+    "forkserver imports the modules once for all the workers)",
+)
+@click.option(
+    "--prefetch",
+    type=click.IntRange(min=0),
+    default=None,
+    help="Number of files read ahead of the workers",
+)
+@click.option(
+    "--ordered",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Write features in the order of the input files",
+)
+@click.option(
+    "--largest-first",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Process the largest files first, to shorten the tail of the run "
+    "(multiprocess/thread)",
+)
+@click.option(
+    "--split-size",
+    type=click.IntRange(min=1),
+    default=None,
+    metavar="MB",
+    help="Split XMLs larger than this into parts parsed by several workers "
+    "(multiprocess/thread)",
+)
+@click.option(
+    "--partition",
+    "partition_by",
+    type=click.Choice(PARTITION_KEYS),
+    default=None,
+    help="Let the workers write shards (per 市区町村コード or per group of "
+    "files) into the directory DST_FILE",
+)
+@click.option(
+    "--files-per-shard",
+    type=click.IntRange(min=1),
+    default=16,
+    show_default=True,
+    help="Number of files parsed and written together by a worker (--partition)",
+)
+@click.option(
+    "--merge",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Merge the shards into DST_FILE (--partition)",
+)
+@click.option(
+    "--shard",
+    default=None,
+    metavar="I/N",
+    help="Only convert the I-th of N deterministic shards of the XMLs "
+    "(to split a conversion across machines)",
+)
+@click.option(
+    "--shard-by",
+    type=click.Choice(SHARD_KEYS),
+    default="name",
+    show_default=True,
+    help="Assign the XMLs to shards by file name or by 市区町村コード (--shard)",
+)
+@click.option(
+    "--checkpoint",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="SQLite journal of the XMLs written, to resume an interrupted run "
+    "(--partition, or --writer geojsonseq to a file)",
+)
+@click.option(
+    "--manifest",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="SQLite manifest to skip zip members unchanged since the last run",
+)
+@click.option(
+    "--stats-json",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="Write per-stage timings and counters as JSON",
+)
+@click.option(
+    "--profile-dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Write a cProfile of each worker process (multiprocess/single)",
+)
 @click.option(
     "-a",
     "--arbitrary",
@@ -41,12 +306,76 @@ from .process.executor import EXECUTOR_MAP
     default=False,
     help="Include 地区外 and 別図",
 )
+@click.option(
+    "--city-code",
+    "city_codes",
+    multiple=True,
+    help="Only files of the 市区町村コード (repeatable)",
+)
+@click.option(
+    "--oaza-code",
+    "oaza_codes",
+    multiple=True,
+    help="Only 筆 of the 大字コード (repeatable)",
+)
+@click.option(
+    "--chiban",
+    "chiban_pattern",
+    default=None,
+    help="Only 筆 whose 地番 matches the regular expression",
+)
+@click.option(
+    "--bbox",
+    type=float,
+    nargs=4,
+    default=None,
+    metavar="MINX MINY MAXX MAXY",
+    help="Only 筆 intersecting the bounding box (longitude/latitude)",
+)
+@click.option(
+    "--bbox-source-crs",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Give --bbox in the coordinate system of each file",
+)
 def main(
-    dst_file: Path, src_files: List[Path], worker: str, arbitrary: bool, chikugai: bool
+    dst_file: Path,
+    src_files: List[Path],
+    worker: str,
+    layers: Tuple[str, ...],
+    writer: str,
+    min_zoom: int,
+    max_zoom: int,
+    hilbert_sort: bool,
+    sort_memory: int,
+    jobs: Optional[int],
+    start_method: Optional[str],
+    prefetch: Optional[int],
+    ordered: bool,
+    largest_first: bool,
+    split_size: Optional[int],
+    partition_by: Optional[str],
+    files_per_shard: int,
+    merge: bool,
+    shard: Optional[str],
+    shard_by: str,
+    checkpoint: Optional[Path],
+    manifest: Optional[Path],
+    stats_json: Optional[Path],
+    profile_dir: Optional[Path],
+    arbitrary: bool,
+    chikugai: bool,
+    city_codes: Tuple[str, ...],
+    oaza_codes: Tuple[str, ...],
+    chiban_pattern: Optional[str],
+    bbox: Optional[Tuple[float, float, float, float]],
+    bbox_source_crs: bool,
 ) -> None:
     """Convert MoJ XMLs to GeoJSON/GeoPackage/FlatGeobuf/etc.
 
-    DST_FILE: output filename (.geojson, .gpkg, .fgb, etc.)
+    DST_FILE: output filename (.geojson, .gpkg, .fgb, etc.), "-" for
+    GeoJSONSeq on stdout, or directory of shards with --partition
 
     SRC_FILES: one or more .xml/.zip files
     """
@@ -60,11 +389,155 @@ def main(
     options = ParseOptions(
         include_arbitrary_crs=arbitrary,
         include_chikugai=chikugai,
+        city_codes=city_codes or None,
+        oaza_codes=oaza_codes or None,
+        chiban_pattern=chiban_pattern,
+        bbox=bbox,
+        bbox_in_source_crs=bbox_source_crs,
+        layers=tuple(dict.fromkeys(layers)) or (FUDE_LAYER,),
+    )
+    writer = _resolve_writer(dst_file, writer, partition_by)
+    _check_layers(
+        options.layers,
+        writer,
+        {
+            "DST_FILE -": str(dst_file) == STDOUT,
+            "--partition": partition_by is not None,
+            "--manifest": manifest is not None,
+            "--checkpoint": checkpoint is not None,
+            "--split-size": split_size is not None,
+            "--hilbert-sort": hilbert_sort,
+        },
+    )
+    shard_spec = _parse_shard(shard, shard_by)
+    if checkpoint is not None:
+        _check_unsupported(
+            "--checkpoint",
+            {
+                "DST_FILE -": str(dst_file) == STDOUT,
+                "--manifest": manifest is not None,
+                "--writer": partition_by is None and writer != "geojsonseq",
+                "--hilbert-sort": hilbert_sort,
+            },
+        )
+    if partition_by is not None:
+        _check_unsupported(
+            "--partition",
+            {
+                "--manifest": manifest is not None,
+                "--writer tiles": writer == "tiles",
+                "--largest-first": largest_first,
+                "--split-size": split_size is not None,
+                "--hilbert-sort": hilbert_sort,
+            },
+        )
+        if merge and writer in UNMERGEABLE_WRITERS:
+            raise click.BadParameter(
+                f"shards of --writer {writer} cannot be merged", param_hint="--merge"
+            )
+    if ordered:
+        _check_unsupported("--ordered", {"--largest-first": largest_first})
+    if min_zoom > max_zoom:
+        raise click.BadParameter(
+            "must not be greater than --max-zoom", param_hint="--min-zoom"
+        )
+    executor = _make_executor(
+        worker,
+        options,
+        jobs,
+        start_method,
+        prefetch=prefetch,
+        ordered=ordered,
+        profile_dir=profile_dir,
+        largest_first=largest_first,
+        split_bytes=split_size * 1024 * 1024 if split_size is not None else None,
     )
-    executor = EXECUTOR_MAP[worker](options)
 
     # Process files
-    files_to_ogr_file(src_paths=src_files, dst_path=dst_file, executor=executor)
+    stats = StatsCollector() if stats_json is not None else None
+    with executor:
+        if partition_by is not None:
+            files_to_partitioned_output(
+                src_paths=src_files,
+                dst_path=dst_file,
+                executor=executor,
+                writer=writer,
+                partition_by=partition_by,
+                files_per_shard=files_per_shard,
+                merge=merge,
+                stats=stats,
+                shard=shard_spec,
+                checkpoint_path=checkpoint,
+            )
+        else:
+            files_to_ogr_file(
+                src_paths=src_files,
+                dst_path=dst_file,
+                executor=executor,
+                writer=_make_writer(
+                    writer, min_zoom, max_zoom, hilbert_sort, sort_memory
+                ),
+                manifest_path=manifest,
+                stats=stats,
+                shard=shard_spec,
+                checkpoint_path=checkpoint,
+            )
+    if stats is not None and stats_json is not None:
+        stats.write_json(stats_json)
+
+
+@click.command()
+@click.argument("dst_file", nargs=1, type=click.Path(dir_okay=False, path_type=Path))
+@click.argument(
+    "src_files",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+)
+@click.option(
+    "--worker",
+    type=click.Choice(list(EXECUTOR_MAP.keys())),
+    default="multiprocess",
+    show_default=True,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of workers (multiprocess/thread)",
+)
+@click.option(
+    "--header-only",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Only read the root-level fields (no counts nor extents)",
+)
+def scan(
+    dst_file: Path,
+    src_files: List[Path],
+    worker: str,
+    jobs: Optional[int],
+    header_only: bool,
+) -> None:
+    """Catalogue MoJ XMLs without parsing their geometries
+
+    DST_FILE: output filename (.csv or .parquet), one row per XML file with
+    its 地図名, 市区町村コード, 市区町村名, 座標系, 測地系判別, the numbers of 筆,
+    points, curves and surfaces, and the extent of its coordinates
+
+    SRC_FILES: one or more .xml/.zip files
+    """
+    root_logger = logging.getLogger()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    root_logger.addHandler(handler)
+    root_logger.setLevel(logging.INFO)
+
+    executor = _make_executor(worker, ParseOptions(), jobs)
+    with executor:
+        files_to_catalogue(src_files, dst_file, executor, header_only=header_only)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,405 @@
+"""Columnar representation of the features parsed from one XML file"""
+
+import struct
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple, TypedDict
+
+import numpy as np
+import numpy.typing as npt
+
+
+class Feature(TypedDict):
+    """GeoJSON-like feature representation"""
+
+    type: str
+    geometry: Optional[Dict[str, Any]]
+    properties: Dict[str, object]
+
+
+_MAGIC = b"MJFB"
+_VERSION = 2
+
+# magic, version, geometry type, (padding), n_fields, n_strings, n_features,
+# n_rings, n_vertices, n_field_bytes
+_HEADER = struct.Struct("<4sII4xIIIIII")
+
+# 地物のジオメトリの種類 (None: ジオメトリなし)
+GEOMETRY_TYPES = ("MultiPolygon", "LineString", "Point", None)
+
+# ヘッダーに書くジオメトリの種類の番号 (WKB の番号に合わせる)
+_GEOMETRY_CODES: Dict[Optional[str], int] = {
+    None: 0,
+    "Point": 1,
+    "LineString": 2,
+    "MultiPolygon": 6,
+}
+
+
+def _pack_strings(strings: Sequence[str]) -> Tuple[bytes, bytes]:
+    encoded = [s.encode("utf-8") for s in strings]
+    lengths = np.fromiter((len(b) for b in encoded), dtype=np.int32, count=len(encoded))
+    return (lengths.tobytes(), b"".join(encoded))
+
+
+def _unpack_strings(lengths: npt.NDArray[np.int32], data: memoryview) -> List[str]:
+    strings: List[str] = []
+    pos = 0
+    for length in lengths.tolist():
+        strings.append(str(data[pos : pos + length], "utf-8"))
+        pos += length
+    return strings
+
+
+def _concat_ranges(
+    starts: npt.NDArray[np.int64], stops: npt.NDArray[np.int64]
+) -> npt.NDArray[np.int64]:
+    """Concatenate arange(start, stop) of each pair without a Python loop"""
+    lengths = stops - starts
+    ends = np.cumsum(lengths)
+    total = int(ends[-1]) if len(ends) else 0
+    return np.repeat(starts - ends + lengths, lengths) + np.arange(
+        total, dtype=np.int64
+    )
+
+
+class FeatureBatch:
+    """Features of one XML file as packed columns
+
+    - Coordinates of all rings are packed in one float64 (n, 2) array.
+    - ``ring_offsets`` gives the vertex range of each ring, and
+      ``feature_offsets`` the ring range of each feature (exterior first).
+      A feature with no rings has no geometry.
+    - ``geometry_type`` tells how the rings are read: the rings of a polygon
+      ("MultiPolygon"), or a single ring holding the vertices of a
+      "LineString" or the one vertex of a "Point". It is None for tables
+      without geometry.
+    - Property values are indices into the string table ``strings``
+      (-1 for null), one row per feature and one column per field.
+
+    The batch is pickled as a single bytes blob, which is much cheaper to
+    transfer between processes than nested GeoJSON-like dicts.
+    """
+
+    def __init__(
+        self,
+        fields: Sequence[str],
+        strings: Sequence[str],
+        properties: npt.NDArray[np.int32],
+        coords: npt.NDArray[np.float64],
+        ring_offsets: npt.NDArray[np.int64],
+        feature_offsets: npt.NDArray[np.int64],
+        geometry_type: Optional[str] = "MultiPolygon",
+    ) -> None:
+        """Initialize"""
+        assert geometry_type in GEOMETRY_TYPES, f"Unknown geometry: {geometry_type}"
+        self.fields = list(fields)
+        self.strings = list(strings)
+        self.properties = properties
+        self.coords = coords
+        self.ring_offsets = ring_offsets
+        self.feature_offsets = feature_offsets
+        self.geometry_type = geometry_type
+
+    @classmethod
+    def empty(
+        cls, fields: Sequence[str], geometry_type: Optional[str] = "MultiPolygon"
+    ) -> "FeatureBatch":
+        """Create a batch with no features"""
+        return cls(
+            fields,
+            [],
+            np.empty((0, len(fields)), dtype=np.int32),
+            np.empty((0, 2), dtype=np.float64),
+            np.zeros(1, dtype=np.int64),
+            np.zeros(1, dtype=np.int64),
+            geometry_type,
+        )
+
+    def __len__(self) -> int:
+        """Number of features"""
+        return len(self.properties)
+
+    def __reduce__(self) -> Tuple[Any, Tuple[bytes]]:
+        """Pickle as a single bytes blob"""
+        return (FeatureBatch.from_bytes, (self.to_bytes(),))
+
+    def to_bytes(self) -> bytes:
+        """Serialize into a compact binary blob"""
+        (field_lengths, field_data) = _pack_strings(self.fields)
+        (string_lengths, string_data) = _pack_strings(self.strings)
+        header = _HEADER.pack(
+            _MAGIC,
+            _VERSION,
+            _GEOMETRY_CODES[self.geometry_type],
+            len(self.fields),
+            len(self.strings),
+            len(self),
+            len(self.ring_offsets) - 1,
+            len(self.coords),
+            len(field_data),
+        )
+        # 8バイト境界に揃うよう、大きい型の配列から順に並べる
+        return b"".join(
+            [
+                header,
+                np.ascontiguousarray(self.coords, dtype=np.float64).tobytes(),
+                np.ascontiguousarray(self.ring_offsets, dtype=np.int64).tobytes(),
+                np.ascontiguousarray(self.feature_offsets, dtype=np.int64).tobytes(),
+                np.ascontiguousarray(self.properties, dtype=np.int32).tobytes(),
+                field_lengths,
+                string_lengths,
+                field_data,
+                string_data,
+            ]
+        )
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> "FeatureBatch":
+        """Deserialize a blob made by to_bytes()"""
+        (
+            magic,
+            version,
+            geometry_code,
+            n_fields,
+            n_strings,
+            n_features,
+            n_rings,
+            n_vertices,
+            n_field_bytes,
+        ) = _HEADER.unpack_from(blob)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("Not a feature batch")
+
+        pos = _HEADER.size
+
+        def take(dtype: npt.DTypeLike, count: int) -> np.ndarray:
+            nonlocal pos
+            arr = np.frombuffer(blob, dtype=dtype, count=count, offset=pos)
+            pos += arr.nbytes
+            return arr
+
+        coords = take(np.float64, n_vertices * 2).reshape((n_vertices, 2))
+        ring_offsets = take(np.int64, n_rings + 1)
+        feature_offsets = take(np.int64, n_features + 1)
+        properties = take(np.int32, n_features * n_fields).reshape(
+            (n_features, n_fields)
+        )
+        field_lengths = take(np.int32, n_fields)
+        string_lengths = take(np.int32, n_strings)
+        data = memoryview(blob)
+        fields = _unpack_strings(field_lengths, data[pos : pos + n_field_bytes])
+        strings = _unpack_strings(string_lengths, data[pos + n_field_bytes :])
+        [geometry_type] = [
+            t for t, code in _GEOMETRY_CODES.items() if code == geometry_code
+        ]
+        return cls(
+            fields,
+            strings,
+            properties,
+            coords,
+            ring_offsets,
+            feature_offsets,
+            geometry_type,
+        )
+
+    def bounds(self) -> npt.NDArray[np.float64]:
+        """Get the (minx, miny, maxx, maxy) of each feature (NaN if no geometry)"""
+        starts = self.ring_offsets[self.feature_offsets[:-1]]
+        stops = self.ring_offsets[self.feature_offsets[1:]]
+        bounds = np.full((len(self), 4), np.nan)
+        has_geometry = stops > starts
+        if has_geometry.any():
+            # ジオメトリを持つ地物の頂点は隙間なく並んでいる
+            starts = starts[has_geometry]
+            for axis in (0, 1):
+                values = self.coords[:, axis]
+                bounds[has_geometry, axis] = np.minimum.reduceat(values, starts)
+                bounds[has_geometry, axis + 2] = np.maximum.reduceat(values, starts)
+        return bounds
+
+    def take(self, indices: npt.ArrayLike) -> "FeatureBatch":
+        """Get a batch of the selected features"""
+        indices = np.asarray(indices, dtype=np.int64)
+        (f0, f1) = (self.feature_offsets[indices], self.feature_offsets[indices + 1])
+        rings = _concat_ranges(f0, f1)
+        (r0, r1) = (self.ring_offsets[rings], self.ring_offsets[rings + 1])
+        ring_offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+        np.cumsum(r1 - r0, out=ring_offsets[1:])
+        feature_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(f1 - f0, out=feature_offsets[1:])
+        return FeatureBatch(
+            self.fields,
+            self.strings,
+            self.properties[indices],
+            self.coords[_concat_ranges(r0, r1)],
+            ring_offsets,
+            feature_offsets,
+            self.geometry_type,
+        )
+
+    @classmethod
+    def concat(cls, batches: Sequence["FeatureBatch"]) -> "FeatureBatch":
+        """Concatenate batches of the same fields and geometry type into one"""
+        assert batches, "No batches to concatenate"
+        (fields, geometry_type) = (batches[0].fields, batches[0].geometry_type)
+        assert all(b.fields == fields for b in batches), "Fields differ"
+        assert all(b.geometry_type == geometry_type for b in batches)
+        strings: List[str] = []
+        properties: List[npt.NDArray[np.int32]] = []
+        coords: List[npt.NDArray[np.float64]] = []
+        ring_offsets: List[npt.NDArray[np.int64]] = [np.zeros(1, dtype=np.int64)]
+        feature_offsets: List[npt.NDArray[np.int64]] = [np.zeros(1, dtype=np.int64)]
+        (num_vertices, num_rings) = (0, 0)
+        for b in batches:
+            # 文字列表を連結し、-1 (null) 以外の番号をずらす
+            properties.append(
+                np.where(b.properties >= 0, b.properties + len(strings), -1).astype(
+                    np.int32
+                )
+            )
+            strings.extend(b.strings)
+            coords.append(b.coords)
+            ring_offsets.append(b.ring_offsets[1:] + num_vertices)
+            feature_offsets.append(b.feature_offsets[1:] + num_rings)
+            num_vertices += len(b.coords)
+            num_rings += len(b.ring_offsets) - 1
+        return cls(
+            fields,
+            strings,
+            np.concatenate(properties).reshape(-1, len(fields)),
+            np.concatenate(coords).reshape(-1, 2),
+            np.concatenate(ring_offsets),
+            np.concatenate(feature_offsets),
+            geometry_type,
+        )
+
+    def compact(self) -> "FeatureBatch":
+        """Drop the strings no longer referenced (e.g. after take())"""
+        used = np.unique(self.properties[self.properties >= 0])
+        if len(used) == len(self.strings):
+            return self
+        properties = np.where(
+            self.properties >= 0, np.searchsorted(used, self.properties), -1
+        ).astype(np.int32)
+        strings = [self.strings[i] for i in used.tolist()]
+        return FeatureBatch(
+            self.fields,
+            strings,
+            properties,
+            self.coords,
+            self.ring_offsets,
+            self.feature_offsets,
+            self.geometry_type,
+        )
+
+    def property_dicts(self) -> List[Dict[str, object]]:
+        """Get the properties of each feature as dicts"""
+        strings: List[Optional[str]] = [*self.strings, None]  # -1 -> None
+        fields = self.fields
+        return [
+            dict(zip(fields, [strings[k] for k in row]))
+            for row in self.properties.tolist()
+        ]
+
+    def to_features(self) -> List[Feature]:
+        """Materialize GeoJSON-like features"""
+        xs = self.coords[:, 0].tolist()
+        ys = self.coords[:, 1].tolist()
+        ring_offsets = self.ring_offsets.tolist()
+        feature_offsets = self.feature_offsets.tolist()
+
+        features: List[Feature] = []
+        for i, properties in enumerate(self.property_dicts()):
+            (r0, r1) = (feature_offsets[i], feature_offsets[i + 1])
+            geometry: Optional[Dict[str, Any]] = None
+            if r1 > r0:
+                rings = [
+                    list(zip(xs[a:b], ys[a:b]))
+                    for (a, b) in zip(
+                        ring_offsets[r0:r1], ring_offsets[r0 + 1 : r1 + 1]
+                    )
+                ]
+                if self.geometry_type == "Point":
+                    geometry = {"type": "Point", "coordinates": rings[0][0]}
+                elif self.geometry_type == "LineString":
+                    geometry = {"type": "LineString", "coordinates": rings[0]}
+                else:
+                    geometry = {"type": "MultiPolygon", "coordinates": [rings]}
+            features.append(
+                {"type": "Feature", "geometry": geometry, "properties": properties}
+            )
+        return features
+
+
+class FeatureBatchBuilder:
+    """Accumulate features and build a FeatureBatch"""
+
+    def __init__(
+        self, fields: Sequence[str], geometry_type: Optional[str] = "MultiPolygon"
+    ) -> None:
+        """Initialize"""
+        self.fields = list(fields)
+        self.geometry_type = geometry_type
+        self._string_index: Dict[str, int] = {}
+        self._rows: List[List[int]] = []
+        self._vertex_indices: List[npt.NDArray[np.int64]] = []
+        self._ring_lengths: List[int] = []
+        self._feature_ring_counts: List[int] = []
+
+    def __len__(self) -> int:
+        """Number of features added so far"""
+        return len(self._rows)
+
+    def add(
+        self,
+        properties: Mapping[str, Optional[str]],
+        rings: Sequence[npt.NDArray[np.int64]],
+    ) -> None:
+        """Add a feature.
+
+        ``rings`` are closed rings given as indices into the coordinate arrays
+        passed to build() (one ring of vertices for lines and points, none for
+        features without geometry).
+        """
+        self.add_values([properties.get(f) for f in self.fields], rings)
+
+    def add_values(
+        self,
+        values: Sequence[Optional[str]],
+        rings: Sequence[npt.NDArray[np.int64]],
+    ) -> None:
+        """Add a feature from its property values, in the order of ``fields``"""
+        index = self._string_index
+        self._rows.append(
+            [-1 if v is None else index.setdefault(v, len(index)) for v in values]
+        )
+        self._vertex_indices.extend(rings)
+        self._ring_lengths.extend(len(ring) for ring in rings)
+        self._feature_ring_counts.append(len(rings))
+
+    def vertex_indices(self) -> npt.NDArray[np.int64]:
+        """Get the coordinate indices of all the rings added so far"""
+        if self._vertex_indices:
+            return np.concatenate(self._vertex_indices)
+        return np.empty(0, dtype=np.int64)
+
+    def build(
+        self, x: npt.NDArray[np.float64], y: npt.NDArray[np.float64]
+    ) -> FeatureBatch:
+        """Gather the coordinates and build the batch"""
+        if not self._rows:
+            return FeatureBatch.empty(self.fields, self.geometry_type)
+        indices = self.vertex_indices()
+        coords = np.column_stack((x[indices], y[indices]))
+        ring_offsets = np.zeros(len(self._ring_lengths) + 1, dtype=np.int64)
+        np.cumsum(self._ring_lengths, out=ring_offsets[1:])
+        feature_offsets = np.zeros(len(self._feature_ring_counts) + 1, dtype=np.int64)
+        np.cumsum(self._feature_ring_counts, out=feature_offsets[1:])
+        return FeatureBatch(
+            self.fields,
+            list(self._string_index),
+            np.array(self._rows, dtype=np.int32),
+            coords,
+            ring_offsets,
+            feature_offsets,
+            self.geometry_type,
+        )
@@ -0,0 +1,218 @@
+"""Two-tier cache of parse results for repeated library use
+
+Results are keyed by the hash of the XML content and the parse options. The
+memory tier keeps recently used batches up to a byte budget (LRU); the
+optional disk tier keeps their binary serialization (FeatureBatch.to_bytes)
+in a directory, evicting the least recently used files beyond its budget.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, List, Optional, Tuple, Union
+
+from .batch import Feature, FeatureBatch
+from .parse import ParseOptions, parse_batch
+
+_SUFFIX = ".mjfb"
+
+
+def _share(batch: FeatureBatch) -> FeatureBatch:
+    """Make the arrays of a batch read-only, to be shared by the cache hits"""
+    for a in (
+        batch.properties,
+        batch.coords,
+        batch.ring_offsets,
+        batch.feature_offsets,
+    ):
+        a.flags.writeable = False
+    return batch
+
+
+def _view(batch: FeatureBatch) -> FeatureBatch:
+    """Get a batch sharing the (read-only) arrays, with lists of its own"""
+    return FeatureBatch(
+        batch.fields,
+        batch.strings,
+        batch.properties,
+        batch.coords,
+        batch.ring_offsets,
+        batch.feature_offsets,
+        batch.geometry_type,
+    )
+
+
+@dataclass
+class CacheStats:
+    """Hit/miss counters of a ParseCache"""
+
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    memory_evictions: int = 0
+    disk_evictions: int = 0
+
+    @property
+    def hits(self) -> int:
+        """Number of hits in either tier"""
+        return self.memory_hits + self.disk_hits
+
+
+class ParseCache:
+    """Cache in front of parse_batch / parse_raw
+
+    Args:
+        memory_bytes: Budget of the in-memory tier (serialized size of the
+            batches). 0 disables the tier.
+        directory: Directory of the on-disk tier (disabled if None). It can be
+            shared by processes; files are written atomically.
+        disk_bytes: Budget of the on-disk tier.
+
+    The batches kept in memory are shared by every caller getting them: their
+    arrays are read-only (copy them to modify).
+    """
+
+    def __init__(
+        self,
+        memory_bytes: int = 256 * 1024 * 1024,
+        directory: Optional[Union[str, Path]] = None,
+        disk_bytes: int = 4 * 1024 * 1024 * 1024,
+    ) -> None:
+        """Initialize"""
+        self.memory_bytes = memory_bytes
+        self.directory = Path(directory) if directory is not None else None
+        self.disk_bytes = disk_bytes
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        # キー -> (バッチ, シリアライズしたサイズ)。末尾ほど最近使われたもの
+        self._memory: OrderedDict[str, Tuple[FeatureBatch, int]] = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = 0
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._disk_size = sum(
+                p.stat().st_size for p in self.directory.glob("*" + _SUFFIX)
+            )
+
+    @staticmethod
+    def key(content: bytes, options: ParseOptions) -> str:
+        """Get the cache key of an XML content parsed with the options"""
+        h = hashlib.sha256(content)
+        h.update(b"\0")
+        h.update(options.cache_key().encode("utf-8"))
+        return h.hexdigest()
+
+    def parse_batch(
+        self, content: Union[bytes, IO[bytes]], options: ParseOptions
+    ) -> FeatureBatch:
+        """Parse XML content into a batch, or get it from the cache"""
+        if not isinstance(content, bytes):
+            content = content.read()
+        key = self.key(content, options)
+        batch = self._get_memory(key)
+        if batch is not None:
+            return batch
+        blob = self._get_disk(key)
+        if blob is not None:
+            return self._put_memory(key, FeatureBatch.from_bytes(blob), len(blob))
+
+        with self._lock:
+            self.stats.misses += 1
+        batch = parse_batch(content, options)
+        blob = batch.to_bytes()
+        self._put_disk(key, blob)
+        return self._put_memory(key, batch, len(blob))
+
+    def parse_raw(
+        self, content: Union[bytes, IO[bytes]], options: ParseOptions
+    ) -> List[Feature]:
+        """Parse XML content into features, or get them from the cache"""
+        return self.parse_batch(content, options).to_features()
+
+    def clear(self) -> None:
+        """Remove every entry from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            if self.directory is not None:
+                for path in self.directory.glob("*" + _SUFFIX):
+                    path.unlink(missing_ok=True)
+                self._disk_size = 0
+
+    def _get_memory(self, key: str) -> Optional[FeatureBatch]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            self._memory.move_to_end(key)
+            self.stats.memory_hits += 1
+            return _view(entry[0])
+
+    def _put_memory(self, key: str, batch: FeatureBatch, size: int) -> FeatureBatch:
+        """Keep a batch in memory and get the batch to return to the caller"""
+        if size > self.memory_bytes:
+            return batch
+        with self._lock:
+            if key in self._memory:
+                return _view(self._memory[key][0])
+            self._memory[key] = (_share(batch), size)
+            self._memory_size += size
+            while self._memory_size > self.memory_bytes:
+                (_, (_, evicted_size)) = self._memory.popitem(last=False)
+                self._memory_size -= evicted_size
+                self.stats.memory_evictions += 1
+        return _view(batch)
+
+    def _disk_path(self, key: str) -> Path:
+        assert self.directory is not None
+        return self.directory / (key + _SUFFIX)
+
+    def _get_disk(self, key: str) -> Optional[bytes]:
+        if self.directory is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            blob = path.read_bytes()
+            # 最終アクセス時刻として更新時刻を使う
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self.stats.disk_hits += 1
+        return blob
+
+    def _put_disk(self, key: str, blob: bytes) -> None:
+        if self.directory is None or len(blob) > self.disk_bytes:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, self._disk_path(key))
+        with self._lock:
+            self._disk_size += len(blob)
+            if self._disk_size > self.disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        """Remove the least recently used files until within the budget"""
+        assert self.directory is not None
+        entries = []
+        for path in self.directory.glob("*" + _SUFFIX):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, path))
+        entries.sort()
+        # 他のプロセスと共有している場合もあるので、実際の合計から数え直す
+        self._disk_size = sum(size for (_, size, _) in entries)
+        for _, size, path in entries:
+            if self._disk_size <= self.disk_bytes:
+                break
+            path.unlink(missing_ok=True)
+            self._disk_size -= size
+            self.stats.disk_evictions += 1
@@ -1,250 +1,815 @@
 """Parse MOJ MAP XML files"""
 
-from dataclasses import dataclass
-from typing import Dict, List, Tuple, TypedDict
+import io
+import json
+import re
+from array import array
+from dataclasses import asdict, dataclass
+from typing import (
+    IO,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import lxml.etree as et
-import pyproj
+import numpy as np
+import numpy.typing as npt
 
+from .batch import Feature, FeatureBatch, FeatureBatchBuilder
 from .constants import CRS_MAP
 from .constants import XML_NAMESPACES as _NS
+from .schema import FUDE_LAYER, LAYER_SCHEMAS, LAYERS, geometry_type
+from .stats import FileStats
+from .tables import CoordinateTable, LineTable, SurfaceTable, truncate
+from .transform import get_transformer
 
 Point = Tuple[float, float]
 Curve = Tuple[float, float]
 Surface = List[List[List[Tuple[float, float]]]]
+BBox = Tuple[float, float, float, float]
+
+_TIZU = "{" + _NS[None] + "}"
+_ZMN = "{" + _NS["zmn"] + "}"
+
+_TAG_X = _ZMN + "X"
+_TAG_Y = _ZMN + "Y"
+TAG_POINT = _ZMN + "GM_Point"
+TAG_CURVE = _ZMN + "GM_Curve"
+TAG_SURFACE = _ZMN + "GM_Surface"
+_TAG_POSITION_DIRECT = _ZMN + "GM_Position.direct"
+_TAG_POSITION_INDIRECT = _ZMN + "GM_Position.indirect"
+_TAG_DIRECT_POSITION = _ZMN + "DirectPosition"
+_TAG_COLUMN = _ZMN + "GM_PointArray.column"
+_TAG_EXTERIOR = _ZMN + "GM_SurfaceBoundary.exterior"
+_TAG_INTERIOR = _ZMN + "GM_SurfaceBoundary.interior"
+_TAG_RING = _ZMN + "GM_Ring"
+_TAG_SHAPE = _TIZU + "形状"
+_TAG_CRS = _TIZU + "座標系"
+_TAG_CITY_CODE = _TIZU + "市区町村コード"
+_TAG_SPATIAL = _TIZU + "空間属性"
+_TAG_THEMATIC = _TIZU + "主題属性"
+TAG_FUDE = _TIZU + "筆"
+_TAG_BOUNDARY_POINT = _TIZU + "筆界点"
+_TAG_CONTROL_POINT = _TIZU + "基準点"
+_TAG_BOUNDARY_LINE = _TIZU + "筆界線"
+_TAG_ZUKAKU = _TIZU + "図郭"
+_TAG_FUDE_REF = _TIZU + "筆参照"
+
+# 図郭の四隅 (外周の順)
+_ZUKAKU_CORNERS = tuple(
+    _TIZU + name for name in ("左下座標", "右下座標", "右上座標", "左上座標")
+)
+# 図郭の年月日の要素
+_DATE_PARTS = tuple(_TIZU + name for name in ("年", "月", "日"))
+
+# ルート要素の直下にあり、すべての筆に付与する属性
+BASE_PROPERTY_TAGS = frozenset(
+    _TIZU + name
+    for name in ("地図名", "市区町村コード", "市区町村名", "座標系", "測地系判別")
+)
+
+# 筆のプロパティ (この順序で出力する)
+FUDE_FIELDS = (
+    "筆ID",
+    "精度区分",
+    "大字コード",
+    "丁目コード",
+    "小字コード",
+    "予備コード",
+    "大字名",
+    "丁目名",
+    "小字名",
+    "予備名",
+    "地番",
+    "座標値種別",
+    "筆界未定構成筆",
+    "地図名",
+    "市区町村コード",
+    "市区町村名",
+    "座標系",
+    "測地系判別",
+)
+
+# 筆の子要素・ルート要素直下の属性のタグから、レコードの位置への対応
+_FUDE_SLOTS: Dict[str, int] = {
+    _TIZU + name: i for i, name in enumerate(FUDE_FIELDS) if name != "筆ID"
+}
+_SLOT_FUDE_ID = FUDE_FIELDS.index("筆ID")
+_SLOT_OAZA_CODE = FUDE_FIELDS.index("大字コード")
+_SLOT_CHIBAN = FUDE_FIELDS.index("地番")
+
+# 筆以外のレイヤー
+_ZUKAKU_LAYER = "図郭"
+_LINE_LAYER = "筆界線"
+_POINT_LAYERS = ("筆界点", "基準点")
+_RELATION_LAYER = "筆図郭"
+
+# ストリーミング解析で終了イベントを受け取る要素
+# (読み捨てる要素も、メモリを解放するためにここに含める)
+STREAM_TAGS = (
+    *BASE_PROPERTY_TAGS,
+    TAG_POINT,
+    TAG_CURVE,
+    TAG_SURFACE,
+    _TAG_SPATIAL,
+    TAG_FUDE,
+    _TAG_CONTROL_POINT,
+    _TAG_BOUNDARY_POINT,
+    _TAG_BOUNDARY_LINE,
+    _TAG_ZUKAKU,
+)
 
 
 @dataclass
 class ParseOptions:
-    """Options for parsing XMLs"""
+    """Options for parsing XMLs
+
+    The filters are applied while parsing, so that files and 筆 that do not
+    match are skipped before their geometries are built and transformed.
+    """
 
     include_arbitrary_crs: bool = False
     include_chikugai: bool = False
-
-
-class Feature(TypedDict):
-    """GeoJSON-like feature representation"""
-
-    type: str
-    geometry: Dict[str, list]
-    properties: Dict[str, object]
-
-
-def _parse_base_properties(root: et._Element) -> Dict[str, object]:
-    crs_det_elem = root.find("./測地系判別", _NS)
-    return {
-        "地図名": root.find("./地図名", _NS).text,
-        "市区町村コード": root.find("./市区町村コード", _NS).text,
-        "市区町村名": root.find("./市区町村名", _NS).text,
-        "座標系": root.find("./座標系", _NS).text,
-        "測地系判別": crs_det_elem.text if crs_det_elem is not None else None,
-    }
-
-
-def _parse_points(spatial_elem: et._Element) -> Dict[str, Point]:
-    points: Dict[str, Point] = {}
-    for point in spatial_elem.iterfind("./zmn:GM_Point", _NS):
-        pos = point.find(".//zmn:DirectPosition", _NS)
-        x = None
-        y = None
-        for xy in pos:
-            if xy.tag == "{http://www.moj.go.jp/MINJI/tizuzumen}X":
-                x = float(xy.text)
-            elif xy.tag == "{http://www.moj.go.jp/MINJI/tizuzumen}Y":
-                y = float(xy.text)
-            else:
-                raise ValueError(f"Unknown tag: {xy.tag}")  # pragma: no cover
-        assert x is not None and y is not None
-        point_id = point.attrib["id"]
-        points[point_id] = (x, y)
-
-    return points
-
-
-def _parse_curves(
-    spatial_elem: et._Element, points: Dict[str, Point]
-) -> Dict[str, Curve]:
-    curves: Dict[str, Curve] = {}
-    for curve in spatial_elem.iterfind("./zmn:GM_Curve", _NS):
-        segments = curve.findall("./zmn:GM_Curve.segment", _NS)
-        assert len(segments) == 1
-        segment = segments[0]
-
-        columns = segment.findall(".//zmn:GM_PointArray.column", _NS)
-        assert len(columns) == 2
-        column = columns[0]
-        assert len(column) == 1
-        pos = column[0]
-        x = None
-        y = None
-        if pos.tag == "{http://www.moj.go.jp/MINJI/tizuzumen}GM_Position.indirect":
-            ref = pos[0]
-            idref = ref.attrib["idref"]
-            (x, y) = points[idref]
-        elif pos.tag == "{http://www.moj.go.jp/MINJI/tizuzumen}GM_Position.direct":
-            for xy in pos:
-                if xy.tag == "{http://www.moj.go.jp/MINJI/tizuzumen}X":
-                    x = float(xy.text)
-                elif xy.tag == "{http://www.moj.go.jp/MINJI/tizuzumen}Y":
-                    y = float(xy.text)
-                else:
-                    raise ValueError(f"Unknown tag: {xy.tag}")  # pragma: no cover
+    # 市区町村コードが一致するファイルのみ
+    city_codes: Optional[Sequence[str]] = None
+    # 大字コードが一致する筆のみ
+    oaza_codes: Optional[Sequence[str]] = None
+    # 地番が正規表現にマッチ (re.search) する筆のみ
+    chiban_pattern: Optional[str] = None
+    # 範囲 (minx, miny, maxx, maxy) と交差する筆のみ
+    # (経度・緯度、bbox_in_source_crs の場合はファイルの座標系の東西・南北)
+    bbox: Optional[BBox] = None
+    bbox_in_source_crs: bool = False
+    # 出力するレイヤー (parse_layers() で使う。schema.LAYERS のいずれか)
+    layers: Sequence[str] = (FUDE_LAYER,)
+
+    @property
+    def multi_layer(self) -> bool:
+        """Whether layers other than 筆 are asked for"""
+        return tuple(self.layers) != (FUDE_LAYER,)
+
+    def cache_key(self) -> str:
+        """Get a stable string identifying the options (for caches of results)"""
+        return json.dumps(asdict(self), sort_keys=True, ensure_ascii=False)
+
+
+def iter_elements(
+    source: Union[bytes, IO[bytes]], tags: Sequence[str] = STREAM_TAGS
+) -> Iterable[et._Element]:
+    """Iterate elements of interest as they are closed, freeing them afterwards.
+
+    The whole document tree is never built: each yielded element is cleared,
+    together with its already processed preceding siblings, once the caller
+    has finished with it.
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    for _, elem in et.iterparse(source, events=("end",), tag=tags):
+        yield elem
+        elem.clear(keep_tail=True)
+        parent = elem.getparent()
+        if parent is not None:
+            while elem.getprevious() is not None:
+                del parent[0]
+
+
+def field_name(tag: str) -> str:
+    """Get the name of a field (e.g. 地図名) from its tag"""
+    return tag[len(_TIZU) :]
+
+
+def iter_header(
+    source: Union[bytes, IO[bytes]],
+) -> Iterable[Tuple[str, Optional[str]]]:
+    """Iterate the root-level fields of an XML as (name, text)
+
+    Reading stops at the start of the first section (空間属性 or 主題属性),
+    so the geometries and the 筆 are never read, even if a field is missing.
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    tags = (*BASE_PROPERTY_TAGS, _TAG_SPATIAL, _TAG_THEMATIC)
+    for event, elem in et.iterparse(source, events=("start", "end"), tag=tags):
+        if elem.tag not in BASE_PROPERTY_TAGS:
+            return
+        if event == "end":
+            yield (field_name(elem.tag), elem.text)
+
+
+def _parse_position(pos: et._Element) -> Point:
+    x = None
+    y = None
+    for xy in pos:
+        if xy.tag == _TAG_X:
+            x = float(xy.text)
+        elif xy.tag == _TAG_Y:
+            y = float(xy.text)
         else:
-            raise ValueError(f"Unknown tag: {pos.tag}")  # pragma: no cover
-
-        curve_id = curve.attrib["id"]
-        assert x is not None and y is not None
-
-        curves[curve_id] = (y, x)
-
-    return curves
-
-
-def _parse_surfaces(
-    spatial_elem: et._Element, curves: Dict[str, Curve]
-) -> Dict[str, Surface]:
-    surfaces: Dict[str, Surface] = {}
-    for surface in spatial_elem.iterfind("./zmn:GM_Surface", _NS):
-        polygons = surface.findall("./zmn:GM_Surface.patch/zmn:GM_Polygon", _NS)
-        assert len(polygons) == 1
-        polygon = polygons[0]
-        surface_id = surface.attrib["id"]
-        rings: list[list[tuple[float, float]]] = []
-
-        exterior = polygon.find(".//zmn:GM_SurfaceBoundary.exterior", _NS)
-        ring: list[tuple[float, float]] = []
-        for cc in exterior.find(".//zmn:GM_Ring", _NS):
-            curve_id = cc.attrib["idref"]
-            assert curve_id in curves
-            ring.append(curves[curve_id])
-        ring.append(ring[0])
-        rings.append(ring)
-
-        for interior in polygon.iterfind(".//zmn:GM_SurfaceBoundary.interior", _NS):
-            ring: list[tuple[float, float]] = []
-            for cc in interior.find(".//zmn:GM_Ring", _NS):
-                curve_id = cc.attrib["idref"]
-                assert curve_id in curves
-                ring.append(curves[curve_id])
-            ring.append(ring[0])
-            rings.append(ring)
-
-        assert surface_id not in surfaces
-        surfaces[surface_id] = [rings]
-
-    return surfaces
-
-
-def _parse_features(
-    subject_elem: et._Element, surfaces: Dict[str, Surface], include_chikugai: bool
-) -> List[Feature]:
-    features = []
-    for fude in subject_elem.iterfind("./筆", _NS):
-        fude_id = fude.attrib["id"]
-        properties = {
-            "筆ID": fude_id,
-            "精度区分": None,
-            "大字コード": None,
-            "丁目コード": None,
-            "小字コード": None,
-            "予備コード": None,
-            "大字名": None,
-            "丁目名": None,
-            "小字名": None,
-            "予備名": None,
-            "地番": None,
-            "座標値種別": None,
-            "筆界未定構成筆": None,
-            "地図名": None,
-            "市区町村コード": None,
-            "市区町村名": None,
-            "座標系": None,
-            "測地系判別": None,
-        }
-        geometry = None
-        for entry in fude:
-            key = entry.tag.split("}")[1]
-            if key == "形状":
-                coordinates = surfaces[entry.attrib["idref"]]
-                geometry = {"type": "MultiPolygon", "coordinates": coordinates}
+            raise ValueError(f"Unknown tag: {xy.tag}")  # pragma: no cover
+    assert x is not None and y is not None
+    return (x, y)
+
+
+def parse_point(point: et._Element) -> Point:
+    """Get the position (north, east) of a point"""
+    pos = next(point.iter(_TAG_DIRECT_POSITION))
+    return _parse_position(pos)
+
+
+def parse_curve_start(curve: et._Element) -> Tuple[Optional[str], Optional[Point]]:
+    """Get the start of a curve as the ID of the point it references, or as
+    its own position (north, east)"""
+    pos = next(curve.iter(_TAG_COLUMN))[0]
+    if pos.tag == _TAG_POSITION_INDIRECT:
+        return (pos[0].attrib["idref"], None)
+    if pos.tag == _TAG_POSITION_DIRECT:
+        return (None, _parse_position(pos))
+    raise ValueError(f"Unknown tag: {pos.tag}")  # pragma: no cover
+
+
+def _resolve_position(pos: et._Element, points: CoordinateTable) -> Point:
+    if pos.tag == _TAG_POSITION_INDIRECT:
+        ref = pos[0]
+        idref = ref.attrib["idref"]
+        return points.get(idref)
+    if pos.tag == _TAG_POSITION_DIRECT:
+        return _parse_position(pos)
+    raise ValueError(f"Unknown tag: {pos.tag}")  # pragma: no cover
+
+
+def _parse_curve(curve: et._Element, points: CoordinateTable) -> Curve:
+    # 曲線の始点のみを使う
+    column = next(curve.iter(_TAG_COLUMN))
+    assert len(column) == 1
+    (x, y) = _resolve_position(column[0], points)
+    return (y, x)
+
+
+def _parse_curve_vertices(curve: et._Element, points: CoordinateTable) -> List[Point]:
+    """Get all the control points of a curve as (east, north)"""
+    vertices: List[Point] = []
+    for column in curve.iter(_TAG_COLUMN):
+        (x, y) = _resolve_position(column[0], points)
+        vertices.append((y, x))
+    return vertices
+
+
+def parse_surface(surface: et._Element) -> List[List[str]]:
+    """Get the rings of a surface as lists of curve IDs (exterior first)"""
+    # 外周は内周より前に現れる
+    return [
+        [cc.get("idref") for cc in next(boundary.iter(_TAG_RING))]
+        for boundary in surface.iter(_TAG_EXTERIOR, _TAG_INTERIOR)
+    ]
+
+
+def _intersects(a: BBox, b: BBox) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def _bbox_mask(batch: FeatureBatch, bbox: BBox) -> npt.NDArray[np.bool_]:
+    """Get which features of the batch intersect the bbox"""
+    b = batch.bounds()
+    keep = (b[:, 0] <= bbox[2]) & (bbox[0] <= b[:, 2])
+    keep &= (b[:, 1] <= bbox[3]) & (bbox[1] <= b[:, 3])
+    return keep
+
+
+def _parse_text(entry: et._Element) -> Optional[str]:
+    """Get the text of a field, or a date (年, 月, 日) as YYYY-MM-DD"""
+    if not len(entry):
+        return entry.text
+    parts = [entry.findtext(tag) for tag in _DATE_PARTS]
+    if any(part is None for part in parts):
+        return None
+    if all(part.isdigit() for part in parts if part is not None):
+        (year, month, day) = (int(part or 0) for part in parts)
+        return f"{year:04d}-{month:02d}-{day:02d}"
+    return "-".join(part or "" for part in parts)
+
+
+def _parse_zukaku(
+    elem: et._Element,
+) -> Tuple[Dict[str, Optional[str]], List[Point], List[str]]:
+    """Get the fields, the outline (east, north; closed) and the 筆 of a 図郭"""
+    texts: Dict[str, Optional[str]] = {}
+    corners: Dict[str, Point] = {}
+    fude_ids: List[str] = []
+    for entry in elem:
+        if entry.tag in _ZUKAKU_CORNERS:
+            (x, y) = _parse_position(entry)
+            corners[entry.tag] = (y, x)
+        elif entry.tag == _TAG_FUDE_REF:
+            fude_ids.append(entry.attrib["idref"])
+        else:
+            texts[entry.tag] = _parse_text(entry)
+    outline: List[Point] = []
+    if len(corners) == len(_ZUKAKU_CORNERS):
+        outline = [corners[tag] for tag in _ZUKAKU_CORNERS]
+        outline.append(outline[0])
+    return (texts, outline, fude_ids)
+
+
+def _transform_coords(
+    x: npt.NDArray[np.float64],
+    y: npt.NDArray[np.float64],
+    source_crs: Optional[str],
+) -> None:
+    """平面直角座標系を WGS84 に変換し、小数点以下9ケタに丸める (in place)"""
+    if source_crs is not None:
+        get_transformer(source_crs).transform(x, y, inplace=True)
+    truncate(x)
+    truncate(y)
+
+
+def _transform_curves(
+    curves: CoordinateTable,
+    source_crs: Optional[str],
+    indices: npt.NDArray[np.int64],
+) -> None:
+    """Transform the curves at ``indices`` (the ones referenced by features)"""
+    subset = len(indices) < len(curves)
+    if subset:
+        (x, y) = (curves.x[indices], curves.y[indices])
+    else:
+        (x, y) = (curves.x, curves.y)
+    _transform_coords(x, y, source_crs)
+    if subset:
+        curves.x[indices] = x
+        curves.y[indices] = y
+
+
+def parse_fude(
+    fude: et._Element, base_values: List[Optional[str]]
+) -> Tuple[List[Optional[str]], Optional[str]]:
+    """Get the property values (in FUDE_FIELDS order) and the surface ID of a 筆
+
+    The values start as a copy of ``base_values``, which holds the properties
+    given at the root of the file.
+    """
+    values = base_values.copy()
+    values[_SLOT_FUDE_ID] = fude.get("id")
+    surface_id = None
+    for entry in fude:
+        slot = _FUDE_SLOTS.get(entry.tag)
+        if slot is not None:
+            values[slot] = entry.text
+        elif entry.tag == _TAG_SHAPE:
+            surface_id = entry.get("idref")
+    return (values, surface_id)
+
+
+def base_values(header: Iterable[Tuple[str, Optional[str]]]) -> List[Optional[str]]:
+    """Get the property values given by the root-level fields (tag, text)
+
+    The result is the ``base_values`` of parse_fude().
+    """
+    values: List[Optional[str]] = [None] * len(FUDE_FIELDS)
+    for tag, text in header:
+        values[_FUDE_SLOTS[tag]] = text
+    return values
+
+
+def empty_layer(layer: str) -> FeatureBatch:
+    """Create a batch with no features for a layer"""
+    if layer == FUDE_LAYER:
+        return FeatureBatch.empty(FUDE_FIELDS)
+    fields = list(LAYER_SCHEMAS[layer]["properties"])
+    return FeatureBatch.empty(fields, geometry_type(layer))
+
+
+class _LayerBuilder:
+    """Features of a layer other than 筆, with coordinates of their own
+
+    The coordinates are kept in the coordinate system of the file (east,
+    north) until the layer is built.
+    """
+
+    def __init__(self, layer: str) -> None:
+        fields = list(LAYER_SCHEMAS[layer]["properties"])
+        self.slots = {_TIZU + name: i for i, name in enumerate(fields)}
+        # ルート要素にある属性のみを埋めたレコード
+        self.base_values: List[Optional[str]] = [None] * len(fields)
+        self.features = FeatureBatchBuilder(fields, geometry_type(layer))
+        self._xx = array("d")
+        self._yy = array("d")
+
+    def set_base_property(self, tag: str, text: Optional[str]) -> None:
+        slot = self.slots.get(tag)
+        if slot is not None:
+            self.base_values[slot] = text
+
+    def values(self, texts: Dict[str, Optional[str]]) -> List[Optional[str]]:
+        """Get the property values from the texts of the fields, by tag"""
+        values = self.base_values.copy()
+        for tag, text in texts.items():
+            slot = self.slots.get(tag)
+            if slot is not None:
+                values[slot] = text
+        return values
+
+    def parse(self, elem: et._Element) -> Tuple[List[Optional[str]], Optional[str]]:
+        """Get the property values and the shape ID of an element"""
+        shape_id = None
+        texts: Dict[str, Optional[str]] = {}
+        for entry in elem:
+            if entry.tag == _TAG_SHAPE:
+                shape_id = entry.get("idref")
             else:
-                value = entry.text
-                properties[key] = value
-
-        if not include_chikugai:
+                texts[entry.tag] = _parse_text(entry)
+        return (self.values(texts), shape_id)
+
+    def add(self, values: List[Optional[str]], vertices: Sequence[Point]) -> None:
+        start = len(self._xx)
+        for x, y in vertices:
+            self._xx.append(x)
+            self._yy.append(y)
+        rings = [np.arange(start, len(self._xx))] if vertices else []
+        self.features.add_values(values, rings)
+
+    def build(self) -> FeatureBatch:
+        x = np.array(self._xx, dtype=np.float64)
+        y = np.array(self._yy, dtype=np.float64)
+        return self.features.build(x, y)
+
+
+class _StreamParser:
+    """Build features from the elements of a MOJ XML as they are closed"""
+
+    def __init__(
+        self,
+        options: ParseOptions,
+        stats: FileStats,
+        layers: Sequence[str] = (FUDE_LAYER,),
+    ) -> None:
+        unknown = [name for name in layers if name not in LAYERS]
+        if unknown:
+            raise ValueError(f"Unknown layers: {', '.join(unknown)}")
+        self.options = options
+        self.stats = stats
+        self.layer_names = list(layers)
+        # 筆以外のレイヤー
+        self.layers = {
+            name: _LayerBuilder(name) for name in layers if name != FUDE_LAYER
+        }
+        # 筆界線の形状として、曲線の頂点をすべて残しておく
+        self.curve_vertices = LineTable() if _LINE_LAYER in self.layers else None
+        # 筆界点・基準点の形状として、点を最後まで残しておく
+        self._keep_points = any(name in self.layers for name in _POINT_LAYERS)
+        # 図郭が参照する (筆ID, 地図番号)
+        self._fude_refs: List[Tuple[str, Optional[str]]] = []
+        # ルート要素にある属性のみを埋めたレコード (各筆のレコードの元になる)
+        self.base_values: List[Optional[str]] = [None] * len(FUDE_FIELDS)
+        self.source_crs: Optional[str] = None
+        self.points = CoordinateTable()
+        self.curves = CoordinateTable()
+        self.surfaces = SurfaceTable()
+        self.features = FeatureBatchBuilder(FUDE_FIELDS)
+        self._chiban_pattern = (
+            re.compile(options.chiban_pattern) if options.chiban_pattern else None
+        )
+        # ファイルの座標系での範囲 (WGS84で指定された場合は座標系が分かってから求める)
+        self._bbox: Optional[BBox] = (
+            options.bbox if options.bbox_in_source_crs else None
+        )
+        self._extent_checked = False
+        self._handlers: Dict[str, Callable[[et._Element], bool]] = {
+            TAG_POINT: self._on_point,
+            TAG_CURVE: self._on_curve,
+            TAG_SURFACE: self._on_surface,
+            _TAG_SPATIAL: self._on_spatial,
+            TAG_FUDE: self._on_fude,
+        }
+        for name in _POINT_LAYERS:
+            if name in self.layers:
+                self._handlers[_TIZU + name] = self._on_point_feature
+        if _LINE_LAYER in self.layers:
+            self._handlers[_TAG_BOUNDARY_LINE] = self._on_line_feature
+        if _ZUKAKU_LAYER in self.layers or _RELATION_LAYER in self.layers:
+            self._handlers[_TAG_ZUKAKU] = self._on_zukaku
+
+    def handle(self, elem: et._Element) -> bool:
+        """Handle a closed element. Returns False if the file should be skipped."""
+        handler = self._handlers.get(elem.tag)
+        if handler is not None:
+            return handler(elem)
+        if elem.tag in BASE_PROPERTY_TAGS:
+            return self._on_base_property(elem)
+        return True
+
+    def _on_base_property(self, elem: et._Element) -> bool:
+        return self.set_base_property(elem.tag, elem.text)
+
+    def set_base_property(self, tag: str, text: Optional[str]) -> bool:
+        """Set a root-level property. Returns False if the file should be skipped."""
+        self.base_values[_FUDE_SLOTS[tag]] = text
+        for layer in self.layers.values():
+            layer.set_base_property(tag, text)
+        if tag == _TAG_CITY_CODE:
+            city_codes = self.options.city_codes
+            return city_codes is None or text in city_codes
+        if tag == _TAG_CRS:
+            # このファイルの座標参照系を取得する
+            assert text is not None
+            self.source_crs = CRS_MAP[text]
+            if (not self.options.include_arbitrary_crs) and self.source_crs is None:
+                return False
+            return self._on_source_crs()
+        return True
+
+    def _on_source_crs(self) -> bool:
+        bbox = self.options.bbox
+        if bbox is None or self.options.bbox_in_source_crs:
+            return True
+        if self.source_crs is None:
+            # 任意座標系のファイルは経度・緯度での位置が分からない
+            return False
+        from pyproj.enums import TransformDirection
+
+        # 経度・緯度の範囲を、それを含むファイルの座標系の範囲に変換しておく
+        self._bbox = get_transformer(self.source_crs).transform_bounds(
+            *bbox, direction=TransformDirection.INVERSE
+        )
+        return True
+
+    def _on_point(self, elem: et._Element) -> bool:
+        self.points.append(elem.attrib["id"], *parse_point(elem))
+        return True
+
+    def _on_curve(self, elem: et._Element) -> bool:
+        self.curves.append(elem.attrib["id"], *_parse_curve(elem, self.points))
+        if self.curve_vertices is not None:
+            self.curve_vertices.append(_parse_curve_vertices(elem, self.points))
+        return True
+
+    def _on_surface(self, elem: et._Element) -> bool:
+        if self._bbox is not None and not self._extent_checked:
+            # 面を組み立てる前に、曲線の範囲が指定範囲と重なるかを確かめる
+            self._extent_checked = True
+            extent = self.curves.bounds()
+            if extent is None or not _intersects(extent, self._bbox):
+                return False
+        curve_index = self.curves.index
+        rings = [
+            [curve_index[curve_id] for curve_id in curve_ids]
+            for curve_ids in parse_surface(elem)
+        ]
+        self.surfaces.append(elem.attrib["id"], rings)
+        return True
+
+    def _on_spatial(self, elem: et._Element) -> bool:
+        # 座標の変換は、残った筆が参照する曲線に対してのみ最後にまとめて行う
+        self.stats.points = len(self.points)
+        self.stats.curves = len(self.curves)
+        self.stats.surfaces = len(self.surfaces)
+        if not self._keep_points:
+            self.points = CoordinateTable()
+        self.curves.freeze()
+        self.surfaces.freeze()
+        return True
+
+    def _match_properties(self, values: List[Optional[str]]) -> bool:
+        chiban = values[_SLOT_CHIBAN] or ""
+        if not self.options.include_chikugai:
             # 地番が地区外や別図の場合はスキップする
-            chiban = properties.get("地番", "")
             if "地区外" in chiban or "別図" in chiban:
-                continue
-
-        features.append(
-            {"type": "Feature", "geometry": geometry, "properties": properties}
-        )
-
-    return features
-
-
-def parse_raw(content: bytes, options: ParseOptions) -> List[Feature]:
+                self.stats.skipped_chikugai += 1
+                return False
+        oaza_codes = self.options.oaza_codes
+        if oaza_codes is not None and values[_SLOT_OAZA_CODE] not in oaza_codes:
+            self.stats.filtered += 1
+            return False
+        if self._chiban_pattern is not None:
+            if self._chiban_pattern.search(chiban) is None:
+                self.stats.filtered += 1
+                return False
+        return True
+
+    def _match_rings(self, rings: List[npt.NDArray[np.int64]]) -> bool:
+        if self._bbox is None:
+            return True
+        if not rings:
+            return False
+        # 外周の範囲で判定する (座標はまだファイルの座標系のまま)
+        x = self.curves.x[rings[0]]
+        y = self.curves.y[rings[0]]
+        extent = (float(x.min()), float(y.min()), float(x.max()), float(y.max()))
+        return _intersects(extent, self._bbox)
+
+    def _on_fude(self, elem: et._Element) -> bool:
+        self.add_fude(*parse_fude(elem, self.base_values))
+        return True
+
+    def _on_point_feature(self, elem: et._Element) -> bool:
+        layer = self.layers[elem.tag[len(_TIZU) :]]
+        (values, shape_id) = layer.parse(elem)
+        vertices: List[Point] = []
+        if shape_id is not None:
+            (x, y) = self.points.get(shape_id)
+            vertices.append((y, x))
+        layer.add(values, vertices)
+        return True
+
+    def _on_line_feature(self, elem: et._Element) -> bool:
+        assert self.curve_vertices is not None
+        layer = self.layers[_LINE_LAYER]
+        (values, shape_id) = layer.parse(elem)
+        vertices: List[Point] = []
+        if shape_id is not None:
+            vertices = self.curve_vertices.vertices(self.curves.index[shape_id])
+        layer.add(values, vertices)
+        return True
+
+    def _on_zukaku(self, elem: et._Element) -> bool:
+        (texts, outline, fude_ids) = _parse_zukaku(elem)
+        zukaku = self.layers.get(_ZUKAKU_LAYER)
+        if zukaku is not None:
+            zukaku.add(zukaku.values(texts), outline)
+        if _RELATION_LAYER in self.layers:
+            map_number = texts.get(_TIZU + "地図番号")
+            self._fude_refs.extend((fude_id, map_number) for fude_id in fude_ids)
+        return True
+
+    def add_fude(
+        self, values: List[Optional[str]], surface: Union[str, int, None]
+    ) -> None:
+        """Add a 筆 from its property values and its surface (ID or index),
+        unless it is filtered out"""
+        if not self._match_properties(values):
+            return
+        rings: List[npt.NDArray[np.int64]] = []
+        if isinstance(surface, str):
+            rings = self.surfaces.rings(surface)
+        elif surface is not None:
+            rings = self.surfaces.rings_at(surface)
+        if not self._match_rings(rings):
+            self.stats.filtered += 1
+            return
+        self.features.add_values(values, rings)
+
+    def finish(self) -> FeatureBatch:
+        """Get the parsed features"""
+        # Note: 図郭の情報は筆には付与しない。
+        # デジタル庁の実装は筆に図郭の情報を付与しているものの、
+        # 筆に複数の図郭が結びつく場合に問題があるため、筆図郭レイヤーに分けている
+        with self.stats.timer("transform"):
+            used = np.zeros(len(self.curves), dtype=bool)
+            used[self.features.vertex_indices()] = True
+            _transform_curves(self.curves, self.source_crs, np.flatnonzero(used))
+
+        with self.stats.timer("build"):
+            batch = self.features.build(self.curves.x, self.curves.y)
+            bbox = self.options.bbox
+            if bbox is not None and not self.options.bbox_in_source_crs and len(batch):
+                # ファイルの座標系で大まかに絞り込んだものを、経度・緯度で厳密に判定する
+                keep = _bbox_mask(batch, bbox)
+                if not keep.all():
+                    self.stats.filtered += int((~keep).sum())
+                    batch = batch.take(np.flatnonzero(keep))
+        self.stats.features = len(batch)
+        return batch
+
+    def _add_relations(self, fude: FeatureBatch) -> None:
+        """Add the 筆図郭 rows of the 筆 kept in the output"""
+        relation = self.layers[_RELATION_LAYER]
+        strings = fude.strings
+        kept = {
+            strings[i] for i in fude.properties[:, _SLOT_FUDE_ID].tolist() if i >= 0
+        }
+        for fude_id, map_number in self._fude_refs:
+            if fude_id in kept:
+                texts = {_TIZU + "筆ID": fude_id, _TIZU + "地図番号": map_number}
+                relation.add(relation.values(texts), [])
+
+    def _build_layer(self, layer: _LayerBuilder) -> FeatureBatch:
+        """Build a layer, transforming and filtering it like the 筆"""
+        with self.stats.timer("build"):
+            batch = layer.build()
+        if batch.geometry_type is None or not len(batch):
+            return batch
+        if self._bbox is not None and self.options.bbox_in_source_crs:
+            batch = batch.take(np.flatnonzero(_bbox_mask(batch, self._bbox)))
+        with self.stats.timer("transform"):
+            (x, y) = (batch.coords[:, 0].copy(), batch.coords[:, 1].copy())
+            _transform_coords(x, y, self.source_crs)
+            batch.coords = np.column_stack((x, y))
+        bbox = self.options.bbox
+        if bbox is not None and not self.options.bbox_in_source_crs:
+            batch = batch.take(np.flatnonzero(_bbox_mask(batch, bbox)))
+        return batch.compact()
+
+    def finish_layers(self) -> Dict[str, FeatureBatch]:
+        """Get the parsed features of each layer"""
+        batches = {FUDE_LAYER: self.finish()}
+        if _RELATION_LAYER in self.layers:
+            self._add_relations(batches[FUDE_LAYER])
+        for name, layer in self.layers.items():
+            batches[name] = self._build_layer(layer)
+        return {name: batches[name] for name in self.layer_names}
+
+
+def _parse(parser: _StreamParser, content: Union[bytes, IO[bytes]]) -> bool:
+    """Feed the XML to the parser. Returns False if the file is skipped."""
+    stats = parser.stats
+    with stats.timer("parse"):
+        for elem in iter_elements(content):
+            if not parser.handle(elem):
+                stats.skipped = True
+                return False
+    return True
+
+
+def parse_batch(
+    content: Union[bytes, IO[bytes]],
+    options: ParseOptions,
+    stats: Optional[FileStats] = None,
+) -> FeatureBatch:
+    """Parse raw XML content into a columnar batch of features.
+
+    The XML is parsed in a streaming manner: elements are discarded as soon as
+    they are read, and only the array-backed point/curve/surface tables are kept
+    in memory.
+
+    If ``stats`` is given, the timings and counters of the parse are added to it.
+    """
+    if stats is None:
+        stats = FileStats()
+    parser = _StreamParser(options, stats)
+    if not _parse(parser, content):
+        return FeatureBatch.empty(FUDE_FIELDS)
+    return parser.finish()
+
+
+def match_header(
+    header: Iterable[Tuple[str, Optional[str]]], options: ParseOptions
+) -> bool:
+    """Whether an XML with the root-level fields (tag, text) is to be parsed"""
+    parser = _StreamParser(options, FileStats())
+    return all(parser.set_base_property(tag, text) for tag, text in header)
+
+
+def build_fude(
+    header: Iterable[Tuple[str, Optional[str]]],
+    curves: CoordinateTable,
+    surfaces: SurfaceTable,
+    fude: Iterable[Tuple[List[Optional[str]], Union[str, int, None]]],
+    options: ParseOptions,
+    stats: Optional[FileStats] = None,
+) -> FeatureBatch:
+    """Build the 筆 of an XML from its tables, parsed beforehand
+
+    ``header`` holds the root-level fields (tag, text), ``curves`` and
+    ``surfaces`` are frozen, and ``fude`` holds the property values and the
+    surface (ID, or index in ``surfaces``) of each 筆 (see parse_fude()).
+    The 筆 are filtered, transformed and built as parse_batch() does.
+    """
+    if stats is None:
+        stats = FileStats()
+    parser = _StreamParser(options, stats)
+    for tag, text in header:
+        if not parser.set_base_property(tag, text):
+            stats.skipped = True
+            return FeatureBatch.empty(FUDE_FIELDS)
+    parser.curves = curves
+    parser.surfaces = surfaces
+    for values, surface in fude:
+        parser.add_fude(values, surface)
+    return parser.finish()
+
+
+def parse_layers(
+    content: Union[bytes, IO[bytes]],
+    options: ParseOptions,
+    stats: Optional[FileStats] = None,
+) -> Dict[str, FeatureBatch]:
+    """Parse raw XML content into a batch for each layer of ``options.layers``
+
+    All the layers are read in the same pass over the XML. The filters of the
+    options select the 筆; the other layers are only filtered by ``bbox``,
+    and the 筆図郭 rows are those of the 筆 selected.
+    """
+    if stats is None:
+        stats = FileStats()
+    parser = _StreamParser(options, stats, options.layers)
+    if not _parse(parser, content):
+        return {name: empty_layer(name) for name in options.layers}
+    return parser.finish_layers()
+
+
+def parse_raw(content: Union[bytes, IO[bytes]], options: ParseOptions) -> List[Feature]:
     """Parse raw XML content and get a list of features."""
-    doc = et.fromstring(content, None)
-
-    # このファイルの座標参照系を取得する
-    source_crs = CRS_MAP[doc.find("./座標系", _NS).text]
-    if (not options.include_arbitrary_crs) and source_crs is None:
-        return []
-
-    spatial_elem = doc.find("./空間属性", _NS)
-    points = _parse_points(spatial_elem)
-    curves = _parse_curves(spatial_elem, points)
+    return parse_batch(content, options).to_features()
 
-    # 平面直角座標系を WGS84 に変換する
-    if source_crs is not None:
-        transformer = pyproj.Transformer.from_crs(
-            source_crs, "epsg:4326", always_xy=True
-        )
-        curve_ids: list[str] = []
-        xx: list[float] = []
-        yy: list[float] = []
-        for curve_id, (x, y) in curves.items():
-            curve_ids.append(curve_id)
-            xx.append(x)
-            yy.append(y)
-        (xx, yy) = transformer.transform(xx, yy)
-        for curve_id, x, y in zip(curve_ids, xx, yy):
-            curves[curve_id] = (x, y)
-
-    # 小数点以下9ケタに丸める
-    for curve_id, (x, y) in curves.items():
-        curves[curve_id] = (
-            int(x * 1000000000) / 1000000000,
-            int(y * 1000000000) / 1000000000,
-        )
 
-    surfaces = _parse_surfaces(spatial_elem, curves)
-
-    # Note: 図郭についてはひとまず扱わないことにする。
-    # デジタル庁の実装は筆に図郭の情報を付与しているのものの、
-    # これは筆に複数の図郭が結びつく場合に問題があるように思う
-    #
-    # fude_to_zukakus = {}
-    # for zk in doc.iterfind(".//図郭", _NS):
-    #     zukaku = {
-    #         "地図番号": zk.find("地図番号", _NS).text,
-    #         "縮尺分母": zk.find("縮尺分母", _NS).text,
-    #     }
-    #     for fude_ref in zk.iterfind("筆参照", _NS):
-    #         fude_id = fude_ref.get("idref")
-    #         assert fude_id not in fude_to_zukakus
-    #         fude_to_zukakus[fude_id] = zukaku
-
-    subject_elem = doc.find("./主題属性", _NS)
-    features = _parse_features(
-        subject_elem, surfaces, include_chikugai=options.include_chikugai
-    )
-
-    # XMLのルート要素にある属性情報をFeatureのプロパティに追加する
-    base_props = _parse_base_properties(doc)
-    for feature in features:
-        feature["properties"].update(base_props)
-
-    return features
+def parse_raw_layers(
+    content: Union[bytes, IO[bytes]], options: ParseOptions
+) -> Dict[str, List[Feature]]:
+    """Parse raw XML content and get the features of each layer of the options."""
+    batches = parse_layers(content, options)
+    return {name: batch.to_features() for name, batch in batches.items()}
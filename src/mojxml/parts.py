@@ -0,0 +1,374 @@
+"""Parse one large XML file in parts on several workers
+
+A MOJ XML holds its geometries (空間属性) and 筆 (主題属性) as long flat lists
+of top-level elements. split_xml() cuts each of the two sections into byte
+ranges at element boundaries. Each part is made a well-formed document of its
+own (the root element and root-level fields, one section, and the range of
+elements), so it can be parsed independently.
+
+The parts of the 空間属性 are parsed by parse_part() into arrays, with the
+references (curves to points, surfaces to curves) left as ids. merge_parts()
+resolves them and saves the tables into a file, which the workers
+memory-map to parse and build the 筆 of the parts of the 主題属性 with
+build_part(). concat_parts() joins their batches into the same batch as
+parse_batch() on the whole XML.
+"""
+
+import mmap
+import re
+from array import array
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import numpy.typing as npt
+
+from .batch import FeatureBatch
+from .constants import XML_NAMESPACES as _NS
+from .parse import (
+    BASE_PROPERTY_TAGS,
+    TAG_CURVE,
+    TAG_FUDE,
+    TAG_POINT,
+    TAG_SURFACE,
+    ParseOptions,
+    base_values,
+    build_fude,
+    iter_elements,
+    parse_curve_start,
+    parse_fude,
+    parse_point,
+    parse_surface,
+)
+from .stats import FileStats
+from .tables import CoordinateTable, SurfaceTable
+
+_SPATIAL = "空間属性".encode()
+_THEMATIC = "主題属性".encode()
+_ROOT_END = "</地図>".encode()
+
+# 各セクションの直下の要素の開始タグ ({zmn} は zmn 名前空間の接頭辞)
+_ELEMENT_STARTS = {
+    _SPATIAL: rb"<{zmn}:GM_(?:Point|Curve|Surface)[\s>/]",
+    _THEMATIC: "<(?:筆|筆界点|筆界線|基準点|図郭)[\\s>/]".encode(),
+}
+
+
+class PartRange(NamedTuple):
+    """Byte range of the top-level elements of a section, forming one part"""
+
+    section: bytes
+    start: int
+    end: int
+
+
+@dataclass
+class PartialParse:
+    """Geometries of a part of the 空間属性, with references left as ids
+
+    Curves that reference a point have NaN coordinates and the point id in
+    ``curve_refs`` ("" for the others, which have their own coordinates, east
+    and north). The rings of the surfaces are given as curve ids, flattened
+    with offsets as in SurfaceTable.
+    """
+
+    header: List[Tuple[str, Optional[str]]]
+    point_ids: npt.NDArray[np.str_]
+    point_xy: npt.NDArray[np.float64]
+    curve_ids: npt.NDArray[np.str_]
+    curve_xy: npt.NDArray[np.float64]
+    curve_refs: npt.NDArray[np.str_]
+    surface_ids: npt.NDArray[np.str_]
+    ring_curves: npt.NDArray[np.str_]
+    ring_offsets: npt.NDArray[np.int64]
+    surface_offsets: npt.NDArray[np.int64]
+
+
+class SharedTables(NamedTuple):
+    """Resolved tables of a split XML, saved into a file for the workers
+
+    ``layout`` gives the dtype, shape and offset of each array in the file.
+    """
+
+    path: Path
+    layout: Dict[str, Tuple[str, Tuple[int, ...], int]]
+
+    @classmethod
+    def save(cls, path: Path, arrays: Dict[str, np.ndarray]) -> "SharedTables":
+        """Write the arrays into the file"""
+        layout: Dict[str, Tuple[str, Tuple[int, ...], int]] = {}
+        with open(path, "wb") as f:
+            for name, a in arrays.items():
+                # 配列の先頭を8バイト境界にそろえる
+                f.write(b"\0" * (-f.tell() % 8))
+                layout[name] = (a.dtype.str, a.shape, f.tell())
+                f.write(np.ascontiguousarray(a).tobytes())
+        return cls(path, layout)
+
+    def load(self) -> Dict[str, np.ndarray]:
+        """Memory-map the arrays (copy-on-write: changes stay in the process)"""
+        arrays: Dict[str, np.ndarray] = {}
+        for name, (dtype, shape, offset) in self.layout.items():
+            if 0 in shape:
+                # 大きさ0の配列はメモリマップできない
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(
+                    self.path, dtype=dtype, mode="c", offset=offset, shape=shape
+                )
+        return arrays
+
+
+def split_xml(
+    content: Union[bytes, mmap.mmap], part_bytes: int
+) -> Optional[Tuple[int, List[PartRange]]]:
+    """Cut the sections of an XML into ranges of about ``part_bytes`` bytes
+
+    Returns the end of the prologue (the root element and the root-level
+    fields, which every part repeats) and the ranges, or None if the layout
+    of the document is not recognized, in which case it must be parsed whole.
+    """
+    view = memoryview(content)
+    m = re.search(rb'xmlns:([\w.-]+)="' + re.escape(_NS["zmn"].encode()) + b'"', view)
+    if m is None:
+        return None
+    zmn = m.group(1)
+    sections: List[Tuple[bytes, int, int]] = []
+    pos = 0
+    for name in (_SPATIAL, _THEMATIC):
+        open_tag = b"<" + name + b">"
+        start = _find(view, open_tag, pos)
+        end = _find(view, b"</" + name + b">", start)
+        if start < 0 or end < 0:
+            return None
+        sections.append((name, start + len(open_tag), end))
+        pos = end
+    prologue_end = sections[0][1] - len(b"<" + _SPATIAL + b">")
+
+    ranges: List[PartRange] = []
+    for name, start, end in sections:
+        pattern = re.compile(_ELEMENT_STARTS[name].replace(b"{zmn}", zmn))
+        num_parts = max(1, round((end - start) / part_bytes))
+        cuts = [start]
+        for i in range(1, num_parts):
+            target = start + (end - start) * i // num_parts
+            m = pattern.search(view, max(target, cuts[-1] + 1), end)
+            if m is None:
+                break
+            cuts.append(m.start())
+        cuts.append(end)
+        ranges.extend(PartRange(name, a, b) for a, b in zip(cuts, cuts[1:]))
+    return (prologue_end, ranges)
+
+
+def _find(view: memoryview, sub: bytes, start: int) -> int:
+    m = re.compile(re.escape(sub)).search(view, start)
+    return -1 if m is None else m.start()
+
+
+def part_content(
+    content: Union[bytes, mmap.mmap], prologue_end: int, part: PartRange
+) -> bytes:
+    """Get a part as a well-formed document"""
+    view = memoryview(content)
+    return b"".join(
+        (
+            view[:prologue_end],
+            b"<" + part.section + b">",
+            view[part.start : part.end],
+            b"</" + part.section + b">",
+            _ROOT_END,
+        )
+    )
+
+
+def _strings(values: List[str]) -> npt.NDArray[np.str_]:
+    return np.array(values, dtype=np.str_)
+
+
+def parse_part(
+    content: Union[bytes, IO[bytes]], stats: Optional[FileStats] = None
+) -> PartialParse:
+    """Parse a part of the 空間属性 (see split_xml) without resolving references"""
+    if stats is None:
+        stats = FileStats()
+    header: List[Tuple[str, Optional[str]]] = []
+    point_ids: List[str] = []
+    curve_ids: List[str] = []
+    curve_refs: List[str] = []
+    surface_ids: List[str] = []
+    ring_curves: List[str] = []
+    (point_xy, curve_xy) = (array("d"), array("d"))
+    (ring_offsets, surface_offsets) = (array("q", [0]), array("q", [0]))
+    with stats.timer("parse"):
+        for elem in iter_elements(content):
+            tag = elem.tag
+            if tag == TAG_POINT:
+                point_ids.append(elem.attrib["id"])
+                point_xy.extend(parse_point(elem))
+            elif tag == TAG_CURVE:
+                (ref, position) = parse_curve_start(elem)
+                curve_ids.append(elem.attrib["id"])
+                curve_refs.append(ref or "")
+                # 点は (北, 東)、曲線は (東, 北)
+                curve_xy.extend(
+                    (np.nan, np.nan) if position is None else position[::-1]
+                )
+            elif tag == TAG_SURFACE:
+                surface_ids.append(elem.attrib["id"])
+                for ring in parse_surface(elem):
+                    ring_curves.extend(ring)
+                    ring_offsets.append(len(ring_curves))
+                surface_offsets.append(len(ring_offsets) - 1)
+            elif tag in BASE_PROPERTY_TAGS:
+                header.append((tag, elem.text))
+    return PartialParse(
+        header,
+        _strings(point_ids),
+        np.frombuffer(point_xy, dtype=np.float64).reshape(-1, 2),
+        _strings(curve_ids),
+        np.frombuffer(curve_xy, dtype=np.float64).reshape(-1, 2),
+        _strings(curve_refs),
+        _strings(surface_ids),
+        _strings(ring_curves),
+        np.frombuffer(ring_offsets, dtype=np.int64),
+        np.frombuffer(surface_offsets, dtype=np.int64),
+    )
+
+
+def _lookup(
+    sorted_ids: npt.NDArray[np.str_],
+    order: npt.NDArray[np.int64],
+    keys: npt.NDArray[np.str_],
+) -> npt.NDArray[np.int64]:
+    """Get the indices of ``keys`` among ids (``order`` sorts the ids)
+
+    Raises KeyError for a key that is not found.
+    """
+    if not len(keys):
+        return np.empty(0, dtype=np.int64)
+    if not len(sorted_ids):
+        raise KeyError(str(keys[0]))
+    pos = np.searchsorted(sorted_ids, keys)
+    pos[pos == len(sorted_ids)] = 0
+    missing = sorted_ids[pos] != keys
+    if missing.any():
+        raise KeyError(str(keys[missing][0]))
+    return order[pos]
+
+
+def _sorted_ids(
+    ids: npt.NDArray[np.str_],
+) -> Tuple[npt.NDArray[np.str_], npt.NDArray[np.int64]]:
+    order = np.argsort(ids, kind="stable")
+    return (ids[order], order)
+
+
+def _concat_offsets(offsets: Sequence[npt.NDArray[np.int64]]) -> npt.NDArray[np.int64]:
+    """Join the offsets (each starting at 0) of consecutive parts"""
+    joined = [np.zeros(1, dtype=np.int64)]
+    total = 0
+    for o in offsets:
+        joined.append(o[1:] + total)
+        total += int(o[-1])
+    return np.concatenate(joined)
+
+
+def merge_parts(
+    parts: Sequence[PartialParse], path: Path, stats: Optional[FileStats] = None
+) -> SharedTables:
+    """Resolve the references between the parts of the 空間属性
+
+    The curves (east, north) and surfaces are saved into ``path``, to be
+    memory-mapped by build_part().
+    """
+    if stats is None:
+        stats = FileStats()
+    with stats.timer("build"):
+        point_xy = np.concatenate([p.point_xy for p in parts])
+        curve_xy = np.concatenate([p.curve_xy for p in parts])
+        refs = np.concatenate([p.curve_refs for p in parts])
+        indirect = np.flatnonzero(refs != "")
+        if len(indirect):
+            point_ids = np.concatenate([p.point_ids for p in parts])
+            points = _lookup(*_sorted_ids(point_ids), refs[indirect])
+            curve_xy[indirect] = point_xy[points][:, ::-1]
+        curve_ids = np.concatenate([p.curve_ids for p in parts])
+        ring_curves = np.concatenate([p.ring_curves for p in parts])
+        curve_indices = _lookup(*_sorted_ids(curve_ids), ring_curves)
+        (surface_ids, surface_order) = _sorted_ids(
+            np.concatenate([p.surface_ids for p in parts])
+        )
+        arrays = {
+            "x": curve_xy[:, 0],
+            "y": curve_xy[:, 1],
+            "curve_indices": curve_indices,
+            "ring_offsets": _concat_offsets([p.ring_offsets for p in parts]),
+            "surface_offsets": _concat_offsets([p.surface_offsets for p in parts]),
+            "surface_order": surface_order,
+            "surface_ids": surface_ids,
+        }
+        stats.points = len(point_xy)
+        stats.curves = len(curve_xy)
+        stats.surfaces = len(surface_ids)
+        return SharedTables.save(path, arrays)
+
+
+def build_part(
+    content: Union[bytes, IO[bytes]],
+    tables: SharedTables,
+    options: ParseOptions,
+    stats: Optional[FileStats] = None,
+) -> FeatureBatch:
+    """Parse the 筆 of a part of the 主題属性 and build them with the tables"""
+    if stats is None:
+        stats = FileStats()
+    arrays = tables.load()
+    header: List[Tuple[str, Optional[str]]] = []
+    fude: List[Tuple[List[Optional[str]], Optional[str]]] = []
+    with stats.timer("parse"):
+        base = base_values(header)
+        for elem in iter_elements(content):
+            if elem.tag == TAG_FUDE:
+                fude.append(parse_fude(elem, base))
+            elif elem.tag in BASE_PROPERTY_TAGS:
+                header.append((elem.tag, elem.text))
+                base = base_values(header)
+        # 面のIDを、共有する表での番号にする
+        surface_ids = _strings([id_ for _, id_ in fude if id_ is not None])
+        indices = iter(
+            _lookup(
+                arrays["surface_ids"], arrays["surface_order"], surface_ids
+            ).tolist()
+        )
+        resolved = [
+            (values, None if id_ is None else next(indices)) for values, id_ in fude
+        ]
+    curves = CoordinateTable.from_arrays([], arrays["x"], arrays["y"])
+    surfaces = SurfaceTable.from_arrays(
+        arrays["curve_indices"], arrays["ring_offsets"], arrays["surface_offsets"]
+    )
+    return build_fude(header, curves, surfaces, resolved, options, stats)
+
+
+def concat_parts(batches: Sequence[FeatureBatch]) -> FeatureBatch:
+    """Join the batches of the parts of the 主題属性, in order
+
+    The strings are shared again, in the same order as parse_batch() would
+    have them.
+    """
+    batch = FeatureBatch.concat(batches)
+    index: Dict[str, int] = {}
+    # 末尾の -1 は null (-1) をそのまま残すため
+    codes = [index.setdefault(s, len(index)) for s in batch.strings]
+    codes.append(-1)
+    return FeatureBatch(
+        batch.fields,
+        list(index),
+        np.array(codes, dtype=np.int32)[batch.properties],
+        batch.coords,
+        batch.ring_offsets,
+        batch.feature_offsets,
+        batch.geometry_type,
+    )
@@ -1,43 +1,49 @@
 """Convert .xml/.zip files to OGR format."""
 
 import logging
+import time
+from contextlib import ExitStack
 from pathlib import Path
-from typing import Iterable, List, Optional, Tuple
+from typing import Iterable, List, Optional, Union
 
-try:
-    import fiona
-except ImportError:  # pragma: no cover
-    fiona = None  # pragma: no cover
-
-from ..parse import Feature
-from ..reader import iter_content_xmls
-from ..schema import OGR_SCHEMA
-from .executor import BaseExecutor
+from ..batch import Feature, FeatureBatch
+from ..reader import iter_content_sources
+from ..stats import StatsCollector
+from .executor import BaseExecutor, ParseResult
+from .geojsonseq import files_to_geojsonseq
+from .layers import files_to_layers
+from .manifest import Manifest
+from .sharding import ShardSpec
+from .writers import WRITER_MAP, Writer
 
 _logger = logging.getLogger(__name__)
 
 
-def _write_by_fiona(
-    features_iter: Iterable[List[Feature]],
-    dst_path: Path,
-    driver: Optional[str] = None,
-) -> Iterable[Tuple[int, int]]:  # (num_files, num_features)
-    assert fiona, "fiona is not installed"
-
-    with fiona.open(
-        dst_path,
-        "w",
-        driver=driver,
-        schema=OGR_SCHEMA,
-        crs="EPSG:4326",
-    ) as f:
-        num_files = 0
-        num_features = 0
-        for features in features_iter:
-            f.writerecords(features)
-            num_files += 1
-            num_features += len(features)
-            yield (num_files, num_features)
+def _log_progress(batches_iter: Iterable[FeatureBatch]) -> Iterable[FeatureBatch]:
+    """Pass batches through, logging the progress once each has been written"""
+    num_files = 0
+    num_features = 0
+    for batch in batches_iter:
+        yield batch
+        num_files += 1
+        num_features += len(batch)
+        if num_files % 10 == 0:
+            _logger.info(
+                f"{num_files} XML files processed, {num_features} features written"
+            )
+    _logger.info(f"{num_files} XML files processed, {num_features} features written")
+
+
+def _track(
+    results: Iterable[ParseResult], stats: Optional[StatsCollector]
+) -> Iterable[FeatureBatch]:
+    """Pass batches through, timing how long the consumer takes to write each"""
+    for result in results:
+        t0 = time.perf_counter()
+        yield result.batch
+        result.stats.add_time("write", time.perf_counter() - t0)
+        if stats is not None:
+            stats.add(result.stats)
 
 
 def files_to_ogr_file(
@@ -45,28 +51,76 @@ def files_to_ogr_file(
     dst_path: Path,
     executor: BaseExecutor,
     driver: Optional[str] = None,
+    writer: Union[str, Writer] = "fiona",
+    manifest_path: Optional[Path] = None,
+    stats: Optional[StatsCollector] = None,
+    shard: Optional[ShardSpec] = None,
+    checkpoint_path: Optional[Path] = None,
 ) -> None:
-    """Generate OGR file from given XML/ZIP files."""
-    features_iter = executor.iter_process(iter_content_xmls(src_paths))
+    """Generate OGR file from given XML/ZIP files.
 
-    num_files = 0
-    num_features = 0
-    for num_files, num_features in _write_by_fiona(
-        features_iter,
-        dst_path,
-        driver=driver,
-    ):
-        if num_files > 0 and num_files % 10 == 0:
-            _logger.info(
-                f"{num_files} XML files processed, {num_features} features written"
+    ``writer`` is either "fiona" (record by record), "arrow" (columnar;
+    GeoParquet natively, other formats through pyogrio), "geojsonseq"
+    (newline-delimited GeoJSON encoded by the workers; "-" for stdout),
+    "topojson" or "tiles" (MBTiles/PMTiles), or a writer function taking the
+    same arguments as those in WRITER_MAP.
+
+    If ``manifest_path`` is given, the parse output of zip members is cached
+    in that SQLite file and unchanged members are not parsed again. Members
+    removed from the archives are pruned from it (except with ``shard``).
+
+    If ``stats`` is given, the timings and counters of each file are added to
+    it once the file has been written.
+
+    If ``shard`` is given, only the XMLs assigned to that shard are converted.
+    If ``checkpoint_path`` is given (only with "geojsonseq" to a file), the
+    XMLs written are recorded in that journal and an interrupted conversion
+    is resumed by running it again.
+
+    If the options of ``executor`` ask for layers other than 筆, they are
+    all written by files_to_layers() (without manifest nor checkpoint).
+    """
+    if executor.options.multi_layer:
+        if manifest_path is not None or checkpoint_path is not None:
+            raise ValueError(
+                "Manifests and checkpoints are not supported with several layers"
             )
-    _logger.info(f"{num_files} XML files processed, {num_features} features written")
+        if not isinstance(writer, str):
+            raise ValueError("Writing several layers needs a named writer")
+        files_to_layers(src_paths, dst_path, executor, driver, writer, stats, shard)
+        return
+    if writer == "geojsonseq" and manifest_path is None:
+        # ワーカーでエンコードしたバイト列をそのまま書き出す
+        files_to_geojsonseq(
+            src_paths, dst_path, executor, stats, shard, checkpoint_path
+        )
+        return
+    if checkpoint_path is not None:
+        raise ValueError(
+            "Checkpoints are only supported with the geojsonseq writer"
+            " (without manifest) or partitioned output"
+        )
+    sources = iter_content_sources(src_paths)
+    if shard is not None:
+        sources = shard.select(sources)
+    with ExitStack() as stack:
+        if manifest_path is None:
+            results = executor.iter_results(sources)
+        else:
+            manifest = stack.enter_context(Manifest(manifest_path, executor.options))
+            # シャードでは他のシャードのメンバーが見えないので、削除しない
+            results = manifest.iter_results(executor, sources, prune=shard is None)
+        batches_iter = _log_progress(_track(results, stats))
+        write = WRITER_MAP[writer] if isinstance(writer, str) else writer
+        write(batches_iter, dst_path, driver)
 
 
 def files_to_feature_iter(
-    src_paths: List[Path], executor: BaseExecutor
+    src_paths: List[Path],
+    executor: BaseExecutor,
+    stats: Optional[StatsCollector] = None,
 ) -> Iterable[Feature]:
     """Iterate features from given XML/ZIP files."""
-    features_iter = executor.iter_process(iter_content_xmls(src_paths))
-    for features in features_iter:
-        yield from features
+    results = executor.iter_results(iter_content_sources(src_paths))
+    for batch in _track(results, stats):
+        yield from batch.to_features()
@@ -0,0 +1,128 @@
+"""Asynchronous (asyncio) counterparts of the feature iterators
+
+The executor keeps running in a background thread and hands each parsed file
+over through a bounded asyncio.Queue. When the consumer falls behind, the
+queue fills up, the executor stops pulling results, and the pipeline stops
+submitting sources to the workers, so memory stays bounded.
+
+Closing the async iterator (``aclose()``, leaving an ``aclosing`` block, or
+cancelling the consuming task) stops the conversion: files not yet started
+are cancelled, the ones being parsed are waited for, and the workers are shut
+down before ``aclose()`` returns.
+"""
+
+import asyncio
+import threading
+import time
+from pathlib import Path
+from typing import AsyncGenerator, Iterable, List, Optional
+
+from ..batch import Feature, FeatureBatch
+from ..reader import iter_content_sources
+from ..stats import StatsCollector
+from .executor import BaseExecutor, ParseResult
+
+# 変換の終了を表す印
+_END = object()
+
+# ParseResult, 例外, または _END を受け渡すキュー
+_Queue = asyncio.Queue[object]
+
+
+def _produce(
+    results_iter: Iterable[ParseResult],
+    results: _Queue,
+    loop: asyncio.AbstractEventLoop,
+    stop: threading.Event,
+) -> None:
+    """Run the executor in a thread, putting its results into the queue"""
+
+    def put(item: object) -> None:
+        # キューが一杯の間はここで止まり、executor が結果を取り出さなくなる
+        asyncio.run_coroutine_threadsafe(results.put(item), loop).result()
+
+    it = iter(results_iter)
+    try:
+        for result in it:
+            put(result)
+            if stop.is_set():
+                return
+    except BaseException as e:
+        put(e)
+        return
+    finally:
+        # 未着手のファイルをキャンセルし、ワーカーを終了させる
+        close = getattr(it, "close", None)
+        if close is not None:
+            close()
+    put(_END)
+
+
+async def aiter_results(
+    src_paths: List[Path],
+    executor: BaseExecutor,
+    max_pending: int = 2,
+    stats: Optional[StatsCollector] = None,
+) -> AsyncGenerator[ParseResult, None]:
+    """Asynchronously iterate the parse results of given XML/ZIP files
+
+    Each result is the completion event of a file, with its source, batch and
+    stats. At most ``max_pending`` results wait for the consumer.
+
+    If ``stats`` is given, the stats of each file are added to it (and its
+    callback is called) once the consumer has processed the result.
+    """
+    loop = asyncio.get_running_loop()
+    results: _Queue = asyncio.Queue(maxsize=max_pending)
+    stop = threading.Event()
+    results_iter = executor.iter_results(iter_content_sources(src_paths))
+    producer = loop.run_in_executor(None, _produce, results_iter, results, loop, stop)
+    try:
+        while (item := await results.get()) is not _END:
+            if isinstance(item, BaseException):
+                raise item
+            assert isinstance(item, ParseResult)
+            t0 = time.perf_counter()
+            yield item
+            item.stats.add_time("write", time.perf_counter() - t0)
+            if stats is not None:
+                stats.add(item.stats)
+    finally:
+        stop.set()
+        # キューを空けながらスレッドの終了を待つ (put で止まっていることがある)
+        while not producer.done():
+            while not results.empty():
+                results.get_nowait()
+            await asyncio.wait({producer}, timeout=0.05)
+        producer.result()
+
+
+async def aiter_batches(
+    src_paths: List[Path],
+    executor: BaseExecutor,
+    max_pending: int = 2,
+    stats: Optional[StatsCollector] = None,
+) -> AsyncGenerator[FeatureBatch, None]:
+    """Asynchronously iterate columnar batches (one per file)"""
+    results = aiter_results(src_paths, executor, max_pending, stats)
+    try:
+        async for result in results:
+            yield result.batch
+    finally:
+        await results.aclose()
+
+
+async def files_to_feature_aiter(
+    src_paths: List[Path],
+    executor: BaseExecutor,
+    max_pending: int = 2,
+    stats: Optional[StatsCollector] = None,
+) -> AsyncGenerator[Feature, None]:
+    """Asynchronously iterate features from given XML/ZIP files"""
+    results = aiter_results(src_paths, executor, max_pending, stats)
+    try:
+        async for result in results:
+            for feature in result.batch.to_features():
+                yield feature
+    finally:
+        await results.aclose()
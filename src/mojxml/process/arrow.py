@@ -0,0 +1,232 @@
+"""Columnar output through Apache Arrow (GeoParquet, or OGR via pyogrio)"""
+
+import json
+import struct
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Union
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+from ..batch import FeatureBatch
+from ..schema import FUDE_LAYER, LAYER_SCHEMAS
+
+GEOMETRY_COLUMN = "geometry"
+
+_PARQUET_SUFFIXES = (".parquet", ".geoparquet")
+_ROW_GROUP_SIZE = 65536
+
+# WKB (little endian): MultiPolygon with one Polygon
+_MULTIPOLYGON_HEADER = struct.pack("<BII", 1, 6, 1)
+_POLYGON_HEADER = struct.Struct("<BII")
+_UINT32 = struct.Struct("<I")
+# WKB (little endian): Point, LineString
+_POINT_HEADER = struct.pack("<BI", 1, 1)
+_LINESTRING_HEADER = struct.Struct("<BII")
+
+# FlatGeobuf は空間インデックスを作らない場合に限り、ジオメトリのないレイヤーを持てる
+_FGB_SUFFIXES = (".fgb",)
+
+
+def _multipolygon_wkbs(batch: FeatureBatch) -> List[Optional[bytes]]:
+    coords = np.ascontiguousarray(batch.coords, dtype=np.float64).data.cast("B")
+    ring_offsets = batch.ring_offsets.tolist()
+    feature_offsets = batch.feature_offsets.tolist()
+    wkbs: List[Optional[bytes]] = []
+    for r0, r1 in zip(feature_offsets[:-1], feature_offsets[1:]):
+        if r0 == r1:
+            wkbs.append(None)
+            continue
+        parts: List[Union[bytes, memoryview]] = [
+            _MULTIPOLYGON_HEADER,
+            _POLYGON_HEADER.pack(1, 3, r1 - r0),
+        ]
+        for a, b in zip(ring_offsets[r0:r1], ring_offsets[r0 + 1 : r1 + 1]):
+            parts.append(_UINT32.pack(b - a))
+            parts.append(coords[a * 16 : b * 16])
+        wkbs.append(b"".join(parts))
+    return wkbs
+
+
+def _simple_wkbs(batch: FeatureBatch) -> List[Optional[bytes]]:
+    """Get the WKBs of a batch of points or line strings (one ring per feature)"""
+    coords = np.ascontiguousarray(batch.coords, dtype=np.float64).data.cast("B")
+    ring_offsets = batch.ring_offsets.tolist()
+    feature_offsets = batch.feature_offsets.tolist()
+    is_point = batch.geometry_type == "Point"
+    wkbs: List[Optional[bytes]] = []
+    for r0, r1 in zip(feature_offsets[:-1], feature_offsets[1:]):
+        if r0 == r1:
+            wkbs.append(None)
+            continue
+        (a, b) = (ring_offsets[r0], ring_offsets[r0 + 1])
+        if is_point:
+            wkbs.append(_POINT_HEADER + coords[a * 16 : a * 16 + 16])
+        else:
+            header = _LINESTRING_HEADER.pack(1, 2, b - a)
+            wkbs.append(header + coords[a * 16 : b * 16])
+    return wkbs
+
+
+def layer_options(
+    dst_path: Path, driver: Optional[str], layer: Optional[str]
+) -> Optional[Dict[str, str]]:
+    """Get the OGR layer creation options needed to write a layer"""
+    schema = LAYER_SCHEMAS[layer or FUDE_LAYER]
+    is_fgb = driver == "FlatGeobuf" or (
+        driver is None and Path(dst_path).suffix.lower() in _FGB_SUFFIXES
+    )
+    if is_fgb and schema["geometry"] == "None":
+        return {"SPATIAL_INDEX": "NO"}
+    return None
+
+
+def arrow_schema(geoparquet: bool = False, layer: Optional[str] = None) -> "pa.Schema":
+    """Get the Arrow schema corresponding to a layer (geometry as WKB)
+
+    ``layer`` is one of schema.LAYERS, 筆 by default. Layers without geometry
+    have no geometry column.
+    """
+    import pyarrow as pa
+
+    schema = LAYER_SCHEMAS[layer or FUDE_LAYER]
+    fields = [pa.field(name, pa.string()) for name in schema["properties"]]
+    if schema["geometry"] == "None":
+        return pa.schema(fields)
+    fields.append(pa.field(GEOMETRY_COLUMN, pa.binary()))
+    metadata = None
+    if geoparquet:
+        geo = {
+            "version": "1.0.0",
+            "primary_column": GEOMETRY_COLUMN,
+            "columns": {
+                # crs を省略した場合は OGC:CRS84 (経度・緯度の順) とみなされる
+                GEOMETRY_COLUMN: {
+                    "encoding": "WKB",
+                    "geometry_types": [schema["geometry"]],
+                }
+            },
+        }
+        metadata = {b"geo": json.dumps(geo).encode("utf-8")}
+    return pa.schema(fields, metadata=metadata)
+
+
+def batch_to_arrow(batch: FeatureBatch, schema: "pa.Schema") -> "pa.RecordBatch":
+    """Build an Arrow record batch directly from the columns of a FeatureBatch"""
+    import pyarrow as pa
+
+    strings = pa.array(batch.strings, type=pa.string())
+    columns = []
+    for name in schema.names:
+        if name == GEOMETRY_COLUMN:
+            if batch.geometry_type == "MultiPolygon":
+                wkbs = _multipolygon_wkbs(batch)
+            else:
+                wkbs = _simple_wkbs(batch)
+            columns.append(pa.array(wkbs, type=pa.binary()))
+            continue
+        indices = np.ascontiguousarray(batch.properties[:, batch.fields.index(name)])
+        columns.append(strings.take(pa.array(indices, mask=indices < 0)))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def _write_geoparquet(
+    batches_iter: Iterable[FeatureBatch], dst_path: Path, layer: Optional[str] = None
+) -> None:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema(geoparquet=True, layer=layer)
+    with pq.ParquetWriter(dst_path, schema) as writer:
+        pending: List[pa.RecordBatch] = []
+        num_pending = 0
+        for batch in batches_iter:
+            if len(batch) == 0:
+                continue
+            pending.append(batch_to_arrow(batch, schema))
+            num_pending += len(batch)
+            # 小さな XML ごとに row group が分かれないようにまとめて書き出す
+            if num_pending >= _ROW_GROUP_SIZE:
+                writer.write_table(pa.Table.from_batches(pending, schema=schema))
+                pending = []
+                num_pending = 0
+        if pending:
+            writer.write_table(pa.Table.from_batches(pending, schema=schema))
+
+
+def write_by_arrow(
+    batches_iter: Iterable[FeatureBatch],
+    dst_path: Path,
+    driver: Optional[str] = None,
+    layer: Optional[str] = None,
+) -> None:
+    """Write batches as Arrow record batches
+
+    GeoParquet (.parquet/.geoparquet) is written natively with pyarrow. Other
+    formats are written through GDAL's Arrow stream API with pyogrio.
+    Requires pyarrow (and pyogrio for non-Parquet formats).
+
+    ``layer`` is the layer of schema.LAYERS the batches belong to (筆 by
+    default), also used as the name of the OGR layer.
+    """
+    dst_path = Path(dst_path)
+    if driver == "Parquet" or (
+        driver is None and dst_path.suffix.lower() in _PARQUET_SUFFIXES
+    ):
+        _write_geoparquet(batches_iter, dst_path, layer)
+        return
+
+    write_by_ogr_arrow(batches_iter, dst_path, driver, layer)
+
+
+def write_by_ogr_arrow(
+    batches_iter: Iterable[FeatureBatch],
+    dst_path: Path,
+    driver: Optional[str] = None,
+    layer: Optional[str] = None,
+    dataset_options: Optional[Dict[str, str]] = None,
+) -> None:
+    """Write batches through GDAL's Arrow stream API with pyogrio
+
+    ``layer`` is the layer of schema.LAYERS (筆 by default) and the name of the
+    OGR layer. An existing GeoPackage gets the layer added to it.
+    ``dataset_options`` are passed to GDAL as dataset creation options.
+    """
+    import pyarrow as pa
+    from pyogrio.raw import write_arrow
+
+    schema = arrow_schema(layer=layer)
+    reader = pa.RecordBatchReader.from_batches(
+        schema,
+        (batch_to_arrow(batch, schema) for batch in batches_iter if len(batch)),
+    )
+    geometry = LAYER_SCHEMAS[layer or FUDE_LAYER]["geometry"]
+    has_geometry = geometry != "None"
+    write_arrow(
+        reader,
+        str(dst_path),
+        driver=driver,
+        geometry_name=GEOMETRY_COLUMN if has_geometry else None,
+        geometry_type=geometry if has_geometry else None,
+        crs="EPSG:4326" if has_geometry else None,
+        layer=layer,
+        dataset_options=dataset_options,
+        layer_options=layer_options(dst_path, driver, layer),
+    )
+
+
+def merge_geoparquet(src_paths: Iterable[Path], dst_path: Path) -> None:
+    """Concatenate GeoParquet files written by this module into one file
+
+    Row groups are copied as they are, without going through FeatureBatch.
+    """
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema(geoparquet=True)
+    with pq.ParquetWriter(dst_path, schema) as writer:
+        for src_path in src_paths:
+            f = pq.ParquetFile(src_path)
+            for i in range(f.num_row_groups):
+                writer.write_table(f.read_row_group(i))
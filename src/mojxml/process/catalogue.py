@@ -0,0 +1,130 @@
+"""Catalogue of XML files (one row per file) from an index-only scan"""
+
+import csv
+import logging
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from ..reader import (
+    Source,
+    XMLSource,
+    ZipMemberSource,
+    iter_content_sources,
+    open_source,
+)
+from ..scan import HEADER_FIELDS, ScanRecord, scan_xml
+from .executor import BaseExecutor
+
+_logger = logging.getLogger(__name__)
+
+# カタログの列 (ルート要素直下の属性の他はすべて数値)
+# bytes は XML のサイズ (ヘッダのみの場合は読み込んだところまで)
+CATALOGUE_COLUMNS: Tuple[str, ...] = (
+    "archive",
+    "file",
+    "bytes",
+    *HEADER_FIELDS,
+    "num_fude",
+    "num_points",
+    "num_curves",
+    "num_surfaces",
+    "minx",
+    "miny",
+    "maxx",
+    "maxy",
+    "source_minx",
+    "source_miny",
+    "source_maxx",
+    "source_maxy",
+)
+
+_PARQUET_SUFFIXES = (".parquet", ".geoparquet")
+
+
+def _scan_source(src: Source, header_only: bool) -> ScanRecord:
+    """Read the source in the worker and scan it"""
+    with open_source(src) as f:
+        record = scan_xml(f, header_only)
+        record.bytes_in = f.tell()
+    record.name = src.name if isinstance(src, XMLSource) else None
+    return record
+
+
+def catalogue_row(record: ScanRecord, archive: Optional[Path] = None) -> Dict[str, Any]:
+    """Flatten a scan record into a catalogue row"""
+    row: Dict[str, Any] = {
+        "archive": str(archive) if archive is not None else None,
+        "file": record.name,
+        "bytes": record.bytes_in,
+    }
+    row.update(record.header)
+    row["num_fude"] = record.num_fude
+    row["num_points"] = record.num_points
+    row["num_curves"] = record.num_curves
+    row["num_surfaces"] = record.num_surfaces
+    for prefix, bounds in (("", record.bounds), ("source_", record.source_bounds)):
+        for key, value in zip(("minx", "miny", "maxx", "maxy"), bounds or [None] * 4):
+            row[prefix + key] = value
+    return row
+
+
+def iter_catalogue(
+    src_paths: List[Path], executor: BaseExecutor, header_only: bool = False
+) -> Iterable[Dict[str, Any]]:
+    """Scan every XML (including those in nested zips) into catalogue rows"""
+    sources = iter_content_sources(src_paths)
+    for src, record in executor.iter_tasks(_scan_source, (header_only,), sources):
+        # ZIPの中のファイルは、それを含むアーカイブも記録する
+        archive = src.archive if isinstance(src, ZipMemberSource) else None
+        yield catalogue_row(record, archive)
+
+
+def _write_csv(rows: Iterable[Dict[str, Any]], dst_path: Path) -> int:
+    count = 0
+    with open(dst_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CATALOGUE_COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def _write_parquet(rows: Iterable[Dict[str, Any]], dst_path: Path) -> int:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    fields = []
+    for name in CATALOGUE_COLUMNS:
+        if name in ("archive", "file", *HEADER_FIELDS):
+            fields.append(pa.field(name, pa.string()))
+        elif name.startswith("num_") or name == "bytes":
+            fields.append(pa.field(name, pa.int64()))
+        else:
+            fields.append(pa.field(name, pa.float64()))
+    table = pa.Table.from_pylist(list(rows), schema=pa.schema(fields))
+    pq.write_table(table, dst_path)
+    return table.num_rows
+
+
+def files_to_catalogue(
+    src_paths: List[Path],
+    dst_path: Path,
+    executor: BaseExecutor,
+    header_only: bool = False,
+) -> int:
+    """Write the catalogue of given XML/ZIP files as CSV or Parquet
+
+    The format is chosen by the suffix of ``dst_path`` (.parquet requires
+    pyarrow). Returns the number of XML files.
+    """
+    dst_path = Path(dst_path)
+    t0 = time.perf_counter()
+    rows = iter_catalogue(src_paths, executor, header_only)
+    if dst_path.suffix.lower() in _PARQUET_SUFFIXES:
+        count = _write_parquet(rows, dst_path)
+    else:
+        count = _write_csv(rows, dst_path)
+    _logger.info(f"{count} XML files scanned in {time.perf_counter() - t0:.1f}s")
+    return count
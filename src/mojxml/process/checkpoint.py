@@ -0,0 +1,158 @@
+"""Checkpoint journal to resume an interrupted conversion
+
+The journal (a SQLite file) records the XMLs whose output has been written,
+so that a rerun of the same command after a crash skips them and continues
+where the previous run stopped. It works for outputs that can be extended
+safely:
+
+- partitioned output (``--partition``): the shard files of completed tasks
+  are recorded and kept; those of unfinished tasks are removed.
+- GeoJSONSeq files: the offset of the end of the output is recorded, and the
+  file is truncated back to it before appending.
+
+The journal is a plain file, so it can be kept on shared storage next to
+the output. Give each machine (``--shard``) its own journal, as SQLite
+locking is not reliable on network file systems.
+"""
+
+import logging
+import sqlite3
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Optional, Set, TypeVar, Union
+
+from ..parse import ParseOptions
+from ..reader import XMLSource
+
+_logger = logging.getLogger(__name__)
+
+S = TypeVar("S", bound=XMLSource)
+
+# WAL は共有メモリを使うため、ネットワークファイルシステムでは使わない
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    output TEXT NOT NULL,
+    options TEXT NOT NULL,
+    source TEXT NOT NULL,
+    offset INTEGER,
+    PRIMARY KEY (output, options, source)
+);
+CREATE TABLE IF NOT EXISTS shards (
+    output TEXT NOT NULL,
+    options TEXT NOT NULL,
+    task INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    city_code TEXT,
+    num_features INTEGER NOT NULL,
+    PRIMARY KEY (output, options, path)
+);
+"""
+
+
+class RecordedShard(NamedTuple):
+    """A shard file written by a completed task (path relative to the output)"""
+
+    task: int
+    path: str
+    city_code: Optional[str]
+    num_features: int
+
+
+class Checkpoint:
+    """SQLite journal of the XMLs already converted into an output
+
+    Entries are keyed by the output path, the parse options and the name of
+    the XML (e.g. ``12103-0400-76.xml``). Nothing is written to the journal
+    until commit(), which the caller does once the output recorded so far is
+    on disk.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        options: ParseOptions,
+        output: Union[str, Path],
+    ) -> None:
+        """Open (or create) the journal for the output"""
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript(_SCHEMA)
+        self._key = (str(Path(output).resolve()), options.cache_key())
+        # 前回までに書き出したもの (今回の実行中に記録したものは含めない)
+        self._done: Set[str] = {
+            row[0]
+            for row in self._conn.execute(
+                "SELECT source FROM sources WHERE output = ? AND options = ?",
+                self._key,
+            )
+        }
+        self.num_skipped = 0
+
+    def __enter__(self) -> "Checkpoint":
+        """Enter the context"""
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        """Commit and close"""
+        self.close()
+
+    def close(self) -> None:
+        """Commit and close"""
+        self._conn.commit()
+        self._conn.close()
+
+    def commit(self) -> None:
+        """Make the records so far durable"""
+        self._conn.commit()
+
+    def is_done(self, src: XMLSource) -> bool:
+        """Whether the XML has been converted by a previous run"""
+        return src.name in self._done
+
+    def pending(self, src_iter: Iterable[S]) -> Iterable[S]:
+        """Skip the XMLs converted by a previous run"""
+        for src in src_iter:
+            if self.is_done(src):
+                self.num_skipped += 1
+            else:
+                yield src
+        if self.num_skipped:
+            _logger.info(f"checkpoint: {self.num_skipped} XML files already done")
+
+    def record_source(self, src: XMLSource, offset: Optional[int] = None) -> None:
+        """Record an XML as converted (with the end ``offset`` of the output)"""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)",
+            (*self._key, src.name, offset),
+        )
+
+    def record_shard(self, shard: RecordedShard) -> None:
+        """Record a shard file written by a task"""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO shards VALUES (?, ?, ?, ?, ?, ?)",
+            (*self._key, *shard),
+        )
+
+    def offset(self) -> Optional[int]:
+        """Get the end of the output written so far (None if nothing recorded)"""
+        row = self._conn.execute(
+            "SELECT MAX(offset) FROM sources WHERE output = ? AND options = ?",
+            self._key,
+        ).fetchone()
+        return row[0]
+
+    def shards(self) -> List[RecordedShard]:
+        """Get the shard files written so far"""
+        rows = self._conn.execute(
+            "SELECT task, path, city_code, num_features FROM shards"
+            " WHERE output = ? AND options = ? ORDER BY task, path",
+            self._key,
+        )
+        return [RecordedShard(*row) for row in rows]
+
+    def clear(self) -> None:
+        """Forget the output (e.g. once its shards have been merged)"""
+        for table in ("sources", "shards"):
+            self._conn.execute(
+                f"DELETE FROM {table} WHERE output = ? AND options = ?", self._key
+            )
+        self._conn.commit()
+        self._done.clear()
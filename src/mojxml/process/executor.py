@@ -1,85 +1,596 @@
 """Run conversion process in parallel."""
 
 import concurrent.futures
+import cProfile
+import importlib
+import multiprocessing
 import os
+import queue
+import threading
+import time
 from abc import ABCMeta, abstractmethod
-from typing import Dict, Iterable, List, Type
+from contextlib import ExitStack
+from multiprocessing.context import BaseContext
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+    cast,
+)
 
-from ..parse import Feature, ParseOptions, parse_raw
+from ..batch import FeatureBatch
+from ..parse import Feature, ParseOptions, empty_layer, parse_batch, parse_layers
+from ..parts import PartialParse
+from ..reader import Source, XMLSource, open_source
+from ..schema import FUDE_LAYER
+from ..stats import FileStats
+from ..transform import warm_transformers
+from .schedule import (
+    FudePayload,
+    FudeTask,
+    PartMerger,
+    PartPayload,
+    PartTask,
+    build_part_task,
+    parse_part_task,
+    plan_tasks,
+)
+
+T = TypeVar("T")
+E = TypeVar("E", bound="BaseExecutor")
+
+# 複数のレイヤーを出力する場合の、レイヤーごとのバッチ
+_Layers = Dict[str, Union[FeatureBatch, bytes]]
+
+# ワーカーから返す値 (プロセス間では FeatureBatch をバイト列にして渡す)
+_Payload = Tuple[Union[FeatureBatch, bytes, _Layers], FileStats]
+
+# ワーカーでバッチをバイト列にする関数 (プロセス間で受け渡せるもの)
+Encoder = Callable[[FeatureBatch], bytes]
+
+# ワーカーごとのプロファイラ (profile_dir を指定した場合)
+_profiler: Optional[cProfile.Profile] = None
+
+# ワーカープロセスを起動する前に読み込んでおくモジュール
+PRELOAD_MODULES = ("lxml.etree", "numpy", "pyproj", "mojxml.parse", "mojxml.process")
+
+# ワーカープロセスの起動方法
+START_METHODS = ("fork", "forkserver", "spawn")
+
+
+class ParseResult(NamedTuple):
+    """Batch parsed from a source, with the stats of the file"""
+
+    source: Source
+    batch: FeatureBatch
+    stats: FileStats
+    # ParseOptions.layers を指定した場合の、レイヤーごとのバッチ (batch は筆)
+    layers: Optional[Dict[str, FeatureBatch]] = None
+
+
+class EncodedResult(NamedTuple):
+    """Batch parsed from a source and encoded, with the stats of the file"""
+
+    source: Source
+    data: bytes
+    stats: FileStats
+
+
+def _read_and_parse(
+    src: Source, options: ParseOptions, encode: Optional[Encoder]
+) -> _Payload:
+    stats = FileStats(name=src.name if isinstance(src, XMLSource) else None)
+    t0 = time.perf_counter()
+    with ExitStack() as stack:
+        with stats.timer("read"):
+            f = stack.enter_context(open_source(src))
+        # XMLを丸ごと読み込まずに、ストリームのままパースする
+        if options.multi_layer:
+            batches = parse_layers(f, options, stats)
+        else:
+            batches = parse_batch(f, options, stats)
+        stats.bytes_in = f.tell()
+    payload: Union[FeatureBatch, bytes, _Layers]
+    if isinstance(batches, dict):
+        with stats.timer("serialize"):
+            payload = {
+                name: b if encode is None else encode(b) for name, b in batches.items()
+            }
+    elif encode is not None:
+        with stats.timer("serialize"):
+            payload = encode(batches)
+    else:
+        payload = batches
+    stats.wall = time.perf_counter() - t0
+    return (payload, stats)
+
+
+# ワーカーで処理するもの (ソース、または大きいXMLの部分)
+_Task = Union[Source, PartTask, FudeTask]
+
+
+def _run_task(
+    task: _Task, options: ParseOptions, encode: Optional[Encoder]
+) -> Union[_Payload, PartPayload]:
+    if isinstance(task, PartTask):
+        return parse_part_task(task)
+    if isinstance(task, FudeTask):
+        # 組み立てた筆は親プロセスで結合するので、バッチのまま返す
+        return build_part_task(task, options)
+    return _read_and_parse(task, options, encode)
+
+
+def _parse_source(
+    src: _Task,
+    options: ParseOptions,
+    encode: Optional[Encoder] = None,
+    profile_dir: Optional[Path] = None,
+) -> Union[_Payload, PartPayload]:
+    """Read the source (or a part of a large XML) in the worker and parse it
+
+    With ``profile_dir``, each worker process accumulates a cProfile of its
+    tasks in ``worker-<pid>.prof``, rewritten after every task.
+    """
+    global _profiler
+    if profile_dir is None:
+        return _run_task(src, options, encode)
+    if _profiler is None:
+        _profiler = cProfile.Profile()
+    payload = _profiler.runcall(_run_task, src, options, encode)
+    _profiler.dump_stats(Path(profile_dir) / f"worker-{os.getpid()}.prof")
+    return payload
+
+
+def _decode(data: Union[FeatureBatch, bytes]) -> FeatureBatch:
+    if isinstance(data, bytes):
+        return FeatureBatch.from_bytes(data)
+    return data
+
+
+def _to_result(src: Source, payload: _Payload) -> ParseResult:
+    (data, stats) = payload
+    with stats.timer("deserialize"):
+        if not isinstance(data, dict):
+            return ParseResult(src, _decode(data), stats)
+        layers = {name: _decode(b) for name, b in data.items()}
+    batch = layers[FUDE_LAYER] if FUDE_LAYER in layers else empty_layer(FUDE_LAYER)
+    return ParseResult(src, batch, stats, layers)
 
 
 class BaseExecutor(metaclass=ABCMeta):
     """Executor for processing files"""
 
-    def __init__(self, options: ParseOptions) -> None:
-        """Initialize"""
+    # 結果をバイト列にしてワーカーから受け渡すか
+    _serialize = False
+    # 大きいソースから処理するか
+    largest_first = False
+    # これより大きいXMLを分割して複数のワーカーで処理する (None: 分割しない)
+    split_bytes: Optional[int] = None
+
+    @property
+    def preserves_order(self) -> bool:
+        """Whether results are yielded in the order of the sources"""
+        return not self.largest_first
+
+    def __init__(
+        self, options: ParseOptions, profile_dir: Optional[Path] = None
+    ) -> None:
+        """Initialize
+
+        Args:
+            options: Parse options
+            profile_dir: Directory to write a cProfile of each worker process
+        """
         self.options = options
+        self.profile_dir = profile_dir
+        if profile_dir is not None:
+            Path(profile_dir).mkdir(parents=True, exist_ok=True)
+
+    def __enter__(self: E) -> E:
+        """Keep the workers (if any) running until the end of the block"""
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        """Shut the workers down"""
+        self.close()
+
+    def close(self) -> None:
+        """Shut the workers down (if kept running)"""
+        # ワーカーを持たない場合は何もしない
+        return None
 
     @abstractmethod
+    def iter_tasks(
+        self, fn: Callable[..., T], args: Tuple[object, ...], items: Iterable[Any]
+    ) -> Iterable[Tuple[Any, T]]:
+        """Run ``fn(item, *args)`` on the workers, yielding (item, result) pairs"""
+
+    def _iter_payloads(
+        self, src_iter: Iterable[Source], encode: Optional[Encoder]
+    ) -> Iterable[Tuple[Source, _Payload]]:
+        """Parse XMLs on the workers, encoding the batches there if ``encode``
+
+        Batches of split XMLs are merged here and returned as FeatureBatch.
+        """
+        args = (self.options, encode, self.profile_dir)
+        spilled: List[Path] = []
+        # 分割したXMLの結合は筆のみに対応している
+        split_bytes = None if self.options.multi_layer else self.split_bytes
+        tasks = plan_tasks(src_iter, self.largest_first, split_bytes, spilled)
+
+        def run_fude_tasks(
+            fude_tasks: List[FudeTask],
+        ) -> Iterable[Tuple[Any, FudePayload]]:
+            results = self.iter_tasks(_parse_source, args, fude_tasks)
+            return cast(Iterable[Tuple[Any, FudePayload]], results)
+
+        merger = PartMerger(self.options, spilled, run_fude_tasks)
+        try:
+            for task, payload in self.iter_tasks(_parse_source, args, tasks):
+                if not isinstance(task, PartTask):
+                    assert not isinstance(payload[0], PartialParse)
+                    yield (task, cast(_Payload, payload))
+                    continue
+                assert isinstance(payload[0], PartialParse)
+                merged = merger.add(task, cast(PartPayload, payload))
+                if merged is not None:
+                    yield (task.source, merged)
+        finally:
+            # 中断した場合に残った一時ファイルを消す
+            for path in spilled:
+                path.unlink(missing_ok=True)
+
+    def iter_results(self, src_iter: Iterable[Source]) -> Iterable[ParseResult]:
+        """Convert XMLs to batches, with the source and stats of each"""
+        encode = FeatureBatch.to_bytes if self._serialize else None
+        for src, payload in self._iter_payloads(src_iter, encode):
+            yield _to_result(src, payload)
+
+    def iter_encoded(
+        self, src_iter: Iterable[Source], encode: Encoder
+    ) -> Iterable[EncodedResult]:
+        """Convert XMLs to batches encoded by the workers (e.g. as GeoJSON text)
+
+        ``encode`` must be picklable (a module-level function) for the
+        multiprocess executor.
+        """
+        if self.options.multi_layer:
+            raise ValueError("Encoded results are only available for the 筆 layer")
+        for src, (data, stats) in self._iter_payloads(src_iter, encode):
+            assert not isinstance(data, dict)
+            if isinstance(data, FeatureBatch):
+                # 分割して親プロセスで結合したもの
+                with stats.timer("serialize"):
+                    data = encode(data)
+            yield EncodedResult(src, data, stats)
+
+    def iter_batches(
+        self,
+        src_iter: Iterable[Source],
+    ) -> Iterable[FeatureBatch]:
+        """Convert XMLs to columnar batches of features"""
+        for result in self.iter_results(src_iter):
+            yield result.batch
+
     def iter_process(
         self,
-        src_iter: Iterable[bytes],
+        src_iter: Iterable[Source],
     ) -> Iterable[List[Feature]]:
         """Convert XMLs to OGR features"""
+        for batch in self.iter_batches(src_iter):
+            yield batch.to_features()
+
+
+class _EndOfItems(NamedTuple):
+    num_submitted: int
+
+
+class _Pipeline(Generic[T]):
+    """Feed items (e.g. sources) to a worker pool from a reader thread
+
+    The reader thread pulls items (e.g. decompresses zips) while the workers
+    are busy. The number of items being read or processed is bounded, and
+    results are yielded in completion order, or in submission order if
+    ``ordered`` is set (completed results then wait in a reorder buffer).
+    """
+
+    def __init__(
+        self,
+        executor: concurrent.futures.Executor,
+        fn: Callable[..., T],
+        args: Tuple[object, ...],
+        items: Iterable[Any],
+        max_in_flight: int,
+        ordered: bool,
+    ) -> None:
+        self._executor = executor
+        self._fn = fn
+        self._args = args
+        self._items = items
+        self._ordered = ordered
+        self._slots = threading.Semaphore(max_in_flight)
+        self._results: queue.Queue[object] = queue.Queue()
+        self._stop = threading.Event()
+        # 中断した場合に取り消すための、実行中または待機中のタスク
+        self._pending: Set[concurrent.futures.Future[T]] = set()
+
+    def _read(self) -> None:
+        num_submitted = 0
+        try:
+            for item in self._items:
+                while not self._slots.acquire(timeout=0.1):
+                    if self._stop.is_set():
+                        return
+                if self._stop.is_set():
+                    return
+                fut = self._executor.submit(self._fn, item, *self._args)
+                self._pending.add(fut)
+                fut.add_done_callback(self._pending.discard)
+                num_submitted += 1
+                if self._ordered:
+                    self._results.put((item, fut))
+                else:
+                    fut.add_done_callback(
+                        lambda fut, item=item: self._results.put((item, fut))
+                    )
+        except BaseException as e:
+            self._results.put(e)
+            return
+        self._results.put(_EndOfItems(num_submitted))
+
+    def __iter__(self) -> Iterator[Tuple[Any, T]]:
+        """Iterate results paired with their items"""
+        reader = threading.Thread(target=self._read, daemon=True)
+        reader.start()
+        num_yielded = 0
+        num_submitted: Optional[int] = None
+        try:
+            while num_submitted is None or num_yielded < num_submitted:
+                entry = self._results.get()
+                if isinstance(entry, _EndOfItems):
+                    num_submitted = entry.num_submitted
+                elif isinstance(entry, BaseException):
+                    raise entry
+                else:
+                    assert isinstance(entry, tuple)
+                    (item, fut) = entry
+                    result = fut.result()
+                    self._slots.release()
+                    num_yielded += 1
+                    yield (item, result)
+        finally:
+            self._stop.set()
+            reader.join()
+            # プールを使い続ける場合に備えて、残りのタスクを取り消す
+            for fut in list(self._pending):
+                fut.cancel()
 
 
 class WorkerPoolExecutor(BaseExecutor, metaclass=ABCMeta):
-    """Executor implemeted with worker pool"""
+    """Executor implemeted with worker pool
+
+    By default, the pool is started for each conversion and shut down at its
+    end. Used as a context manager, the pool is started once and kept for
+    all the conversions run in the block::
+
+        with ProcessPoolExecutor(options) as executor:
+            for src, dst in jobs:
+                files_to_ogr_file([src], dst, executor)
+    """
+
+    def __init__(
+        self,
+        options: ParseOptions,
+        max_workers: Optional[int] = None,
+        prefetch: Optional[int] = None,
+        ordered: bool = False,
+        profile_dir: Optional[Path] = None,
+        largest_first: bool = False,
+        split_bytes: Optional[int] = None,
+    ) -> None:
+        """Initialize
+
+        Args:
+            options: Parse options
+            max_workers: Number of workers (default: depends on the pool type)
+            prefetch: Number of sources read ahead beyond the ones being
+                processed (default: same as max_workers)
+            ordered: Yield results in the order of the sources
+            profile_dir: Directory to write a cProfile of each worker process
+            largest_first: Process the largest sources first (the sources are
+                listed beforehand to sort them)
+            split_bytes: Split XMLs larger than this into parts of about this
+                size, parsed by several workers and merged afterwards
+        """
+        super().__init__(options, profile_dir=profile_dir)
+        self.max_workers = max_workers or self._default_max_workers()
+        self.prefetch = prefetch if prefetch is not None else self.max_workers
+        self.ordered = ordered
+        self.largest_first = largest_first
+        self.split_bytes = split_bytes
+        self._pool: Optional[concurrent.futures.Executor] = None
+
+    def __enter__(self: E) -> E:
+        """Start the pool, kept until the end of the block"""
+        assert isinstance(self, WorkerPoolExecutor)
+        if self._pool is None:
+            self._pool = self._get_executor(max_workers=self.max_workers)
+        return self
+
+    def close(self) -> None:
+        """Shut the pool down (if kept running)"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    @property
+    def preserves_order(self) -> bool:
+        """Whether results are yielded in the order of the sources"""
+        return self.ordered and not self.largest_first
+
+    @abstractmethod
+    def _default_max_workers(self) -> int:
+        """Get the default number of workers."""
 
     @abstractmethod
     def _get_executor(self, max_workers: int) -> concurrent.futures.Executor:
         """Get executor."""
 
-    def iter_process(
+    def iter_tasks(
+        self, fn: Callable[..., T], args: Tuple[object, ...], items: Iterable[Any]
+    ) -> Iterable[Tuple[Any, T]]:
+        """Run ``fn(item, *args)`` on the workers, yielding (item, result) pairs"""
+        if self._pool is not None:
+            yield from self._run_pipeline(self._pool, fn, args, items)
+            return
+        executor = self._get_executor(max_workers=self.max_workers)
+        # 入れ子の呼び出し (分割したXMLの筆の組み立て) にも同じプールを使う
+        self._pool = executor
+        try:
+            yield from self._run_pipeline(executor, fn, args, items)
+        finally:
+            self._pool = None
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _run_pipeline(
         self,
-        src_iter: Iterable[bytes],
-    ) -> Iterable[List[Feature]]:
-        """Convert XMLs to OGR features"""
-        max_workers = os.cpu_count() or 1
-        with self._get_executor(max_workers=max_workers) as executor:
-            futs = []
-            for src in src_iter:
-                fut = executor.submit(parse_raw, src, self.options)
-                futs.append(fut)
-                if len(futs) >= max_workers:
-                    (done, not_done) = concurrent.futures.wait(
-                        futs, return_when=concurrent.futures.FIRST_COMPLETED
-                    )
-                    for fut in done:
-                        yield fut.result()
-                    futs = list(not_done)
+        executor: concurrent.futures.Executor,
+        fn: Callable[..., T],
+        args: Tuple[object, ...],
+        items: Iterable[Any],
+    ) -> Iterable[Tuple[Any, T]]:
+        return _Pipeline(
+            executor,
+            fn,
+            args,
+            items,
+            max_in_flight=self.max_workers + self.prefetch,
+            ordered=self.ordered,
+        )
+
+
+def _get_mp_context(start_method: Optional[str]) -> BaseContext:
+    """Get the context to start worker processes, preloading the modules
 
-            if futs:
-                (done, not_done) = concurrent.futures.wait(
-                    futs, return_when=concurrent.futures.ALL_COMPLETED
-                )
-                for fut in done:
-                    yield fut.result()
+    Forked workers inherit the modules imported here. A fork server imports
+    them once and forks the workers from itself. Spawned workers import them
+    each on their own.
+    """
+    ctx = multiprocessing.get_context(start_method)
+    method = ctx.get_start_method()
+    if method == "forkserver":
+        ctx.set_forkserver_preload(list(PRELOAD_MODULES))
+    elif method == "fork":
+        for name in PRELOAD_MODULES:
+            importlib.import_module(name)
+    return ctx
 
 
 class ProcessPoolExecutor(WorkerPoolExecutor):
     """Process in parallel with ProcessPoolExecutor"""
 
+    _serialize = True
+
+    def __init__(
+        self,
+        options: ParseOptions,
+        max_workers: Optional[int] = None,
+        prefetch: Optional[int] = None,
+        ordered: bool = False,
+        profile_dir: Optional[Path] = None,
+        largest_first: bool = False,
+        split_bytes: Optional[int] = None,
+        start_method: Optional[str] = None,
+    ) -> None:
+        """Initialize
+
+        Args:
+            start_method: How worker processes are started ("fork",
+                "forkserver" or "spawn"; default: that of the platform)
+
+        See WorkerPoolExecutor for the other arguments.
+        """
+        super().__init__(
+            options,
+            max_workers,
+            prefetch,
+            ordered,
+            profile_dir=profile_dir,
+            largest_first=largest_first,
+            split_bytes=split_bytes,
+        )
+        self.start_method = start_method
+
+    def _default_max_workers(self) -> int:
+        return os.cpu_count() or 1
+
     def _get_executor(self, max_workers: int) -> concurrent.futures.Executor:
-        max_workers = os.cpu_count() or 1
-        return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+        # PROJ のコンテキストはプロセス間で共有できないため、変換器は各ワーカーで作る
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=_get_mp_context(self.start_method),
+            initializer=warm_transformers,
+        )
 
 
 class ThreadPoolExecutor(WorkerPoolExecutor):
-    """Process in parallel with ThreadPoolExecutor"""
+    """Process in parallel with ThreadPoolExecutor
+
+    Profiling is not supported, as a profiler covers the whole process.
+    """
+
+    def __init__(
+        self,
+        options: ParseOptions,
+        max_workers: Optional[int] = None,
+        prefetch: Optional[int] = None,
+        ordered: bool = False,
+        profile_dir: Optional[Path] = None,
+        largest_first: bool = False,
+        split_bytes: Optional[int] = None,
+    ) -> None:
+        """Initialize"""
+        if profile_dir is not None:
+            raise ValueError("Profiling is not supported with the thread executor")
+        super().__init__(
+            options,
+            max_workers,
+            prefetch,
+            ordered,
+            largest_first=largest_first,
+            split_bytes=split_bytes,
+        )
+
+    def _default_max_workers(self) -> int:
+        return (os.cpu_count() or 1) * 2
 
     def _get_executor(self, max_workers: int) -> concurrent.futures.Executor:
-        max_workers = (os.cpu_count() or 1) * 2
-        return concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        return concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, initializer=warm_transformers
+        )
 
 
 class SingleThreadExecutor(BaseExecutor):
     """Process files with single-thread (normal) iterator"""
 
-    def iter_process(self, src_iter: Iterable[bytes]) -> Iterable[List[Feature]]:
-        """Convert XMLs to OGR features"""
-        for src in src_iter:
-            yield parse_raw(src, options=self.options)
+    def iter_tasks(
+        self, fn: Callable[..., T], args: Tuple[object, ...], items: Iterable[Any]
+    ) -> Iterable[Tuple[Any, T]]:
+        """Run ``fn(item, *args)`` in this thread, yielding (item, result) pairs"""
+        for item in items:
+            yield (item, fn(item, *args))
 
 
 EXECUTOR_MAP: Dict[str, Type[BaseExecutor]] = {
@@ -0,0 +1,194 @@
+"""Newline-delimited GeoJSON (GeoJSONSeq) output without fiona/OGR
+
+Each feature is written as one line of compact JSON, the same text as
+``json.dumps(feature, ensure_ascii=False, separators=(",", ":"))`` on the
+features of FeatureBatch.to_features(), but encoded straight from the
+columns of the batch. With files_to_geojsonseq() the encoding is done by the
+workers, so the parent only copies bytes to the output, which may be a file,
+a pipe or stdout ("-").
+"""
+
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import IO, Iterable, Iterator, List, Optional, Union
+
+from ..batch import FeatureBatch
+from ..reader import XMLSource, iter_content_sources
+from ..stats import StatsCollector
+from .checkpoint import Checkpoint
+from .executor import BaseExecutor
+from .sharding import ShardSpec
+
+_logger = logging.getLogger(__name__)
+
+# 標準出力に書き出す場合の出力先
+STDOUT = "-"
+
+# チェックポイントを確定する間隔 (秒)
+_CHECKPOINT_INTERVAL = 2.0
+
+_encode_string = json.JSONEncoder(ensure_ascii=False).encode
+
+
+def _encode_geometry(geometry_type: Optional[str], rings: List[str]) -> str:
+    """Encode the geometry of a feature from its rings (non-empty)"""
+    if geometry_type == "Point":
+        # 点は1点だけのリングとして持っている ("[[x,y]]")
+        return '{"type":"Point","coordinates":' + rings[0][1:-1] + "}"
+    if geometry_type == "LineString":
+        return '{"type":"LineString","coordinates":' + rings[0] + "}"
+    return '{"type":"MultiPolygon","coordinates":[[' + ",".join(rings) + "]]}"
+
+
+def encode_geojsonseq(batch: FeatureBatch) -> bytes:
+    """Encode a batch as GeoJSONSeq lines (UTF-8)"""
+    # 座標は小数点以下9ケタに丸めてあるので、repr() で十分に短くなる
+    values = list(map(repr, batch.coords.ravel().tolist()))
+    points = [f"[{values[i]},{values[i + 1]}]" for i in range(0, len(values), 2)]
+    ring_offsets = batch.ring_offsets.tolist()
+    rings = [
+        "[" + ",".join(points[a:b]) + "]"
+        for a, b in zip(ring_offsets[:-1], ring_offsets[1:])
+    ]
+    feature_offsets = batch.feature_offsets.tolist()
+    strings = [_encode_string(s) for s in batch.strings] + ["null"]  # -1 -> null
+    keys = [_encode_string(f) + ":" for f in batch.fields]
+
+    lines: List[str] = []
+    for i, row in enumerate(batch.properties.tolist()):
+        (r0, r1) = (feature_offsets[i], feature_offsets[i + 1])
+        geometry = "null"
+        if r1 > r0:
+            geometry = _encode_geometry(batch.geometry_type, rings[r0:r1])
+        properties = ",".join([k + strings[v] for k, v in zip(keys, row)])
+        lines.append(
+            '{"type":"Feature","geometry":'
+            + geometry
+            + ',"properties":{'
+            + properties
+            + "}}\n"
+        )
+    return "".join(lines).encode("utf-8")
+
+
+@contextmanager
+def _open_output(
+    dst_path: Union[str, Path], resume_at: Optional[int] = None
+) -> Iterator[IO[bytes]]:
+    """Open the output, "-" being stdout
+
+    With ``resume_at``, the file is kept up to that offset and appended to.
+    If the reader of a pipe goes away (e.g. ``| head``), writing stops
+    quietly instead of failing.
+    """
+    if str(dst_path) != STDOUT:
+        if resume_at is None:
+            with open(dst_path, "wb") as f:
+                yield f
+            return
+        with open(dst_path, "r+b") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < resume_at:
+                raise ValueError(
+                    f"{dst_path} is shorter than recorded in the checkpoint"
+                    f" ({size} < {resume_at} bytes)"
+                )
+            # 記録されていない (書きかけの) 部分を捨てる
+            f.truncate(resume_at)
+            f.seek(resume_at)
+            yield f
+        return
+    assert resume_at is None, "Cannot resume writing to stdout"
+    out = sys.stdout.buffer
+    try:
+        yield out
+        out.flush()
+    except BrokenPipeError:
+        # 終了時に再び flush して失敗しないよう、標準出力を /dev/null に向ける
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        os.close(devnull)
+        _logger.info("Output closed by the reader, stopping")
+
+
+def write_geojsonseq(
+    batches_iter: Iterable[FeatureBatch],
+    dst_path: Path,
+    driver: Optional[str] = None,
+    layer: Optional[str] = None,
+) -> None:
+    """Write batches as GeoJSONSeq, encoding them here
+
+    The features of any layer can be written (the file has no layer name, so
+    ``layer`` is not used).
+    """
+    assert driver in (None, "GeoJSONSeq"), f"Unsupported driver: {driver}"
+    with _open_output(dst_path) as out:
+        for batch in batches_iter:
+            out.write(encode_geojsonseq(batch))
+
+
+def _sync(out: IO[bytes]) -> None:
+    out.flush()
+    os.fsync(out.fileno())
+
+
+def files_to_geojsonseq(
+    src_paths: List[Path],
+    dst_path: Union[str, Path],
+    executor: BaseExecutor,
+    stats: Optional[StatsCollector] = None,
+    shard: Optional[ShardSpec] = None,
+    checkpoint_path: Optional[Path] = None,
+) -> None:
+    """Convert XML/ZIP files to GeoJSONSeq, encoding the features in the workers
+
+    ``dst_path`` may be "-" for stdout. With ``shard``, only the XMLs of the
+    shard are converted. With ``checkpoint_path``, the XMLs written are
+    recorded in that journal, and a rerun appends the ones not written yet.
+    """
+    sources = iter_content_sources(src_paths)
+    if shard is not None:
+        sources = shard.select(sources)
+    num_files = 0
+    num_features = 0
+    last_commit = time.perf_counter()
+    with ExitStack() as stack:
+        checkpoint: Optional[Checkpoint] = None
+        resume_at: Optional[int] = None
+        if checkpoint_path is not None:
+            checkpoint = stack.enter_context(
+                Checkpoint(checkpoint_path, executor.options, dst_path)
+            )
+            sources = checkpoint.pending(sources)
+            resume_at = checkpoint.offset()
+        # 出力を閉じてからチェックポイントを確定するよう、後に開く
+        out = stack.enter_context(_open_output(dst_path, resume_at))
+        for result in executor.iter_encoded(sources, encode_geojsonseq):
+            t0 = time.perf_counter()
+            out.write(result.data)
+            result.stats.add_time("write", time.perf_counter() - t0)
+            if checkpoint is not None:
+                assert isinstance(result.source, XMLSource)
+                checkpoint.record_source(result.source, out.tell())
+                if time.perf_counter() - last_commit >= _CHECKPOINT_INTERVAL:
+                    # 書き出した内容をディスクに載せてから記録を確定する
+                    _sync(out)
+                    checkpoint.commit()
+                    last_commit = time.perf_counter()
+            if stats is not None:
+                stats.add(result.stats)
+            num_files += 1
+            num_features += result.data.count(b"\n")
+            if num_files % 10 == 0:
+                _logger.info(
+                    f"{num_files} XML files processed, {num_features} features written"
+                )
+        if checkpoint is not None:
+            _sync(out)
+    _logger.info(f"{num_files} XML files processed, {num_features} features written")
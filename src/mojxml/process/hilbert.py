@@ -0,0 +1,211 @@
+"""Hilbert-sorted output: features ordered along a Hilbert curve
+
+Features are written in the order of the Hilbert key of the centre of their
+bounding box, so that features close to each other on the ground are close
+in the file too. Spatial indexes (the packed Hilbert R-tree of FlatGeobuf,
+the R*Tree of GeoPackage) are then built over clustered data, and bounding
+box queries read a few contiguous ranges of the file instead of pages
+scattered all over it.
+
+The sort is external: batches are collected up to ``memory_bytes``, sorted
+and spilled to a temporary file as a run, and the runs are merged at the end
+chunk by chunk, so memory use does not grow with the size of the output.
+"""
+
+import logging
+import struct
+import tempfile
+from contextlib import ExitStack
+from pathlib import Path
+from typing import IO, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from ..batch import FeatureBatch
+from .geojsonseq import STDOUT
+from .writers import Writer
+
+_logger = logging.getLogger(__name__)
+
+# メモリに溜める地物の大きさの上限 (超えると整列して一時ファイルに書き出す)
+DEFAULT_MEMORY_BYTES = 256 * 1024 * 1024
+
+# 軸ごとのビット数 (経度方向で約1cmの解像度)
+_ORDER = 32
+# キーを計算する範囲 (経度・緯度)
+_EXTENT = (-180.0, -90.0, 180.0, 90.0)
+# ジオメトリのない地物は最後に並べる
+_NO_GEOMETRY_KEY = np.iinfo(np.uint64).max
+# 一時ファイルへの書き出しと結合の単位 (地物の数)
+_CHUNK_SIZE = 16384
+# チャンクの地物の数とバッチのバイト数
+_CHUNK_HEADER = struct.Struct("<QQ")
+
+# 整列済みの (キー, バッチ) の列
+_Run = Iterator[Tuple[npt.NDArray[np.uint64], FeatureBatch]]
+
+
+def _hilbert_index(
+    x: npt.NDArray[np.uint64], y: npt.NDArray[np.uint64]
+) -> npt.NDArray[np.uint64]:
+    """Get the distance along the Hilbert curve of cells (x, y) of 2^_ORDER"""
+    (x, y) = (x.copy(), y.copy())
+    d = np.zeros(len(x), dtype=np.uint64)
+    last = np.uint64((1 << _ORDER) - 1)
+    for bit in range(_ORDER - 1, -1, -1):
+        s = np.uint64(1 << bit)
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        quadrant = (3 * rx.astype(np.uint64)) ^ ry.astype(np.uint64)
+        d += np.uint64(1 << (2 * bit)) * quadrant
+        # 象限に合わせて回転する
+        flip = rx & ~ry
+        x[flip] = last - x[flip]
+        y[flip] = last - y[flip]
+        swap = ~ry
+        (x[swap], y[swap]) = (y[swap], x[swap])
+    return d
+
+
+def hilbert_keys(bounds: npt.NDArray[np.float64]) -> npt.NDArray[np.uint64]:
+    """Get the Hilbert keys of the centres of (minx, miny, maxx, maxy) boxes
+
+    Boxes of features without geometry (NaN) get the largest key.
+    """
+    (minx, miny, maxx, maxy) = _EXTENT
+    scale = float((1 << _ORDER) - 1)
+    has_geometry = ~np.isnan(bounds[:, 0])
+    cells = []
+    for axis, (lo, hi) in enumerate(((minx, maxx), (miny, maxy))):
+        centre = (bounds[has_geometry, axis] + bounds[has_geometry, axis + 2]) / 2
+        cell = np.zeros(len(bounds), dtype=np.uint64)
+        cell[has_geometry] = np.clip((centre - lo) / (hi - lo), 0.0, 1.0) * scale
+        cells.append(cell)
+    keys = _hilbert_index(*cells)
+    keys[~has_geometry] = _NO_GEOMETRY_KEY
+    return keys
+
+
+def _nbytes(batch: FeatureBatch) -> int:
+    """Estimate the memory used by a batch"""
+    arrays = (batch.coords, batch.properties, batch.ring_offsets, batch.feature_offsets)
+    # 文字列はオブジェクトの大きさも含めておおよそで見積もる
+    return sum(a.nbytes for a in arrays) + sum(len(s) * 3 + 64 for s in batch.strings)
+
+
+def _sort(
+    pending: List[Tuple[npt.NDArray[np.uint64], FeatureBatch]],
+) -> Tuple[npt.NDArray[np.uint64], FeatureBatch]:
+    keys = np.concatenate([k for k, _ in pending])
+    batch = FeatureBatch.concat([b for _, b in pending])
+    order = np.argsort(keys, kind="stable")
+    return (keys[order], batch.take(order))
+
+
+def _iter_chunks(keys: npt.NDArray[np.uint64], batch: FeatureBatch) -> _Run:
+    for start in range(0, len(batch), _CHUNK_SIZE):
+        stop = min(start + _CHUNK_SIZE, len(batch))
+        yield (keys[start:stop], batch.take(np.arange(start, stop)).compact())
+
+
+def _write_run(f: IO[bytes], run: _Run) -> None:
+    for keys, batch in run:
+        blob = batch.to_bytes()
+        f.write(_CHUNK_HEADER.pack(len(keys), len(blob)))
+        f.write(keys.tobytes())
+        f.write(blob)
+
+
+def _read_run(f: IO[bytes]) -> _Run:
+    f.seek(0)
+    while header := f.read(_CHUNK_HEADER.size):
+        (num_keys, size) = _CHUNK_HEADER.unpack(header)
+        keys = np.frombuffer(f.read(num_keys * 8), dtype=np.uint64)
+        yield (keys, FeatureBatch.from_bytes(f.read(size)))
+
+
+def _merge_runs(runs: List[_Run]) -> Iterator[FeatureBatch]:
+    """Merge sorted runs, a range of keys at a time"""
+    # 各 run の現在のチャンクと、その中の位置
+    heads: List[Optional[Tuple[npt.NDArray[np.uint64], FeatureBatch, int]]] = []
+    for run in runs:
+        chunk = next(run, None)
+        heads.append(None if chunk is None else (*chunk, 0))
+    while True:
+        active = [(i, head) for i, head in enumerate(heads) if head is not None]
+        if not active:
+            return
+        # どの run の現在のチャンクにも収まるキーまでは、順序が確定している
+        bound = min(keys[-1] for _, (keys, _, _) in active)
+        keys_parts: List[npt.NDArray[np.uint64]] = []
+        batch_parts: List[FeatureBatch] = []
+        for i, (keys, batch, pos) in active:
+            end = int(np.searchsorted(keys, bound, side="right"))
+            if end > pos:
+                keys_parts.append(keys[pos:end])
+                batch_parts.append(batch.take(np.arange(pos, end)))
+            if end < len(keys):
+                heads[i] = (keys, batch, end)
+            else:
+                chunk = next(runs[i], None)
+                heads[i] = None if chunk is None else (*chunk, 0)
+        order = np.argsort(np.concatenate(keys_parts), kind="stable")
+        yield FeatureBatch.concat(batch_parts).take(order).compact()
+
+
+def sort_batches(
+    batches_iter: Iterable[FeatureBatch],
+    memory_bytes: int = DEFAULT_MEMORY_BYTES,
+    tmp_dir: Optional[Path] = None,
+) -> Iterator[FeatureBatch]:
+    """Reorder the features of batches along the Hilbert curve
+
+    Sorted runs larger than ``memory_bytes`` are spilled to temporary files
+    in ``tmp_dir``.
+    """
+    with ExitStack() as stack:
+        run_files: List[IO[bytes]] = []
+        pending: List[Tuple[npt.NDArray[np.uint64], FeatureBatch]] = []
+        pending_bytes = 0
+        for batch in batches_iter:
+            if len(batch) == 0:
+                continue
+            pending.append((hilbert_keys(batch.bounds()), batch))
+            pending_bytes += _nbytes(batch)
+            if pending_bytes >= memory_bytes:
+                f = stack.enter_context(
+                    tempfile.TemporaryFile(prefix="mojxml-sort-", dir=tmp_dir)
+                )
+                _write_run(f, _iter_chunks(*_sort(pending)))
+                run_files.append(f)
+                pending = []
+                pending_bytes = 0
+
+        # 最後の run はメモリに置いたまま結合する
+        runs = [_read_run(f) for f in run_files]
+        if pending:
+            runs.append(_iter_chunks(*_sort(pending)))
+        if len(runs) > 1:
+            _logger.info(f"Merging {len(runs)} sorted runs")
+            yield from _merge_runs(runs)
+        else:
+            for run in runs:
+                yield from (batch for _, batch in run)
+
+
+def hilbert_sorted(write: Writer, memory_bytes: int = DEFAULT_MEMORY_BYTES) -> Writer:
+    """Wrap a writer to write the features in Hilbert order
+
+    Runs are spilled next to the output.
+    """
+
+    def write_sorted(
+        batches_iter: Iterable[FeatureBatch],
+        dst_path: Path,
+        driver: Optional[str] = None,
+    ) -> None:
+        tmp_dir = None if str(dst_path) == STDOUT else Path(dst_path).parent
+        write(sort_batches(batches_iter, memory_bytes, tmp_dir), dst_path, driver)
+
+    return write_sorted
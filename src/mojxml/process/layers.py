@@ -0,0 +1,151 @@
+"""Output of several layers (筆, 図郭, 筆界線, ...) read in one pass over the XMLs
+
+The layers of ParseOptions.layers are all parsed from the same pass over each
+XML. The first layer is streamed to the writer as the XMLs are processed; the
+others are spooled to temporary files next to the output and written once the
+first layer is done, so that memory use does not grow with their size.
+
+A GeoPackage gets all the layers as tables of the same file. Other formats
+get one file per layer: 筆 is written to the output path and the other layers
+to ``<stem>_<layer><suffix>`` beside it.
+"""
+
+import logging
+import struct
+import tempfile
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Union
+
+from ..batch import FeatureBatch
+from ..reader import iter_content_sources
+from ..schema import FUDE_LAYER
+from ..stats import StatsCollector
+from .executor import BaseExecutor, ParseResult
+from .sharding import ShardSpec
+from .writers import LAYER_WRITER_MAP, LayerWriter
+
+_logger = logging.getLogger(__name__)
+
+_GPKG_SUFFIXES = (".gpkg",)
+
+# 一時ファイルに書き出すバッチのバイト数
+_SIZE = struct.Struct("<Q")
+
+
+def is_multi_layer_file(dst_path: Path, driver: Optional[str] = None) -> bool:
+    """Whether all the layers are written into the one file (GeoPackage)"""
+    if driver is not None:
+        return driver == "GPKG"
+    return Path(dst_path).suffix.lower() in _GPKG_SUFFIXES
+
+
+def layer_path(dst_path: Path, layer: str, driver: Optional[str] = None) -> Path:
+    """Get the path a layer is written to"""
+    dst_path = Path(dst_path)
+    if layer == FUDE_LAYER or is_multi_layer_file(dst_path, driver):
+        return dst_path
+    return dst_path.with_name(f"{dst_path.stem}_{layer}{dst_path.suffix}")
+
+
+def _read_spool(f: IO[bytes]) -> Iterator[FeatureBatch]:
+    f.seek(0)
+    while header := f.read(_SIZE.size):
+        (size,) = _SIZE.unpack(header)
+        yield FeatureBatch.from_bytes(f.read(size))
+
+
+class _Spooler:
+    """Stream the first layer, spooling the others to temporary files"""
+
+    def __init__(
+        self,
+        layers: List[str],
+        stack: ExitStack,
+        tmp_dir: Path,
+        stats: Optional[StatsCollector],
+    ) -> None:
+        self.first = layers[0]
+        self.spools: Dict[str, IO[bytes]] = {
+            name: stack.enter_context(
+                tempfile.TemporaryFile(prefix="mojxml-layer-", dir=tmp_dir)
+            )
+            for name in layers[1:]
+        }
+        self.stats = stats
+        self.num_files = 0
+        self.num_features = {name: 0 for name in layers}
+
+    def _spool(self, result: ParseResult) -> FeatureBatch:
+        assert result.layers is not None
+        for name, f in self.spools.items():
+            batch = result.layers[name]
+            self.num_features[name] += len(batch)
+            if len(batch):
+                blob = batch.to_bytes()
+                f.write(_SIZE.pack(len(blob)))
+                f.write(blob)
+        batch = result.layers[self.first]
+        self.num_features[self.first] += len(batch)
+        return batch
+
+    def iter_first(self, results: Iterable[ParseResult]) -> Iterator[FeatureBatch]:
+        """Yield the batches of the first layer, spooling the other layers"""
+        for result in results:
+            t0 = time.perf_counter()
+            yield self._spool(result)
+            result.stats.add_time("write", time.perf_counter() - t0)
+            if self.stats is not None:
+                self.stats.add(result.stats)
+            self.num_files += 1
+            if self.num_files % 10 == 0:
+                _logger.info(f"{self.num_files} XML files processed")
+        _logger.info(f"{self.num_files} XML files processed")
+
+    def iter_spooled(self, layer: str) -> Iterator[FeatureBatch]:
+        """Yield the batches of a spooled layer"""
+        return _read_spool(self.spools[layer])
+
+
+def files_to_layers(
+    src_paths: List[Path],
+    dst_path: Path,
+    executor: BaseExecutor,
+    driver: Optional[str] = None,
+    writer: Union[str, LayerWriter] = "fiona",
+    stats: Optional[StatsCollector] = None,
+    shard: Optional[ShardSpec] = None,
+) -> None:
+    """Generate the layers of ``executor.options.layers`` from XML/ZIP files
+
+    ``writer`` is one of LAYER_WRITER_MAP ("fiona", "arrow", "geojsonseq")
+    or a function taking the same arguments.
+    """
+    layers = list(executor.options.layers)
+    if isinstance(writer, str):
+        if writer not in LAYER_WRITER_MAP:
+            raise ValueError(f"The {writer} writer cannot write several layers")
+        writer = LAYER_WRITER_MAP[writer]
+    dst_path = Path(dst_path)
+    if is_multi_layer_file(dst_path, driver):
+        # 既存のファイルにはレイヤーが追加されてしまうので、作り直す
+        dst_path.unlink(missing_ok=True)
+    sources = iter_content_sources(src_paths)
+    if shard is not None:
+        sources = shard.select(sources)
+    with ExitStack() as stack:
+        spooler = _Spooler(layers, stack, dst_path.parent, stats)
+        results = executor.iter_results(sources)
+        first = layers[0]
+        writer(
+            spooler.iter_first(results),
+            layer_path(dst_path, first, driver),
+            driver,
+            first,
+        )
+        for name in layers[1:]:
+            path = layer_path(dst_path, name, driver)
+            writer(spooler.iter_spooled(name), path, driver, name)
+    for name in layers:
+        _logger.info(f"{name}: {spooler.num_features[name]} features written")
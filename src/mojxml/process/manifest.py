@@ -0,0 +1,238 @@
+"""Sidecar manifest for incremental conversion
+
+Every year the whole dataset is republished, but most of the XMLs in it are
+unchanged. The manifest (a SQLite file) remembers, for each zip member, the
+CRC32 and size recorded in the central directory of the archive together with
+the parse output. On re-runs, members whose CRC32 and size still match are not
+decompressed nor parsed again; their cached batches are spliced in instead.
+Members that are no longer in their archive are pruned from the manifest.
+"""
+
+import logging
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Union
+
+from ..batch import FeatureBatch
+from ..parse import ParseOptions
+from ..reader import Source, ZipMemberSource
+from ..stats import FileStats
+from .executor import BaseExecutor, ParseResult
+
+_logger = logging.getLogger(__name__)
+
+_COMMIT_INTERVAL = 100
+
+# 現在の形式のバッチの先頭 (マジックナンバーとバージョン)。古い形式のものは使わない
+_BATCH_PREFIX = FeatureBatch.empty([]).to_bytes()[:8]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS members (
+    member TEXT NOT NULL,
+    options TEXT NOT NULL,
+    archive TEXT NOT NULL,
+    crc32 INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    num_features INTEGER NOT NULL,
+    batch BLOB NOT NULL,
+    PRIMARY KEY (member, options)
+)
+"""
+
+
+class ManifestStats(NamedTuple):
+    """Number of members reused from the manifest, (re)parsed and pruned"""
+
+    reused: int
+    parsed: int
+    pruned: int = 0
+
+
+class Manifest:
+    """SQLite manifest of zip members and their cached parse output
+
+    Entries are keyed by the member name (e.g. ``12103-0400-76.zip``), which
+    is stable across releases even if the outer archive is renamed, and by
+    the parse options, since they change the output. Plain .xml files have no
+    central directory to check against and are always parsed.
+    """
+
+    def __init__(self, path: Union[str, Path], options: ParseOptions) -> None:
+        """Open (or create) the manifest"""
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(_SCHEMA)
+        self._options_key = options.cache_key()
+        self._num_uncommitted = 0
+        self.stats = ManifestStats(0, 0)
+
+    def __enter__(self) -> "Manifest":
+        """Enter the context"""
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        """Commit and close"""
+        self.close()
+
+    def close(self) -> None:
+        """Commit and close"""
+        self._conn.commit()
+        self._conn.close()
+
+    def lookup(self, src: ZipMemberSource) -> Optional[int]:
+        """Get the feature count cached for an unchanged member"""
+        row = self._conn.execute(
+            "SELECT num_features FROM members"
+            " WHERE member = ? AND options = ? AND crc32 = ? AND size = ?"
+            " AND substr(batch, 1, ?) = ?",
+            (
+                src.member,
+                self._options_key,
+                src.crc32,
+                src.size,
+                len(_BATCH_PREFIX),
+                _BATCH_PREFIX,
+            ),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def load(self, src: ZipMemberSource) -> Optional[FeatureBatch]:
+        """Get the batch cached for an unchanged member"""
+        row = self._conn.execute(
+            "SELECT batch FROM members"
+            " WHERE member = ? AND options = ? AND crc32 = ? AND size = ?",
+            (src.member, self._options_key, src.crc32, src.size),
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            return FeatureBatch.from_bytes(row[0])
+        except ValueError:
+            # 古い形式で保存されたものは再度パースする
+            return None
+
+    def store(self, src: ZipMemberSource, batch: FeatureBatch) -> None:
+        """Record the parse output of a member"""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                src.member,
+                self._options_key,
+                str(src.archive),
+                src.crc32,
+                src.size,
+                len(batch),
+                batch.to_bytes(),
+            ),
+        )
+        self._num_uncommitted += 1
+        if self._num_uncommitted >= _COMMIT_INTERVAL:
+            self._conn.commit()
+            self._num_uncommitted = 0
+
+    def iter_batches(
+        self, executor: BaseExecutor, src_iter: Iterable[Source]
+    ) -> Iterable[FeatureBatch]:
+        """Iterate batches, parsing only the members changed since the last run"""
+        for result in self.iter_results(executor, src_iter):
+            yield result.batch
+
+    def prune(self, seen: Iterable[ZipMemberSource]) -> int:
+        """Delete the members no longer in the archives of the ``seen`` members
+
+        Members of other archives are kept. Returns the number of rows deleted.
+        """
+        archives: Dict[str, List[str]] = {}
+        for src in seen:
+            archives.setdefault(str(src.archive), []).append(src.member)
+        deleted = 0
+        for archive, members in archives.items():
+            # アーカイブの名前が変わった場合に備えて、見つかったメンバーの記録を更新する
+            self._conn.executemany(
+                "UPDATE members SET archive = ? WHERE member = ?",
+                [(archive, member) for member in members],
+            )
+            placeholders = ",".join("?" * len(members))
+            cursor = self._conn.execute(
+                "DELETE FROM members"
+                f" WHERE archive = ? AND member NOT IN ({placeholders})",
+                (archive, *members),
+            )
+            deleted += cursor.rowcount
+        self._conn.commit()
+        self._num_uncommitted = 0
+        return deleted
+
+    def _load_result(self, src: ZipMemberSource) -> ParseResult:
+        file_stats = FileStats(name=src.name, cached=True)
+        with file_stats.timer("load"):
+            batch = self.load(src)
+        # lookup() で現在の形式のものがあることを確認済み
+        assert batch is not None
+        file_stats.features = len(batch)
+        self.stats = self.stats._replace(reused=self.stats.reused + 1)
+        return ParseResult(src, batch, file_stats)
+
+    def _store_result(self, result: ParseResult) -> ParseResult:
+        if isinstance(result.source, ZipMemberSource):
+            self.store(result.source, result.batch)
+        self.stats = self.stats._replace(parsed=self.stats.parsed + 1)
+        return result
+
+    def iter_results(
+        self,
+        executor: BaseExecutor,
+        src_iter: Iterable[Source],
+        prune: bool = False,
+    ) -> Iterable[ParseResult]:
+        """Iterate results, parsing only the members changed since the last run
+
+        The results parsed by the executor are recorded in the manifest. If the
+        executor preserves the order of the sources, cached and parsed results
+        are yielded in that order too; otherwise the cached ones come first.
+
+        With ``prune``, once all the results are read, the members that are no
+        longer in the archives read are deleted from the manifest (only when
+        every member of those archives was given, e.g. not with shards).
+        """
+        sources = list(src_iter)
+        cached = [
+            isinstance(src, ZipMemberSource) and self.lookup(src) is not None
+            for src in sources
+        ]
+        changed = [src for src, hit in zip(sources, cached) if not hit]
+        parsed = iter(executor.iter_results(changed))
+        if executor.preserves_order:
+            yield from self._iter_in_order(sources, cached, parsed)
+        else:
+            for src, hit in zip(sources, cached):
+                if hit:
+                    assert isinstance(src, ZipMemberSource)
+                    yield self._load_result(src)
+            for result in parsed:
+                yield self._store_result(result)
+
+        if prune:
+            members = [src for src in sources if isinstance(src, ZipMemberSource)]
+            pruned = self.prune(members)
+            self.stats = self.stats._replace(pruned=self.stats.pruned + pruned)
+        _logger.info(
+            f"manifest: {self.stats.reused} XML files reused,"
+            f" {self.stats.parsed} XML files parsed,"
+            f" {self.stats.pruned} removed members pruned"
+        )
+
+    def _iter_in_order(
+        self,
+        sources: List[Source],
+        cached: List[bool],
+        parsed: Iterator[ParseResult],
+    ) -> Iterator[ParseResult]:
+        """Interleave cached and parsed results in the order of the sources"""
+        for src, hit in zip(sources, cached):
+            if hit:
+                assert isinstance(src, ZipMemberSource)
+                yield self._load_result(src)
+            else:
+                result = next(parsed)
+                assert result.source == src
+                yield self._store_result(result)
@@ -0,0 +1,338 @@
+"""Partitioned output: each worker writes its own shards, optionally merged
+
+Instead of funneling every batch back to a single writer in the parent, the
+sources are grouped into tasks of ``files_per_shard`` files and each worker
+parses its task and writes the shard files itself, in the target format.
+
+Shards are laid out as a directory dataset, either Hive-style per
+市区町村コード (``city_code=12103/part-00000.parquet``) or flat
+(``part-00000.gpkg``). They can be left as is (e.g. to be read as a
+partitioned GeoParquet dataset) or merged into a single file afterwards.
+
+With ``--shard i/N``, the shard files are named ``part-<i>of<N>-00000`` so
+that several machines can write into the same directory. With a checkpoint,
+the shard files of completed tasks are recorded, and a rerun after a crash
+keeps them and converts the remaining XMLs only.
+"""
+
+import logging
+import shutil
+import time
+from contextlib import ExitStack
+from itertools import islice
+from pathlib import Path
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from ..batch import FeatureBatch
+from ..parse import ParseOptions
+from ..reader import Source, XMLSource, iter_content_sources
+from ..schema import OGR_SCHEMA
+from ..stats import FileStats, StatsCollector
+from .arrow import merge_geoparquet
+from .checkpoint import Checkpoint, RecordedShard
+from .executor import BaseExecutor, _read_and_parse
+from .sharding import ShardSpec
+from .writers import WRITER_MAP
+
+_logger = logging.getLogger(__name__)
+
+# シャードの分け方
+# - city: 市区町村コードごと (タスク内のファイルを市区町村コードで分ける)
+# - files: タスク (files_per_shard 個のファイル) ごと
+PARTITION_KEYS = ("city", "files")
+
+_CITY_FIELD = "市区町村コード"
+# Hive形式のディレクトリ名のキー (市区町村コードの列と衝突しないように別名にする)
+_CITY_PARTITION_KEY = "city_code"
+_GEOJSONSEQ_SUFFIXES = (".geojsonl", ".geojsons")
+_PARQUET_SUFFIXES = (".parquet", ".geoparquet")
+
+
+class Shard(NamedTuple):
+    """A shard file written by a worker"""
+
+    path: Path
+    city_code: Optional[str]
+    num_features: int
+
+
+# ワーカーに渡すタスク (通し番号とソース)
+_Task = Tuple[int, List[Source]]
+
+
+def _city_code(batch: FeatureBatch) -> Optional[str]:
+    # 1つのXMLファイルの筆はすべて同じ市区町村に属する
+    if len(batch) == 0:
+        return None
+    index = batch.properties[0, batch.fields.index(_CITY_FIELD)]
+    return batch.strings[index] if index >= 0 else None
+
+
+def _shard_prefix(shard: Optional[ShardSpec]) -> str:
+    if shard is None:
+        return "part-"
+    return f"part-{shard.index}of{shard.count}-"
+
+
+def _shard_path(
+    root: Path,
+    task_index: int,
+    suffix: str,
+    partition_by: str,
+    city_code: Optional[str],
+    prefix: str = "part-",
+) -> Path:
+    name = f"{prefix}{task_index:05d}{suffix}"
+    if partition_by == "city":
+        return root / f"{_CITY_PARTITION_KEY}={city_code}" / name
+    return root / name
+
+
+def _write_shards(
+    task: _Task,
+    options: ParseOptions,
+    root: Path,
+    suffix: str,
+    writer: str,
+    driver: Optional[str],
+    partition_by: str,
+    prefix: str = "part-",
+) -> Tuple[List[Shard], List[FileStats]]:
+    """Parse the sources of a task and write them as shards, in the worker"""
+    (task_index, sources) = task
+    results = [_read_and_parse(src, options, encode=None) for src in sources]
+
+    groups: Dict[Optional[str], List[FeatureBatch]] = {}
+    for batch, _ in results:
+        assert isinstance(batch, FeatureBatch)
+        if len(batch):
+            key = _city_code(batch) if partition_by == "city" else None
+            groups.setdefault(key, []).append(batch)
+
+    t0 = time.perf_counter()
+    shards: List[Shard] = []
+    for city_code, batches in groups.items():
+        path = _shard_path(root, task_index, suffix, partition_by, city_code, prefix)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        WRITER_MAP[writer](batches, path, driver)
+        shards.append(Shard(path, city_code, sum(len(b) for b in batches)))
+    write_time = time.perf_counter() - t0
+
+    # 書き込み時間は地物の数に応じて各ファイルに配分する
+    num_features = sum(len(batch) for batch, _ in results)
+    file_stats: List[FileStats] = []
+    for batch, stats in results:
+        assert isinstance(batch, FeatureBatch)
+        if num_features:
+            stats.add_time("write", write_time * len(batch) / num_features)
+        file_stats.append(stats)
+    return (shards, file_stats)
+
+
+def _iter_tasks(
+    sources: Iterable[Source], files_per_shard: int, first_index: int = 0
+) -> Iterator[_Task]:
+    it = iter(sources)
+    task_index = first_index
+    while chunk := list(islice(it, files_per_shard)):
+        yield (task_index, chunk)
+        task_index += 1
+
+
+# merge_shards() で結合できない形式の writer (弧を共有する TopoJSON は追記できない)
+UNMERGEABLE_WRITERS = ("topojson",)
+
+
+def _check_merge(writer: str, merge: bool) -> None:
+    """Fail if the shards are to be merged but the writer does not allow it"""
+    if merge and writer in UNMERGEABLE_WRITERS:
+        raise ValueError(f"Shards of the {writer} writer cannot be merged")
+
+
+def _is_geojsonseq(path: Path, driver: Optional[str]) -> bool:
+    if driver is not None:
+        return driver == "GeoJSONSeq"
+    return path.suffix.lower() in _GEOJSONSEQ_SUFFIXES
+
+
+def _is_parquet(path: Path, driver: Optional[str]) -> bool:
+    if driver is not None:
+        return driver == "Parquet"
+    return path.suffix.lower() in _PARQUET_SUFFIXES
+
+
+def merge_shards(
+    shard_paths: List[Path], dst_path: Path, driver: Optional[str] = None
+) -> None:
+    """Merge shard files into a single file of the same format
+
+    GeoJSONSeq shards are concatenated byte by byte and GeoParquet shards row
+    group by row group. Other formats (GeoPackage, FlatGeobuf, etc.) are
+    appended record by record into the destination, as ``ogr2ogr -append``
+    would do.
+    """
+    if _is_geojsonseq(dst_path, driver):
+        with open(dst_path, "wb") as dst:
+            for path in shard_paths:
+                with open(path, "rb") as src:
+                    shutil.copyfileobj(src, dst)
+        return
+
+    if _is_parquet(dst_path, driver):
+        merge_geoparquet(shard_paths, dst_path)
+        return
+
+    import fiona
+
+    with fiona.open(
+        dst_path,
+        "w",
+        driver=driver,
+        schema=OGR_SCHEMA,
+        crs="EPSG:4326",
+    ) as dst:
+        for path in shard_paths:
+            with fiona.open(path) as src:
+                dst.writerecords(src)
+
+
+def files_to_partitioned_output(
+    src_paths: List[Path],
+    dst_path: Path,
+    executor: BaseExecutor,
+    driver: Optional[str] = None,
+    writer: str = "fiona",
+    partition_by: str = "city",
+    files_per_shard: int = 16,
+    merge: bool = False,
+    stats: Optional[StatsCollector] = None,
+    shard: Optional[ShardSpec] = None,
+    checkpoint_path: Optional[Path] = None,
+) -> List[Shard]:
+    """Convert XML/ZIP files into shards written in parallel by the workers
+
+    Without ``merge``, ``dst_path`` is a directory that receives the shards,
+    named after the extension of ``dst_path`` (e.g. ``out.parquet/``). With
+    ``merge``, the shards are written next to ``dst_path`` and then merged
+    into it.
+
+    With ``shard``, only the XMLs assigned to that shard are converted. With
+    ``checkpoint_path``, completed tasks are recorded in that journal and a
+    rerun resumes the conversion (the journal is cleared once merged).
+
+    Returns the shards written (already removed if merged).
+    """
+    assert partition_by in PARTITION_KEYS, f"Unknown partition: {partition_by}"
+    _check_merge(writer, merge)
+    dst_path = Path(dst_path)
+    root = dst_path.with_name(dst_path.name + ".parts") if merge else dst_path
+    prefix = _shard_prefix(shard)
+    sources: Iterable[XMLSource] = iter_content_sources(src_paths)
+    if shard is not None:
+        sources = shard.select(sources)
+
+    with ExitStack() as stack:
+        shards: List[Shard] = []
+        first_task = 0
+        checkpoint: Optional[Checkpoint] = None
+        if checkpoint_path is not None:
+            checkpoint = stack.enter_context(
+                Checkpoint(checkpoint_path, executor.options, root)
+            )
+            recorded = checkpoint.shards()
+            shards = [
+                Shard(root / r.path, r.city_code, r.num_features) for r in recorded
+            ]
+            first_task = max((r.task for r in recorded), default=-1) + 1
+            sources = checkpoint.pending(sources)
+        _prepare_root(root, prefix, {s.path for s in shards}, checkpoint is not None)
+
+        tasks = _iter_tasks(sources, files_per_shard, first_task)
+        args = (
+            executor.options,
+            root,
+            dst_path.suffix,
+            writer,
+            driver,
+            partition_by,
+            prefix,
+        )
+        num_files = 0
+        num_features = 0
+        for task, (task_shards, file_stats) in executor.iter_tasks(
+            _write_shards, args, tasks
+        ):
+            if checkpoint is not None:
+                _record_task(checkpoint, root, task, task_shards)
+            shards.extend(task_shards)
+            num_files += len(file_stats)
+            num_features += sum(s.num_features for s in task_shards)
+            _logger.info(
+                f"{num_files} XML files processed, {num_features} features written"
+            )
+            if stats is not None:
+                for s in file_stats:
+                    stats.add(s)
+
+        # ワーカーの完了順ではなく、市区町村コード・タスクの順に並べる
+        shards.sort(key=lambda shard: (shard.city_code or "", shard.path.name))
+        if merge:
+            t0 = time.perf_counter()
+            merge_shards([shard.path for shard in shards], dst_path, driver)
+            if stats is not None:
+                stats.add_time("merge", time.perf_counter() - t0)
+            shutil.rmtree(root)
+            if checkpoint is not None:
+                checkpoint.clear()
+            _logger.info(f"{len(shards)} shards merged into {dst_path}")
+    return shards
+
+
+def _prepare_root(root: Path, prefix: str, recorded: Set[Path], resume: bool) -> None:
+    """Create the shard directory, checking for (or removing) stale shards
+
+    Shards of other machines (with other prefixes) are left alone. When
+    resuming, shards not recorded in the checkpoint were left by tasks that
+    did not complete, and are removed.
+    """
+    root.mkdir(parents=True, exist_ok=True)
+    stale = [
+        path
+        for path in root.rglob(prefix + "*")
+        if path.is_file() and path not in recorded
+    ]
+    if stale and not resume:
+        raise FileExistsError(f"Shard directory already has shards: {root}")
+    for path in stale:
+        _logger.info(f"Removing incomplete shard {path}")
+        path.unlink()
+
+
+def _record_task(
+    checkpoint: Checkpoint, root: Path, task: _Task, shards: List[Shard]
+) -> None:
+    """Record a completed task (its sources and shards) in the checkpoint"""
+    (task_index, sources) = task
+    for shard in shards:
+        checkpoint.record_shard(
+            RecordedShard(
+                task_index,
+                shard.path.relative_to(root).as_posix(),
+                shard.city_code,
+                shard.num_features,
+            )
+        )
+    for src in sources:
+        assert isinstance(src, XMLSource)
+        checkpoint.record_source(src)
+    # シャードはワーカーが書き終えて閉じている
+    checkpoint.commit()
@@ -0,0 +1,285 @@
+"""Task scheduling: largest sources first, and large XMLs split into parts
+
+A single large XML would otherwise keep one worker busy long after the
+others have finished. Sources are ordered by size (largest first), and XMLs
+larger than ``split_bytes`` are cut into parts (see mojxml.parts). The parts
+of the 空間属性 are parsed by several workers and their tables resolved in the
+parent, then the 筆 of the parts of the 主題属性 are built by several workers.
+
+The parts are read from the same memory-mapped file by every worker, so the
+XML itself is never sent through the pool, nor are the resolved tables, which
+the workers memory-map too; only arrays and batches come back. XMLs inside
+zips are decompressed once into a temporary file for that purpose, and
+removed once merged.
+"""
+
+import mmap
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from ..batch import FeatureBatch
+from ..parse import FUDE_FIELDS, ParseOptions, match_header
+from ..parts import (
+    PartialParse,
+    PartRange,
+    SharedTables,
+    build_part,
+    concat_parts,
+    merge_parts,
+    parse_part,
+    part_content,
+    split_xml,
+)
+from ..reader import Source, XMLFileSource, XMLSource, ZipMemberSource
+from ..stats import FileStats
+
+_SPATIAL = "空間属性".encode()
+
+# ZIPに入ったZIP (1つのXMLを含む) は、展開するとおよそこの倍以上の大きさになる
+_NESTED_ZIP_RATIO = 10
+
+
+class PartTask(NamedTuple):
+    """A part of the 空間属性 of a large XML, read from ``path`` by the worker"""
+
+    # 分割したXMLの通し番号
+    key: int
+    source: XMLSource
+    path: Path
+    prologue_end: int
+    part: PartRange
+    part_index: int
+    num_parts: int
+    # 主題属性の部分 (空間属性の部分をすべて結合してから、筆を組み立てる)
+    fude_parts: Tuple[PartRange, ...]
+
+
+class FudeTask(NamedTuple):
+    """A part of the 主題属性 of a large XML, whose 筆 the worker builds"""
+
+    source: XMLSource
+    path: Path
+    prologue_end: int
+    part: PartRange
+    part_index: int
+    tables: SharedTables
+
+
+# ワーカーから返す値 (部分的な解析結果)
+PartPayload = Tuple[PartialParse, FileStats]
+FudePayload = Tuple[FeatureBatch, FileStats]
+
+
+def source_size(src: Source) -> int:
+    """Get the size of a source (of the zip member for zip members)"""
+    if isinstance(src, bytes):
+        return len(src)
+    if isinstance(src, XMLFileSource):
+        return src.path.stat().st_size
+    if isinstance(src, ZipMemberSource):
+        return src.size
+    return 0  # pragma: no cover
+
+
+def _estimated_xml_size(src: Source) -> int:
+    size = source_size(src)
+    if isinstance(src, ZipMemberSource) and src.member.endswith(".zip"):
+        size *= _NESTED_ZIP_RATIO
+    return size
+
+
+def _spill(src: XMLSource) -> Path:
+    """Decompress the XML into a temporary file"""
+    (fd, name) = tempfile.mkstemp(prefix="mojxml-", suffix=".xml")
+    try:
+        with os.fdopen(fd, "wb") as out, src.open() as f:
+            shutil.copyfileobj(f, out, 1024 * 1024)
+    except BaseException:
+        os.unlink(name)
+        raise
+    return Path(name)
+
+
+def _split(key: int, src: XMLSource, path: Path, split_bytes: int) -> List[PartTask]:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            layout = split_xml(mm, split_bytes)
+    if layout is None:
+        return []
+    (prologue_end, ranges) = layout
+    if len(ranges) <= 2:
+        # 各セクションが1つずつにしかならない場合は分けない
+        return []
+    spatial = [part for part in ranges if part.section == _SPATIAL]
+    fude_parts = tuple(part for part in ranges if part.section != _SPATIAL)
+    return [
+        PartTask(key, src, path, prologue_end, part, i, len(spatial), fude_parts)
+        for i, part in enumerate(spatial)
+    ]
+
+
+def plan_tasks(
+    src_iter: Iterable[Source],
+    largest_first: bool,
+    split_bytes: Optional[int],
+    spilled: List[Path],
+) -> Iterable[Union[Source, PartTask]]:
+    """Order the sources and split the large ones into parts
+
+    Temporary files created for splitting are appended to ``spilled``; the
+    caller removes them.
+    """
+    if largest_first:
+        src_iter = sorted(src_iter, key=source_size, reverse=True)
+    num_split = 0
+    for src in src_iter:
+        if (
+            split_bytes is None
+            or not isinstance(src, XMLSource)
+            or _estimated_xml_size(src) < split_bytes
+        ):
+            yield src
+            continue
+        if isinstance(src, XMLFileSource):
+            path = src.path
+        else:
+            path = _spill(src)
+            spilled.append(path)
+        parts = _split(num_split, src, path, split_bytes)
+        if not parts:
+            if path in spilled:
+                spilled.remove(path)
+                path.unlink()
+            yield src
+            continue
+        num_split += 1
+        yield from parts
+
+
+def _read_part(
+    path: Path, prologue_end: int, part: PartRange, stats: FileStats
+) -> bytes:
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with stats.timer("read"):
+                return part_content(mm, prologue_end, part)
+
+
+def parse_part_task(task: PartTask) -> PartPayload:
+    """Parse a part in the worker, reading it from the memory-mapped file"""
+    stats = FileStats(name=task.source.name)
+    t0 = time.perf_counter()
+    content = _read_part(task.path, task.prologue_end, task.part, stats)
+    part = parse_part(content, stats)
+    stats.bytes_in = task.part.end - task.part.start
+    stats.wall = time.perf_counter() - t0
+    return (part, stats)
+
+
+def build_part_task(task: FudeTask, options: ParseOptions) -> FudePayload:
+    """Build the 筆 of a part in the worker, with the memory-mapped tables"""
+    stats = FileStats(name=task.source.name)
+    t0 = time.perf_counter()
+    content = _read_part(task.path, task.prologue_end, task.part, stats)
+    batch = build_part(content, task.tables, options, stats)
+    stats.wall = time.perf_counter() - t0
+    return (batch, stats)
+
+
+def _add_part_stats(stats: FileStats, part: FileStats) -> None:
+    stats.wall += part.wall
+    for stage, seconds in part.times.items():
+        stats.add_time(stage, seconds)
+    # 筆は部分ごとに組み立てて数える
+    stats.features += part.features
+    stats.skipped_chikugai += part.skipped_chikugai
+    stats.filtered += part.filtered
+
+
+# 主題属性の部分を、ワーカーで組み立てる関数
+FudeRunner = Callable[[List[FudeTask]], Iterable[Tuple[Any, FudePayload]]]
+
+
+class PartMerger:
+    """Collect the parts of split XMLs and build each XML once complete
+
+    Once all the parts of the 空間属性 of an XML have arrived, their tables
+    are resolved and saved next to the XML, and ``run`` builds the 筆 of the
+    parts of the 主題属性 on the workers.
+    """
+
+    def __init__(
+        self, options: ParseOptions, spilled: List[Path], run: FudeRunner
+    ) -> None:
+        """Initialize"""
+        self.options = options
+        self._spilled = spilled
+        self._run = run
+        self._parts: Dict[int, Dict[int, PartPayload]] = {}
+
+    def add(
+        self, task: PartTask, payload: PartPayload
+    ) -> Optional[Tuple[FeatureBatch, FileStats]]:
+        """Add a parsed part. Returns the batch once all parts have arrived."""
+        parts = self._parts.setdefault(task.key, {})
+        parts[task.part_index] = payload
+        if len(parts) < task.num_parts:
+            return None
+        del self._parts[task.key]
+
+        stats = FileStats(name=task.source.name)
+        for _, part_stats in parts.values():
+            _add_part_stats(stats, part_stats)
+        batch = self._build(task, [parts[i][0] for i in range(task.num_parts)], stats)
+        stats.bytes_in = task.path.stat().st_size
+        if task.path in self._spilled:
+            self._spilled.remove(task.path)
+            task.path.unlink()
+        return (batch, stats)
+
+    def _build(
+        self, task: PartTask, parts: List[PartialParse], stats: FileStats
+    ) -> FeatureBatch:
+        if not match_header(parts[0].header, self.options):
+            stats.skipped = True
+            return FeatureBatch.empty(FUDE_FIELDS)
+        (fd, name) = tempfile.mkstemp(prefix="mojxml-", suffix=".tables")
+        os.close(fd)
+        path = Path(name)
+        self._spilled.append(path)
+        try:
+            t0 = time.perf_counter()
+            tables = merge_parts(parts, path, stats)
+            stats.wall += time.perf_counter() - t0
+            fude_tasks = [
+                FudeTask(task.source, task.path, task.prologue_end, part, i, tables)
+                for i, part in enumerate(task.fude_parts)
+            ]
+            batches: Dict[int, FeatureBatch] = {}
+            for fude_task, (batch, part_stats) in self._run(fude_tasks):
+                batches[fude_task.part_index] = batch
+                _add_part_stats(stats, part_stats)
+        finally:
+            self._spilled.remove(path)
+            path.unlink()
+        t0 = time.perf_counter()
+        with stats.timer("build"):
+            batch = concat_parts([batches[i] for i in range(len(fude_tasks))])
+        stats.wall += time.perf_counter() - t0
+        return batch
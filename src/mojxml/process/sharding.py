@@ -0,0 +1,66 @@
+"""Deterministic split of the XMLs across machines (``--shard i/N``)
+
+Each machine runs the same command with its own shard index and converts
+only the XMLs assigned to it. The assignment depends only on the name of the
+XML (e.g. ``12103-0400-76.xml``), not on the order or the location of the
+inputs, so every machine agrees on it without any coordination.
+"""
+
+import re
+import zlib
+from dataclasses import dataclass
+from typing import Iterable, TypeVar
+
+from ..reader import XMLSource
+
+# 分け方
+# - name: XMLファイル名ごと
+# - city: 市区町村コード (ファイル名の先頭5桁) ごと
+SHARD_KEYS = ("name", "city")
+
+_CITY_CODE = re.compile(r"\d{5}")
+
+S = TypeVar("S", bound=XMLSource)
+
+
+@dataclass(frozen=True)
+class ShardSpec:
+    """The ``index``-th (1-based) of ``count`` shards, keyed by ``by``"""
+
+    index: int
+    count: int
+    by: str = "name"
+
+    @classmethod
+    def parse(cls, text: str, by: str = "name") -> "ShardSpec":
+        """Parse "i/N" (e.g. "2/8")"""
+        m = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", text)
+        if m is None:
+            raise ValueError(f"Shard must be given as i/N: {text!r}")
+        (index, count) = (int(m.group(1)), int(m.group(2)))
+        if not 1 <= index <= count:
+            raise ValueError(f"Shard index must be between 1 and {count}: {index}")
+        assert by in SHARD_KEYS, f"Unknown shard key: {by}"
+        return cls(index, count, by)
+
+    def key(self, src: XMLSource) -> str:
+        """Get the value the XML is assigned by"""
+        name = src.name
+        if self.by == "city":
+            m = _CITY_CODE.match(name)
+            if m is not None:
+                return m.group()
+        return name
+
+    def contains(self, src: XMLSource) -> bool:
+        """Whether the XML is assigned to this shard"""
+        # hash() は実行ごとに変わるため、マシン間で一致する CRC32 を使う
+        return zlib.crc32(self.key(src).encode()) % self.count == self.index - 1
+
+    def select(self, src_iter: Iterable[S]) -> Iterable[S]:
+        """Keep the XMLs assigned to this shard"""
+        return (src for src in src_iter if self.contains(src))
+
+    def __str__(self) -> str:
+        """Format as "i/N" """
+        return f"{self.index}/{self.count}"
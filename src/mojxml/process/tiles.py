@@ -0,0 +1,53 @@
+"""Vector tile output (MBTiles / PMTiles) through GDAL's MVT encoder"""
+
+from pathlib import Path
+from typing import Iterable, Optional
+
+from ..batch import FeatureBatch
+from .arrow import write_by_ogr_arrow
+
+# 筆を見分けられる程度のズームレベル
+DEFAULT_MIN_ZOOM = 14
+DEFAULT_MAX_ZOOM = 16
+
+# タイルのレイヤ名
+LAYER_NAME = "筆"
+
+_DRIVERS = {
+    ".mbtiles": "MBTiles",
+    ".pmtiles": "PMTiles",
+}
+
+
+def write_tiles(
+    batches_iter: Iterable[FeatureBatch],
+    dst_path: Path,
+    driver: Optional[str] = None,
+    min_zoom: int = DEFAULT_MIN_ZOOM,
+    max_zoom: int = DEFAULT_MAX_ZOOM,
+) -> None:
+    """Write batches as Mapbox Vector Tiles into MBTiles or PMTiles
+
+    GDAL clips, quantizes and encodes the features for each zoom level in
+    [min_zoom, max_zoom]. Features are first spilled into a temporary SQLite
+    database next to the output, so memory use does not grow with the number
+    of features. Requires pyarrow and pyogrio (GDAL >= 3.8 for PMTiles).
+    """
+    dst_path = Path(dst_path)
+    if driver is None:
+        driver = _DRIVERS.get(dst_path.suffix.lower())
+        if driver is None:
+            raise ValueError(f"Unsupported vector tile format: {dst_path.name}")
+    if not 0 <= min_zoom <= max_zoom:
+        raise ValueError(f"Invalid zoom range: {min_zoom}-{max_zoom}")
+    write_by_ogr_arrow(
+        batches_iter,
+        dst_path,
+        driver,
+        layer=LAYER_NAME,
+        dataset_options={
+            "MINZOOM": str(min_zoom),
+            "MAXZOOM": str(max_zoom),
+            "NAME": dst_path.stem,
+        },
+    )
@@ -0,0 +1,61 @@
+"""TopoJSON output, keeping the boundaries shared between adjacent 筆"""
+
+import json
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+from ..batch import FeatureBatch
+from ..topology import build_topology
+
+# TopoJSON のオブジェクト名
+OBJECT_NAME = "筆"
+
+
+def write_topojson(
+    batches_iter: Iterable[FeatureBatch],
+    dst_path: Path,
+    driver: Optional[str] = None,
+) -> None:
+    """Write batches as a TopoJSON topology
+
+    Arcs are shared within each XML file (one batch); files are not stitched
+    together. Geometries are streamed to the output and arcs to a temporary
+    file, so the whole topology is never held in memory.
+    """
+    assert driver in (None, "TopoJSON"), f"Unsupported driver: {driver}"
+    dst_path = Path(dst_path)
+    with open(dst_path, "w", encoding="utf-8") as out, tempfile.TemporaryFile(
+        "w+", encoding="utf-8", dir=dst_path.parent
+    ) as arcs_out:
+        out.write('{"type":"Topology","objects":{')
+        out.write(json.dumps(OBJECT_NAME, ensure_ascii=False))
+        out.write(':{"type":"GeometryCollection","geometries":[')
+        num_arcs = 0
+        first = True
+        for batch in batches_iter:
+            topology = build_topology(batch)
+            for properties, rings in zip(batch.property_dicts(), topology.rings):
+                geometry: Dict[str, Any] = {"type": None}
+                if rings:
+                    # 弧の番号をファイル全体の通し番号にずらす
+                    polygon = [
+                        [i + num_arcs if i >= 0 else i - num_arcs for i in ring]
+                        for ring in rings
+                    ]
+                    geometry = {"type": "MultiPolygon", "arcs": [polygon]}
+                geometry["properties"] = properties
+                if not first:
+                    out.write(",")
+                out.write(json.dumps(geometry, ensure_ascii=False))
+                first = False
+            for i in range(topology.num_arcs):
+                if num_arcs or i:
+                    arcs_out.write(",")
+                arcs_out.write(json.dumps(topology.arc(i).tolist()))
+            num_arcs += topology.num_arcs
+        out.write(']}},"arcs":[')
+        arcs_out.seek(0)
+        shutil.copyfileobj(arcs_out, out)
+        out.write("]}")
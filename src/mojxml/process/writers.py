@@ -0,0 +1,63 @@
+"""Output writers taking an iterable of FeatureBatch"""
+
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from ..batch import FeatureBatch
+from ..schema import FUDE_LAYER, LAYER_SCHEMAS
+from .arrow import layer_options, write_by_arrow
+from .geojsonseq import write_geojsonseq
+from .tiles import write_tiles
+from .topojson import write_topojson
+
+
+def write_by_fiona(
+    batches_iter: Iterable[FeatureBatch],
+    dst_path: Path,
+    driver: Optional[str] = None,
+    layer: Optional[str] = None,
+) -> None:
+    """Write batches record by record with fiona
+
+    ``layer`` is the layer of schema.LAYERS (筆 by default) and the name of the
+    OGR layer. An existing GeoPackage gets the layer added to it.
+    """
+    import fiona
+
+    schema = LAYER_SCHEMAS[layer or FUDE_LAYER]
+    # レイヤー作成オプションは fiona.open() のキーワード引数として渡す
+    options: Dict[str, Any] = layer_options(dst_path, driver, layer) or {}
+    with fiona.open(
+        dst_path,
+        "w",
+        driver=driver,
+        schema=schema,
+        crs="EPSG:4326" if schema["geometry"] != "None" else None,
+        layer=layer,
+        **options,
+    ) as f:
+        for batch in batches_iter:
+            # Featureの辞書は書き出す直前に組み立てる
+            f.writerecords(batch.to_features())
+
+
+# 地物のバッチ列を書き出す関数 (batches_iter, dst_path, driver)
+Writer = Callable[[Iterable[FeatureBatch], Path, Optional[str]], None]
+
+# 地物のバッチ列をレイヤーとして書き出す関数 (batches_iter, dst_path, driver, layer)
+LayerWriter = Callable[[Iterable[FeatureBatch], Path, Optional[str], str], None]
+
+WRITER_MAP: Dict[str, Writer] = {
+    "fiona": write_by_fiona,
+    "arrow": write_by_arrow,
+    "geojsonseq": write_geojsonseq,
+    "topojson": write_topojson,
+    "tiles": write_tiles,
+}
+
+# 筆以外のレイヤーも書き出せるもの
+LAYER_WRITER_MAP: Dict[str, LayerWriter] = {
+    "fiona": write_by_fiona,
+    "arrow": write_by_arrow,
+    "geojsonseq": write_geojsonseq,
+}
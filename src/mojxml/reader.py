@@ -1,34 +1,248 @@
 """Handle XML and ZIP sources trnsparently"""
 
+import io
+import mmap
+import os
+import struct
+from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Iterable, List
-from zipfile import ZipFile
+from typing import (
+    IO,
+    ContextManager,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Union,
+    cast,
+)
+from zipfile import ZIP_STORED, ZipFile
 
+# ZIPのローカルファイルヘッダ (ファイル名と拡張フィールドの長さで終わる)
+_LOCAL_FILE_HEADER = struct.Struct("<4s2B4HL2L2H")
 
-def iter_content_xmls(src_paths: List[Path]) -> Iterable[bytes]:
-    """Iterate XML contents from given zips and xmls"""
+
+class _MappedRange(io.RawIOBase):
+    """Read-only stream over a range of a memory-mapped file
+
+    Reads are copied straight from the page cache into the caller's buffer,
+    without materializing the whole range as bytes.
+    """
+
+    def __init__(
+        self, f: IO[bytes], offset: int = 0, size: Optional[int] = None
+    ) -> None:
+        """Map the file and start reading at ``offset``"""
+        self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._start = offset
+        self._pos = offset
+        self._end = len(self._mmap) if size is None else offset + size
+
+    def readable(self) -> bool:
+        """Always readable"""
+        return True
+
+    def readinto(self, buffer: Union[memoryview, bytearray]) -> int:  # type: ignore[override]
+        """Copy the next bytes of the range into the buffer"""
+        n = min(len(buffer), self._end - self._pos)
+        with memoryview(self._mmap) as view:
+            memoryview(buffer).cast("B")[:n] = view[self._pos : self._pos + n]
+        self._pos += n
+        return n
+
+    def tell(self) -> int:
+        """Position relative to the start of the range"""
+        return self._pos - self._start
+
+    def close(self) -> None:
+        """Unmap the file"""
+        if not self.closed:
+            self._mmap.close()
+        super().close()
+
+
+class XMLSource(metaclass=ABCMeta):
+    """Reference to an XML content, read lazily (e.g. in a worker process)"""
+
+    @property
+    @abstractmethod
+    def name(self) -> str:
+        """Name of the XML file"""
+
+    @abstractmethod
+    def open(self) -> ContextManager[IO[bytes]]:
+        """Open the XML content as a binary stream"""
+
+    def read(self) -> bytes:
+        """Read the XML content"""
+        with self.open() as f:
+            return f.read()
+
+
+@dataclass(frozen=True)
+class XMLFileSource(XMLSource):
+    """Plain .xml file"""
+
+    path: Path
+
+    @property
+    def name(self) -> str:
+        """Name of the XML file"""
+        return self.path.name
+
+    @contextmanager
+    def open(self) -> Iterator[IO[bytes]]:
+        """Open the XML file memory-mapped"""
+        with open(self.path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # 空のファイルはマップできない
+                yield f
+                return
+            with _MappedRange(f) as mapped:
+                yield cast(IO[bytes], mapped)
+
+    def read(self) -> bytes:
+        """Read the XML content"""
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+@dataclass(frozen=True)
+class ZipMemberSource(XMLSource):
+    """.xml member (or .zip member containing an .xml) of a zip archive
+
+    ``crc32`` and ``size`` (uncompressed) are taken from the central
+    directory of the archive, so they are known without decompressing.
+    """
+
+    archive: Path
+    member: str
+    crc32: int = field(default=0, compare=False)
+    size: int = field(default=0, compare=False)
+
+    @property
+    def name(self) -> str:
+        """Name of the XML file"""
+        if self.member.endswith(".zip"):
+            return self.member[:-4] + ".xml"
+        return self.member
+
+    @contextmanager
+    def open(self) -> Iterator[IO[bytes]]:
+        """Open the XML content as a stream decompressed on the fly"""
+        with MojXMLZipFile(self.archive) as mzf:
+            with mzf.open_xml(self.member) as f:
+                yield f
+
+    def read(self) -> bytes:
+        """Read the XML content"""
+        with MojXMLZipFile(self.archive) as mzf:
+            return mzf.read_xml(self.member)
+
+
+# XMLの内容そのもの、またはその参照
+Source = Union[bytes, XMLSource]
+
+
+def read_source(src: Source) -> bytes:
+    """Get the XML content of a source"""
+    if isinstance(src, XMLSource):
+        return src.read()
+    return src
+
+
+def open_source(src: Source) -> ContextManager[IO[bytes]]:
+    """Open the XML content of a source as a binary stream"""
+    if isinstance(src, XMLSource):
+        return src.open()
+    return io.BytesIO(src)
+
+
+def iter_content_sources(src_paths: List[Path]) -> Iterable[XMLSource]:
+    """Iterate references to XMLs in given zips and xmls without reading them"""
     for src_path in src_paths:
         src_path = Path(src_path)
         if src_path.suffix == ".xml":
-            with open(src_path, "rb") as f:
-                yield f.read()
+            yield XMLFileSource(src_path)
         elif src_path.suffix == ".zip":
             with MojXMLZipFile(src_path) as mzf:
-                yield from mzf.iter_xml_contents()
+                yield from mzf.iter_xml_sources()
         else:
             raise ValueError(f"Unsupported file type: {src_path.suffix}")
 
 
+def iter_content_xmls(src_paths: List[Path]) -> Iterable[bytes]:
+    """Iterate XML contents from given zips and xmls"""
+    for src in iter_content_sources(src_paths):
+        yield src.read()
+
+
 class MojXMLZipFile(ZipFile):
     """法務省登記所備付地図データの多段zip圧縮されたアーカイブを扱う"""
 
+    def iter_xml_sources(self) -> Iterable[ZipMemberSource]:
+        """Iterate references to XMLs in the zip (only the central directory is read)"""
+        assert isinstance(self.filename, str)
+        archive = Path(self.filename)
+        for info in self.infolist():
+            name = info.filename
+            if name.endswith(".zip") or name.endswith(".xml"):
+                yield ZipMemberSource(archive, name, info.CRC, info.file_size)
+
     def iter_xml_contents(self) -> Iterable[bytes]:
         """Iterate XML contents from given zips"""
         for name in self.namelist():
-            if name.endswith(".zip"):
-                yield self._extract_xml_content(name[:-4])
-            elif name.endswith(".xml"):
-                yield self.open(name).read()
+            if name.endswith(".zip") or name.endswith(".xml"):
+                yield self.read_xml(name)
+
+    def read_xml(self, name: str) -> bytes:
+        """Read an XML member, or the XML in a nested zip member"""
+        if name.endswith(".zip"):
+            return self._extract_xml_content(name[:-4])
+        return self.open(name).read()
+
+    @contextmanager
+    def open_xml(self, name: str) -> Iterator[IO[bytes]]:
+        """Open an XML member, or the XML in a nested zip member, as a stream
+
+        Stored (uncompressed) members are read from a memory-mapped view of
+        the archive. A nested zip is small, so it is read into memory and its
+        XML is decompressed on the fly.
+        """
+        if name.endswith(".zip"):
+            internal_name = name[:-4]
+            with ZipFile(io.BytesIO(self.read(name))) as zf:
+                with zf.open(internal_name + ".xml") as f:
+                    yield f
+            return
+        info = self.getinfo(name)
+        offset = self._stored_data_offset(name)
+        if offset is None:
+            with self.open(info) as f:
+                yield f
+            return
+        assert self.fp is not None
+        with _MappedRange(cast(IO[bytes], self.fp), offset, info.file_size) as f:
+            yield cast(IO[bytes], f)
+
+    def _stored_data_offset(self, name: str) -> Optional[int]:
+        """Get the offset of the data of a stored member (None if not mappable)"""
+        info = self.getinfo(name)
+        if info.compress_type != ZIP_STORED or info.flag_bits & 0x1:
+            return None
+        if self.fp is None or not hasattr(self.fp, "fileno"):
+            return None
+        self.fp.seek(info.header_offset)
+        header = _LOCAL_FILE_HEADER.unpack(self.fp.read(_LOCAL_FILE_HEADER.size))
+        (filename_length, extra_length) = header[-2:]
+        return (
+            info.header_offset
+            + _LOCAL_FILE_HEADER.size
+            + filename_length
+            + extra_length
+        )
 
     def _extract_xml_content(self, internal_name: str) -> bytes:
         with self.open(internal_name + ".zip") as f:
@@ -0,0 +1,131 @@
+"""Index-only scan of MOJ XML files (metadata without building geometries)
+
+A scan reads the root-level fields of a file (地図名, 市区町村コード, ...) and,
+unless only the header is requested, counts its elements and computes the
+extent of its coordinates in a single streaming pass. No points, curves or
+surfaces are assembled and nothing is transformed except the extent, so it
+costs a fraction of a full parse. The resulting catalogue helps to plan and
+shard large conversions.
+"""
+
+from dataclasses import dataclass, field
+from typing import IO, Dict, Optional, Tuple, Union
+
+import lxml.etree as et
+
+from .constants import CRS_MAP
+from .parse import (
+    BASE_PROPERTY_TAGS,
+    TAG_CURVE,
+    TAG_FUDE,
+    TAG_POINT,
+    TAG_SURFACE,
+    field_name,
+    iter_elements,
+    iter_header,
+    parse_curve_start,
+    parse_point,
+)
+from .transform import get_transformer
+
+# ルート要素直下の属性 (この順序で出力する)
+HEADER_FIELDS = ("地図名", "市区町村コード", "市区町村名", "座標系", "測地系判別")
+
+_COUNTED_TAGS = {
+    TAG_POINT: "points",
+    TAG_CURVE: "curves",
+    TAG_SURFACE: "surfaces",
+    TAG_FUDE: "fude",
+}
+
+
+@dataclass
+class ScanRecord:
+    """Metadata of an XML file
+
+    ``header`` holds the root-level fields. The counts and extents are None
+    for header-only scans. ``bounds`` is the extent of all coordinates in
+    longitude/latitude (None for 任意座標系), and ``source_bounds`` the same
+    extent in the coordinate system of the file (east-west, north-south).
+    """
+
+    name: Optional[str] = None
+    bytes_in: int = 0
+    header: Dict[str, Optional[str]] = field(default_factory=dict)
+    num_fude: Optional[int] = None
+    num_points: Optional[int] = None
+    num_curves: Optional[int] = None
+    num_surfaces: Optional[int] = None
+    source_bounds: Optional[Tuple[float, float, float, float]] = None
+    bounds: Optional[Tuple[float, float, float, float]] = None
+
+
+class _Extent:
+    """Running extent of X (north-south) and Y (east-west) values"""
+
+    def __init__(self) -> None:
+        self.min_x = self.min_y = float("inf")
+        self.max_x = self.max_y = float("-inf")
+
+    def add(self, x: float, y: float) -> None:
+        if x < self.min_x:
+            self.min_x = x
+        if x > self.max_x:
+            self.max_x = x
+        if y < self.min_y:
+            self.min_y = y
+        if y > self.max_y:
+            self.max_y = y
+
+    def bounds(self) -> Optional[Tuple[float, float, float, float]]:
+        if self.min_x > self.max_x or self.min_y > self.max_y:
+            return None
+        # 平面直角座標系の X は南北、Y は東西
+        return (self.min_y, self.min_x, self.max_y, self.max_x)
+
+
+def _add_to_extent(elem: et._Element, extent: _Extent) -> None:
+    if elem.tag == TAG_POINT:
+        extent.add(*parse_point(elem))
+    elif elem.tag == TAG_CURVE:
+        # 点を参照せずに座標を直接持つ曲線
+        (_, position) = parse_curve_start(elem)
+        if position is not None:
+            extent.add(*position)
+
+
+def scan_xml(content: Union[bytes, IO[bytes]], header_only: bool = False) -> ScanRecord:
+    """Scan raw XML content for its root-level fields, counts and extent
+
+    With ``header_only``, reading stops at the first section (空間属性 or
+    主題属性), as the root-level fields precede the geometries.
+    """
+    record = ScanRecord(header=dict.fromkeys(HEADER_FIELDS))
+    if header_only:
+        record.header.update(iter_header(content))
+        return record
+
+    counts = dict.fromkeys(_COUNTED_TAGS.values(), 0)
+    extent = _Extent()
+    source_crs: Optional[str] = None
+    for elem in iter_elements(content):
+        tag = elem.tag
+        if tag in _COUNTED_TAGS:
+            counts[_COUNTED_TAGS[tag]] += 1
+            _add_to_extent(elem, extent)
+        elif tag in BASE_PROPERTY_TAGS:
+            name = field_name(tag)
+            record.header[name] = elem.text
+            if name == "座標系":
+                source_crs = CRS_MAP.get(elem.text)
+
+    record.num_fude = counts["fude"]
+    record.num_points = counts["points"]
+    record.num_curves = counts["curves"]
+    record.num_surfaces = counts["surfaces"]
+    record.source_bounds = extent.bounds()
+    if record.source_bounds is not None and source_crs is not None:
+        record.bounds = get_transformer(source_crs).transform_bounds(
+            *record.source_bounds
+        )
+    return record
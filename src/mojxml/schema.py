@@ -2,7 +2,7 @@
 
 import typing
 from collections import OrderedDict
-from typing import TypedDict
+from typing import Dict, Optional, Tuple, TypedDict
 
 
 class _SchemaType(TypedDict):
@@ -35,3 +35,53 @@ OGR_SCHEMA: _SchemaType = {
     ),
     "geometry": "MultiPolygon",
 }
+
+# 筆のほかに出力できるレイヤーの属性 (すべての地物に付与するルート要素直下の属性を除く)
+_BASE_FIELDS = ("地図名", "市区町村コード", "市区町村名", "座標系", "測地系判別")
+
+
+def _schema(fields: Tuple[str, ...], geometry: str) -> _SchemaType:
+    return {
+        "properties": OrderedDict((name, "str") for name in fields),
+        "geometry": geometry,
+    }
+
+
+FUDE_LAYER = "筆"
+
+# レイヤー名から、そのスキーマへの対応
+# - 図郭: 地図の区画 (四隅の座標による四角形)
+# - 筆界線・筆界点・基準点: 筆の境界線・境界点と、測量の基準点
+# - 筆図郭: 筆と、それが描かれている図郭の対応 (1つの筆が複数の図郭にまたがることがある)
+LAYER_SCHEMAS: Dict[str, _SchemaType] = {
+    FUDE_LAYER: OGR_SCHEMA,
+    "図郭": _schema(
+        (
+            "地図番号",
+            *_BASE_FIELDS,
+            "縮尺分母",
+            "方位不明フラグ",
+            "地図種類",
+            "地図分類",
+            "地図材質",
+            "地図作成年月日",
+            "備付地図年月日",
+        ),
+        "MultiPolygon",
+    ),
+    "筆界線": _schema(("線種別", *_BASE_FIELDS), "LineString"),
+    "筆界点": _schema(("点番名", *_BASE_FIELDS), "Point"),
+    "基準点": _schema(
+        ("名称", *_BASE_FIELDS, "基準点種別", "埋標区分"),
+        "Point",
+    ),
+    "筆図郭": _schema(("筆ID", "地図番号", "地図名", "市区町村コード"), "None"),
+}
+
+LAYERS = tuple(LAYER_SCHEMAS)
+
+
+def geometry_type(layer: str) -> Optional[str]:
+    """Get the geometry type of a layer (None for tables without geometry)"""
+    geometry = LAYER_SCHEMAS[layer]["geometry"]
+    return None if geometry == "None" else geometry
@@ -0,0 +1,153 @@
+"""Per-stage timings and counters of the conversion pipeline
+
+Workers fill a FileStats for each XML file, which travels back to the parent
+with the parsed batch. The parent aggregates them in a StatsCollector, which
+can call back for each file and produce a JSON report.
+"""
+
+import json
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+# 処理の段階
+# - read: XMLを開く (ストリームで読むため、読み込みとZIPの展開は parse に含まれる)
+# - parse: XMLの読み込み・解析と点・曲線・面の組み立て
+# - transform: 座標変換
+# - build: 地物の組み立て
+# - serialize/deserialize: ワーカーとの受け渡し
+# - load: マニフェストからの読み込み
+# - write: 出力ファイルへの書き込み
+# - merge: シャードの結合 (ファイルごとではなく全体で1回)
+STAGES = (
+    "read",
+    "parse",
+    "transform",
+    "build",
+    "serialize",
+    "deserialize",
+    "load",
+    "write",
+    "merge",
+)
+
+# 合計するカウンタ
+_COUNTERS = (
+    "bytes_in",
+    "points",
+    "curves",
+    "surfaces",
+    "features",
+    "skipped_chikugai",
+    "filtered",
+)
+
+
+@dataclass
+class FileStats:
+    """Timings (seconds) and counters of one XML file"""
+
+    name: Optional[str] = None
+    bytes_in: int = 0
+    points: int = 0
+    curves: int = 0
+    surfaces: int = 0
+    features: int = 0
+    # 地番が地区外・別図のためスキップした筆
+    skipped_chikugai: int = 0
+    # ParseOptions の絞り込み条件で除外した筆
+    filtered: int = 0
+    # ファイル全体をスキップした (任意座標系、または絞り込み条件による)
+    skipped: bool = False
+    # マニフェストの結果を再利用した
+    cached: bool = False
+    times: Dict[str, float] = field(default_factory=dict)
+    # ワーカーでの所要時間
+    wall: float = 0.0
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        """Add the time spent in a stage"""
+        self.times[stage] = self.times.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """Measure the time spent in a stage"""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - t0)
+
+
+class StatsCollector:
+    """Aggregate the FileStats of a conversion in the parent process
+
+    ``callback`` is called with the FileStats of each file once it has been
+    written. Per-file stats are kept for the report unless ``keep_files`` is
+    False.
+    """
+
+    def __init__(
+        self,
+        callback: Optional[Callable[[FileStats], None]] = None,
+        keep_files: bool = True,
+    ) -> None:
+        """Initialize"""
+        self.callback = callback
+        self.keep_files = keep_files
+        self.files: List[FileStats] = []
+        self.num_files = 0
+        self.num_skipped_files = 0
+        self.num_cached_files = 0
+        self.counters: Dict[str, int] = {name: 0 for name in _COUNTERS}
+        self.times: Dict[str, float] = {stage: 0.0 for stage in STAGES}
+        self.worker_wall = 0.0
+        self._started = time.perf_counter()
+        self.wall = 0.0
+
+    def add(self, file_stats: FileStats) -> None:
+        """Add the stats of a file"""
+        self.num_files += 1
+        self.num_skipped_files += file_stats.skipped
+        self.num_cached_files += file_stats.cached
+        for name in _COUNTERS:
+            self.counters[name] += getattr(file_stats, name)
+        for stage, seconds in file_stats.times.items():
+            self.times[stage] = self.times.get(stage, 0.0) + seconds
+        self.worker_wall += file_stats.wall
+        self.wall = time.perf_counter() - self._started
+        if self.keep_files:
+            self.files.append(file_stats)
+        if self.callback is not None:
+            self.callback(file_stats)
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        """Add the time spent in a stage not attributed to any file"""
+        self.times[stage] = self.times.get(stage, 0.0) + seconds
+        self.wall = time.perf_counter() - self._started
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Get the report as a JSON-serializable dict
+
+        Stage times are summed over all workers, so they can exceed ``wall``
+        (the elapsed time in the parent) when running in parallel.
+        """
+        report: Dict[str, Any] = {
+            "files": self.num_files,
+            "skipped_files": self.num_skipped_files,
+            "cached_files": self.num_cached_files,
+            **self.counters,
+            "times": self.times,
+            "worker_wall": self.worker_wall,
+            "wall": self.wall,
+        }
+        if self.keep_files:
+            report["per_file"] = [asdict(f) for f in self.files]
+        return report
+
+    def write_json(self, path: Union[str, Path]) -> None:
+        """Write the report as JSON"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
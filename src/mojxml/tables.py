@@ -0,0 +1,191 @@
+"""Array-backed tables of points, curves and surfaces"""
+
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+_TRUNCATE_SCALE = 1000000000.0
+
+
+def truncate(values: npt.NDArray[np.float64]) -> None:
+    """小数点以下9ケタに丸める (in place)"""
+    np.multiply(values, _TRUNCATE_SCALE, out=values)
+    np.trunc(values, out=values)
+    np.divide(values, _TRUNCATE_SCALE, out=values)
+
+
+class CoordinateTable:
+    """Coordinates keyed by XML id, stored in contiguous float64 x/y arrays.
+
+    Coordinates are appended while parsing, then the table is frozen into
+    NumPy arrays so that it can be transformed and truncated in place.
+    """
+
+    def __init__(self) -> None:
+        """Initialize"""
+        self.index: Dict[str, int] = {}
+        self._xx = array("d")
+        self._yy = array("d")
+        self.x: npt.NDArray[np.float64] = np.empty(0)
+        self.y: npt.NDArray[np.float64] = np.empty(0)
+
+    @classmethod
+    def from_arrays(
+        cls,
+        ids: Sequence[str],
+        x: npt.NDArray[np.float64],
+        y: npt.NDArray[np.float64],
+    ) -> "CoordinateTable":
+        """Create a frozen table from ids and coordinate arrays"""
+        table = cls()
+        table.index = dict(zip(ids, range(len(ids))))
+        table.x = np.ascontiguousarray(x, dtype=np.float64)
+        table.y = np.ascontiguousarray(y, dtype=np.float64)
+        return table
+
+    def __len__(self) -> int:
+        """Number of coordinates"""
+        # 凍結の前は array に、後は NumPy 配列に入っている
+        return len(self._xx) + len(self.x)
+
+    def append(self, id_: str, x: float, y: float) -> int:
+        """Add a coordinate and get its index"""
+        i = len(self.index)
+        self.index[id_] = i
+        self._xx.append(x)
+        self._yy.append(y)
+        return i
+
+    def get(self, id_: str) -> Tuple[float, float]:
+        """Get a coordinate (before freezing)"""
+        i = self.index[id_]
+        return (self._xx[i], self._yy[i])
+
+    def bounds(self) -> Optional[Tuple[float, float, float, float]]:
+        """Get the (minx, miny, maxx, maxy) of the coordinates (None if empty)"""
+        if not len(self):
+            return None
+        if len(self._xx):
+            # 凍結前はコピーせずに配列を参照する
+            x = np.frombuffer(self._xx, dtype=np.float64)
+            y = np.frombuffer(self._yy, dtype=np.float64)
+        else:
+            (x, y) = (self.x, self.y)
+        return (float(x.min()), float(y.min()), float(x.max()), float(y.max()))
+
+    def freeze(self) -> None:
+        """Move the coordinates into NumPy arrays"""
+        self.x = np.frombuffer(self._xx, dtype=np.float64).copy()
+        self.y = np.frombuffer(self._yy, dtype=np.float64).copy()
+        self._xx = array("d")
+        self._yy = array("d")
+
+    def truncate(self) -> None:
+        """小数点以下9ケタに丸める (in place)"""
+        truncate(self.x)
+        truncate(self.y)
+
+
+class SurfaceTable:
+    """Surfaces keyed by XML id, stored as rings of curve indices.
+
+    The curve indices of all rings are kept in one flat array with ring and
+    surface offsets, and are resolved to coordinates only when features are built.
+    """
+
+    def __init__(self) -> None:
+        """Initialize"""
+        self.index: Dict[str, int] = {}
+        self._curve_indices = array("q")
+        self._ring_offsets = array("q", [0])
+        self._surface_offsets = array("q", [0])
+        self.curve_indices: npt.NDArray[np.int64] = np.empty(0, dtype=np.int64)
+        self.ring_offsets: npt.NDArray[np.int64] = np.zeros(1, dtype=np.int64)
+        self.surface_offsets: npt.NDArray[np.int64] = np.zeros(1, dtype=np.int64)
+
+    @classmethod
+    def from_arrays(
+        cls,
+        curve_indices: npt.NDArray[np.int64],
+        ring_offsets: npt.NDArray[np.int64],
+        surface_offsets: npt.NDArray[np.int64],
+    ) -> "SurfaceTable":
+        """Create a frozen table without ids (the surfaces are got by index)"""
+        table = cls()
+        table.curve_indices = curve_indices
+        table.ring_offsets = ring_offsets
+        table.surface_offsets = surface_offsets
+        return table
+
+    def __len__(self) -> int:
+        """Number of surfaces"""
+        # 凍結の前は array に、後は NumPy 配列に入っている
+        return len(self._surface_offsets) + len(self.surface_offsets) - 2
+
+    def append(self, id_: str, rings: Sequence[Sequence[int]]) -> int:
+        """Add a surface from its rings (exterior first) and get its index"""
+        assert id_ not in self.index
+        i = len(self.index)
+        self.index[id_] = i
+        for ring in rings:
+            self._curve_indices.extend(ring)
+            self._ring_offsets.append(len(self._curve_indices))
+        self._surface_offsets.append(len(self._ring_offsets) - 1)
+        return i
+
+    def freeze(self) -> None:
+        """Move the indices into NumPy arrays"""
+        self.curve_indices = np.frombuffer(self._curve_indices, dtype=np.int64).copy()
+        self.ring_offsets = np.frombuffer(self._ring_offsets, dtype=np.int64).copy()
+        self.surface_offsets = np.frombuffer(
+            self._surface_offsets, dtype=np.int64
+        ).copy()
+        self._curve_indices = array("q")
+        self._ring_offsets = array("q", [0])
+        self._surface_offsets = array("q", [0])
+
+    def rings(self, id_: str) -> List[npt.NDArray[np.int64]]:
+        """Get the rings of a surface as closed arrays of curve indices"""
+        return self.rings_at(self.index[id_])
+
+    def rings_at(self, i: int) -> List[npt.NDArray[np.int64]]:
+        """Get the rings of the ``i``-th surface (see rings())"""
+        ring_offsets = self.ring_offsets
+        rings: List[npt.NDArray[np.int64]] = []
+        for r in range(self.surface_offsets[i], self.surface_offsets[i + 1]):
+            ring = self.curve_indices[ring_offsets[r] : ring_offsets[r + 1]]
+            rings.append(np.append(ring, ring[0]))
+        return rings
+
+
+class LineTable:
+    """Vertices of lines (e.g. all the control points of curves), in order
+
+    Line ``i`` is the ``i``-th appended; its vertices are kept in contiguous
+    float64 arrays with an offset per line.
+    """
+
+    def __init__(self) -> None:
+        """Initialize"""
+        self._xx = array("d")
+        self._yy = array("d")
+        self._offsets = array("q", [0])
+
+    def __len__(self) -> int:
+        """Number of lines"""
+        return len(self._offsets) - 1
+
+    def append(self, vertices: Sequence[Tuple[float, float]]) -> int:
+        """Add a line and get its index"""
+        for x, y in vertices:
+            self._xx.append(x)
+            self._yy.append(y)
+        self._offsets.append(len(self._xx))
+        return len(self) - 1
+
+    def vertices(self, i: int) -> List[Tuple[float, float]]:
+        """Get the vertices of a line"""
+        (a, b) = (self._offsets[i], self._offsets[i + 1])
+        return list(zip(self._xx[a:b], self._yy[a:b]))
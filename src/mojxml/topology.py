@@ -0,0 +1,128 @@
+"""Shared-boundary (TopoJSON-style) representation of a FeatureBatch
+
+Adjacent 筆 reference the same 筆界点, so their rings contain exactly the same
+coordinates along a shared boundary. The rings are cut at junctions (vertices
+with other than two distinct neighbours) into arcs, and each arc is stored
+once and referenced by every ring that uses it, as in TopoJSON.
+"""
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from .batch import FeatureBatch
+
+
+class Topology:
+    """Arcs and the rings of each feature as arc references
+
+    - ``coords`` holds the vertices of all arcs, and ``arc_offsets`` the range
+      of each arc.
+    - ``rings`` lists, for each feature, its rings (exterior first) as arc
+      indices; ``~i`` refers to arc ``i`` traversed in reverse (TopoJSON).
+    """
+
+    def __init__(
+        self,
+        coords: npt.NDArray[np.float64],
+        arc_offsets: npt.NDArray[np.int64],
+        rings: List[List[List[int]]],
+    ) -> None:
+        """Initialize"""
+        self.coords = coords
+        self.arc_offsets = arc_offsets
+        self.rings = rings
+
+    @property
+    def num_arcs(self) -> int:
+        """Number of arcs"""
+        return len(self.arc_offsets) - 1
+
+    def arc(self, index: int) -> npt.NDArray[np.float64]:
+        """Get the coordinates of an arc"""
+        return self.coords[self.arc_offsets[index] : self.arc_offsets[index + 1]]
+
+
+def _vertex_ids(
+    coords: npt.NDArray[np.float64],
+) -> Tuple[npt.NDArray[np.float64], npt.NDArray[np.int64]]:
+    """Identify vertices by their exact coordinates"""
+    packed = np.empty(len(coords), dtype=np.complex128)
+    packed.real = coords[:, 0]
+    packed.imag = coords[:, 1]
+    (unique, inverse) = np.unique(packed, return_inverse=True)
+    vertices = np.column_stack((unique.real, unique.imag))
+    return (vertices, inverse.reshape(-1).astype(np.int64))
+
+
+def _junctions(
+    ids: npt.NDArray[np.int64],
+    ring_offsets: npt.NDArray[np.int64],
+    num_vertices: int,
+) -> npt.NDArray[np.bool_]:
+    """Find the vertices that do not have exactly two distinct neighbours"""
+    # 各リングは閉じている (最後の頂点 = 最初の頂点) ので、リングをまたぐ辺を除く
+    is_edge = np.ones(max(len(ids) - 1, 0), dtype=bool)
+    is_edge[ring_offsets[1:-1] - 1] = False
+    (a, b) = (ids[:-1][is_edge], ids[1:][is_edge])
+    edges = np.unique(np.column_stack((np.minimum(a, b), np.maximum(a, b))), axis=0)
+    degree = np.bincount(edges.ravel(), minlength=num_vertices)
+    return degree != 2
+
+
+def build_topology(batch: FeatureBatch) -> Topology:
+    """Cut the rings of a batch into shared arcs"""
+    if len(batch.coords) == 0:
+        return Topology(
+            np.empty((0, 2), dtype=np.float64),
+            np.zeros(1, dtype=np.int64),
+            [[] for _ in range(len(batch))],
+        )
+    (vertices, ids) = _vertex_ids(batch.coords)
+    is_junction = _junctions(ids, batch.ring_offsets, len(vertices)).tolist()
+
+    arc_index: Dict[Tuple[int, ...], int] = {}
+    arcs: List[Tuple[int, ...]] = []
+
+    def ref(path: Tuple[int, ...]) -> int:
+        # 向きによらず同じ弧になるよう、辞書順で小さい向きを正とする
+        reverse = path[::-1]
+        (key, sign) = (path, 1) if path <= reverse else (reverse, -1)
+        index = arc_index.get(key)
+        if index is None:
+            index = arc_index[key] = len(arcs)
+            arcs.append(key)
+        return index if sign > 0 else ~index
+
+    ring_offsets = batch.ring_offsets.tolist()
+    feature_offsets = batch.feature_offsets.tolist()
+    all_ids = ids.tolist()
+    rings: List[List[List[int]]] = []
+    for r0, r1 in zip(feature_offsets[:-1], feature_offsets[1:]):
+        feature_rings: List[List[int]] = []
+        for r in range(r0, r1):
+            # 閉じた頂点列から最後の頂点を除く
+            ring = all_ids[ring_offsets[r] : ring_offsets[r + 1] - 1]
+            cuts = [i for i, v in enumerate(ring) if is_junction[v]]
+            if not cuts:
+                # 分岐のないリングは最小の頂点から始まる1つの閉じた弧とする
+                start = ring.index(min(ring))
+                rotated = ring[start:] + ring[:start]
+                feature_rings.append([ref((*rotated, rotated[0]))])
+                continue
+            rotated = ring[cuts[0] :] + ring[: cuts[0]]
+            bounds = [c - cuts[0] for c in cuts] + [len(ring)]
+            rotated.append(rotated[0])
+            feature_rings.append(
+                [ref(tuple(rotated[a : b + 1])) for a, b in zip(bounds, bounds[1:])]
+            )
+        rings.append(feature_rings)
+
+    arc_lengths = np.fromiter((len(a) for a in arcs), dtype=np.int64, count=len(arcs))
+    arc_offsets = np.zeros(len(arcs) + 1, dtype=np.int64)
+    np.cumsum(arc_lengths, out=arc_offsets[1:])
+    arc_ids = np.fromiter(
+        (v for arc in arcs for v in arc), dtype=np.int64, count=int(arc_offsets[-1])
+    )
+    return Topology(vertices[arc_ids], arc_offsets, rings)
@@ -0,0 +1,81 @@
+"""Process-local cache of pyproj transformers to WGS84
+
+pyproj is imported on the first use, as importing it takes a noticeable part
+of the startup of the command line tools.
+"""
+
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, Iterable, Optional
+
+if TYPE_CHECKING:
+    import pyproj
+
+from .constants import CRS_MAP
+
+_TARGET_CRS = "epsg:4326"
+
+# pyproj の Transformer はスレッド間で共有できないため、スレッドごとに保持する
+_local = threading.local()
+_stats_lock = threading.Lock()
+
+
+@dataclass
+class TransformerCacheStats:
+    """Hit/miss counters of the transformer cache"""
+
+    hits: int = 0
+    misses: int = 0
+
+
+_stats = TransformerCacheStats()
+
+
+def _get_cache() -> Dict[str, "pyproj.Transformer"]:
+    cache = getattr(_local, "transformers", None)
+    if cache is None:
+        cache = _local.transformers = {}
+    return cache
+
+
+def get_transformer(source_crs: str) -> "pyproj.Transformer":
+    """Get a transformer from source_crs to WGS84, cached for the current thread"""
+    cache = _get_cache()
+    transformer = cache.get(source_crs)
+    if transformer is not None:
+        with _stats_lock:
+            _stats.hits += 1
+        return transformer
+
+    import pyproj
+
+    transformer = pyproj.Transformer.from_crs(source_crs, _TARGET_CRS, always_xy=True)
+    cache[source_crs] = transformer
+    with _stats_lock:
+        _stats.misses += 1
+    return transformer
+
+
+def warm_transformers(source_crss: Optional[Iterable[str]] = None) -> None:
+    """Build transformers for the given CRSs (default: all in CRS_MAP) beforehand
+
+    Intended to be used as the initializer of worker pools.
+    """
+    if source_crss is None:
+        source_crss = (crs for crs in CRS_MAP.values() if crs is not None)
+    for source_crs in source_crss:
+        get_transformer(source_crs)
+
+
+def get_transformer_cache_stats() -> TransformerCacheStats:
+    """Get the hit/miss counters of this process"""
+    with _stats_lock:
+        return TransformerCacheStats(hits=_stats.hits, misses=_stats.misses)
+
+
+def clear_transformer_cache() -> None:
+    """Drop the transformers of the current thread and reset the counters"""
+    _get_cache().clear()
+    with _stats_lock:
+        _stats.hits = 0
+        _stats.misses = 0
@@ -0,0 +1,48 @@
+"""Tests for batch.py."""
+
+import pickle
+from pathlib import Path
+
+from mojxml.batch import FeatureBatch
+from mojxml.parse import ParseOptions, parse_batch
+from mojxml.reader import iter_content_xmls
+
+
+def test_batch_roundtrip():
+    """A batch survives pickling as a single bytes blob."""
+    [content] = iter_content_xmls([Path("testdata") / "12103-0400-76.zip"])
+    batch = parse_batch(content, ParseOptions())
+    assert len(batch) == 1
+
+    restored = pickle.loads(pickle.dumps(batch))
+    assert restored.fields == batch.fields
+    assert restored.to_features() == batch.to_features()
+    [feature] = restored.to_features()
+    assert feature["properties"]["大字名"] == "作草部町"
+    assert feature["properties"]["丁目名"] is None
+
+
+def test_batch_take():
+    """Selecting features keeps their properties and geometries."""
+    [content] = iter_content_xmls([Path("testdata") / "12103-0400-76.zip"])
+    batch = parse_batch(content, ParseOptions())
+    [[minx, miny, maxx, maxy]] = batch.bounds().tolist()
+    assert minx < maxx and miny < maxy
+
+    assert batch.take([0]).to_features() == batch.to_features()
+    assert batch.take([0, 0]).to_features() == batch.to_features() * 2
+    assert len(batch.take([])) == 0
+
+
+def test_batch_concat():
+    """Concatenated batches share one string table, compacted after take()."""
+    [content] = iter_content_xmls([Path("testdata") / "12103-0400-76.zip"])
+    batch = parse_batch(content, ParseOptions())
+    empty = batch.take([])
+    merged = FeatureBatch.concat([batch, empty, batch.take([0, 0])])
+    assert merged.to_features() == batch.to_features() * 3
+    assert len(merged.strings) == len(batch.strings) * 3
+
+    compacted = merged.take([1]).compact()
+    assert compacted.to_features() == batch.to_features()
+    assert len(compacted.strings) == len(batch.strings)
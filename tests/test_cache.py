@@ -0,0 +1,74 @@
+"""Tests for cache.py."""
+
+import os
+from pathlib import Path
+
+import pytest
+
+from mojxml.cache import ParseCache
+from mojxml.parse import ParseOptions, parse_raw
+from mojxml.reader import iter_content_xmls
+
+
+def test_parse_cache(tmp_path):
+    """Results are served from memory, then from disk, keyed by options."""
+    [content] = iter_content_xmls([Path("testdata") / "12103-0400-76.zip"])
+    options = ParseOptions()
+    expected = parse_raw(content, options)
+
+    cache = ParseCache(directory=tmp_path)
+    assert cache.parse_raw(content, options) == expected
+    assert cache.parse_raw(content, options) == expected
+    assert (cache.stats.misses, cache.stats.memory_hits) == (1, 1)
+
+    # 別のインスタンス (別のプロセス) からはディスクの結果を使う
+    cache = ParseCache(directory=tmp_path)
+    assert cache.parse_raw(content, options) == expected
+    assert (cache.stats.misses, cache.stats.disk_hits) == (0, 1)
+
+    # 解析のオプションもキーに含まれる
+    cache.parse_raw(content, ParseOptions(include_chikugai=True))
+    assert cache.stats.misses == 1
+    assert len(list(tmp_path.glob("*.mjfb"))) == 2
+
+
+def test_parse_cache_eviction(tmp_path):
+    """Least recently used entries are evicted beyond the byte budgets."""
+    [content] = iter_content_xmls([Path("testdata") / "12103-0400-76.zip"])
+    all_options = [ParseOptions(), ParseOptions(include_chikugai=True)]
+    size = len(
+        ParseCache(memory_bytes=0).parse_batch(content, all_options[0]).to_bytes()
+    )
+
+    cache = ParseCache(memory_bytes=size, directory=tmp_path, disk_bytes=size)
+    for options in all_options:
+        cache.parse_batch(content, options)
+        for path in tmp_path.glob("*.mjfb"):
+            # 先に書いたファイルほど古くする
+            os.utime(path, ns=(0, path.stat().st_mtime_ns - 10**9))
+    assert cache.stats.memory_evictions == 1
+    assert cache.stats.disk_evictions == 1
+    assert len(list(tmp_path.glob("*.mjfb"))) == 1
+
+    # 最後に使った結果が残っている
+    cache.parse_batch(content, all_options[1])
+    assert cache.stats.memory_hits == 1
+    cache.parse_batch(content, all_options[0])
+    assert cache.stats.misses == 3
+
+
+def test_parse_cache_shared_batches():
+    """Batches kept in memory cannot be modified by the callers sharing them."""
+    [content] = iter_content_xmls([Path("testdata") / "12103-0400-76.zip"])
+    options = ParseOptions()
+    cache = ParseCache()
+    first = cache.parse_batch(content, options)
+    expected = first.to_bytes()
+    with pytest.raises(ValueError):
+        first.coords[0, 0] = 0.0
+    first.strings.clear()
+    assert cache.parse_batch(content, options).to_bytes() == expected
+
+    # メモリに入らない大きさのものは、呼び出し側のもの
+    batch = ParseCache(memory_bytes=0).parse_batch(content, options)
+    batch.coords[0, 0] = 0.0
@@ -1,5 +1,7 @@
 """Tests for __main__.py."""
 
+import json
+
 from click.testing import CliRunner
 
 from mojxml.__main__ import main
@@ -50,3 +52,15 @@ def test_main_chikugai():
     )
     assert result.exit_code == 0
     assert "1051" in result.stdout
+
+
+def test_main_stdout():
+    """Write GeoJSONSeq to stdout."""
+    runner = CliRunner()
+    result = runner.invoke(
+        main, ["-", "testdata/12103-0400-76.zip", "--worker", "single"]
+    )
+    assert result.exit_code == 0
+    lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+    [feature] = [json.loads(line) for line in lines]
+    assert feature["properties"]["地番"] == "194-1"
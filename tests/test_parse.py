@@ -0,0 +1,100 @@
+"""Tests for parse.py."""
+
+import io
+from pathlib import Path
+
+from mojxml.parse import ParseOptions, parse_raw, parse_raw_layers
+from mojxml.reader import iter_content_xmls
+from mojxml.schema import LAYERS
+
+
+def test_parse_stream():
+    """Parsing from a file object gives the same features as from bytes."""
+    [content] = iter_content_xmls([Path("testdata") / "12103-0400-76.zip"])
+    options = ParseOptions()
+    features = parse_raw(content, options)
+    assert len(features) == 1
+    assert parse_raw(io.BytesIO(content), options) == features
+
+    props = features[0]["properties"]
+    assert props["市区町村コード"] == "12103"
+    assert props["座標系"] == "公共座標9系"
+    assert props["地番"] == "194-1"
+    geometry = features[0]["geometry"]
+    assert geometry is not None
+    [[exterior]] = geometry["coordinates"]
+    assert len(exterior) == 5
+    assert exterior[0] == exterior[-1]
+
+
+def test_parse_filters():
+    """Files and 筆 not matching the filters are skipped while parsing."""
+    [content] = iter_content_xmls([Path("testdata") / "12103-0400-76.zip"])
+    [feature] = parse_raw(content, ParseOptions())
+    assert feature["geometry"] is not None
+    [[exterior]] = feature["geometry"]["coordinates"]
+    (lons, lats) = zip(*exterior)
+    bbox = (min(lons), min(lats), max(lons), max(lats))
+
+    def count(**kwargs):
+        return len(parse_raw(content, ParseOptions(**kwargs)))
+
+    assert count(city_codes=["12103"]) == 1
+    assert count(city_codes=["13101"]) == 0
+    assert count(oaza_codes=["015"]) == 1
+    assert count(oaza_codes=["001"]) == 0
+    assert count(chiban_pattern=r"^194-") == 1
+    assert count(chiban_pattern=r"^195-") == 0
+    assert count(bbox=bbox) == 1
+    assert count(bbox=(bbox[0] + 0.01, bbox[1], bbox[2] + 0.01, bbox[3])) == 0
+    # 公共座標9系 (東西, 南北)
+    assert count(bbox=(26000, -43000, 27000, -42000), bbox_in_source_crs=True) == 1
+    assert count(bbox=(0, 0, 1000, 1000), bbox_in_source_crs=True) == 0
+
+
+def test_parse_layers():
+    """All the layers are read in one pass, consistently with the 筆."""
+    [content] = iter_content_xmls([Path("testdata") / "12103-0400-76.zip"])
+    layers = parse_raw_layers(content, ParseOptions(layers=LAYERS))
+    assert list(layers) == list(LAYERS)
+    assert layers["筆"] == parse_raw(content, ParseOptions())
+    assert {name: len(features) for name, features in layers.items()} == {
+        "筆": 1,
+        "図郭": 21,
+        "筆界線": 4,
+        "筆界点": 4,
+        "基準点": 606,
+        "筆図郭": 1,
+    }
+
+    def geometry(feature, geometry_type):
+        assert feature["geometry"] is not None
+        assert feature["geometry"]["type"] == geometry_type
+        return feature["geometry"]["coordinates"]
+
+    # 筆界点・筆界線は筆の頂点に一致する
+    [[exterior]] = geometry(layers["筆"][0], "MultiPolygon")
+    for feature in layers["筆界点"]:
+        assert geometry(feature, "Point") in exterior
+    for feature in layers["筆界線"]:
+        assert set(geometry(feature, "LineString")) <= set(exterior)
+
+    zukaku = layers["図郭"][0]
+    [[outline]] = geometry(zukaku, "MultiPolygon")
+    assert len(outline) == 5
+    assert outline[0] == outline[-1]
+    assert zukaku["properties"]["市区町村コード"] == "12103"
+    assert zukaku["properties"]["地図作成年月日"] == "2021-01-15"
+
+    [relation] = layers["筆図郭"]
+    assert relation["geometry"] is None
+    assert relation["properties"]["筆ID"] == "H000000001"
+    map_numbers = {f["properties"]["地図番号"] for f in layers["図郭"]}
+    assert relation["properties"]["地図番号"] in map_numbers
+
+    # 筆が絞り込まれると、その筆図郭も出力されない
+    filtered = parse_raw_layers(
+        content, ParseOptions(oaza_codes=["001"], layers=("筆", "筆図郭", "図郭"))
+    )
+    assert len(filtered["筆"]) == len(filtered["筆図郭"]) == 0
+    assert len(filtered["図郭"]) == 21
@@ -1,14 +1,40 @@
 """Tests for process.py."""
 
+import asyncio
+import functools
+import json
+import sqlite3
+import tempfile
+import threading
+import zipfile
 from pathlib import Path
 
-from mojxml.parse import ParseOptions
+import fiona
+import numpy as np
+import pytest
+
+from mojxml.batch import FeatureBatch
+from mojxml.parse import ParseOptions, parse_batch
 from mojxml.process import files_to_feature_iter, files_to_ogr_file
+from mojxml.process.aio import aiter_results, files_to_feature_aiter
 from mojxml.process.executor import (
     ProcessPoolExecutor,
     SingleThreadExecutor,
     ThreadPoolExecutor,
 )
+from mojxml.process.hilbert import _hilbert_index, hilbert_keys, sort_batches
+from mojxml.process.layers import layer_path
+from mojxml.process.manifest import Manifest
+from mojxml.process.partition import files_to_partitioned_output
+from mojxml.process.schedule import PartTask, plan_tasks
+from mojxml.process.sharding import ShardSpec
+from mojxml.reader import (
+    XMLFileSource,
+    ZipMemberSource,
+    iter_content_sources,
+    iter_content_xmls,
+)
+from mojxml.stats import StatsCollector
 
 _FILENAMES = {
     "14103-0200.zip": {
@@ -43,6 +69,72 @@ def test_executors(tmp_path):
         files_to_ogr_file([src_path], dst_path, executor)
 
 
+def test_persistent_pool(tmp_path):
+    """A pool used as a context manager is kept across conversions."""
+    src_path = Path("testdata") / "12103-0400-76.zip"
+    executor = ProcessPoolExecutor(
+        ParseOptions(), max_workers=1, start_method="forkserver"
+    )
+    with executor:
+        pool = executor._pool
+        assert pool is not None
+        for i in range(2):
+            dst_path = tmp_path / f"output{i}.geojsonl"
+            files_to_ogr_file([src_path], dst_path, executor, writer="geojsonseq")
+            assert len(dst_path.read_text(encoding="utf-8").splitlines()) == 1
+        assert executor._pool is pool
+    assert executor._pool is None
+
+
+def test_ordered_pipeline():
+    """Ordered pipelines yield batches in the order of the sources."""
+    src_paths = [Path("testdata") / "12103-0400-76.zip"] * 8
+    options = ParseOptions(include_chikugai=True)
+    expected = [
+        b.to_features()
+        for b in SingleThreadExecutor(options).iter_batches(
+            iter_content_xmls(src_paths)
+        )
+    ]
+    for executor_cls in [ProcessPoolExecutor, ThreadPoolExecutor]:
+        executor = executor_cls(options, max_workers=2, prefetch=1, ordered=True)
+        batches = executor.iter_batches(iter_content_xmls(src_paths))
+        assert [b.to_features() for b in batches] == expected
+
+
+def test_split_large_files(tmp_path):
+    """Large XMLs are split into parts and merged into the same batch."""
+    zip_path = Path("testdata") / "12103-0400-76.zip"
+    xml_path = tmp_path / "12103-0400-76.xml"
+    xml_path.write_bytes(next(iter(iter_content_xmls([zip_path]))))
+    src_paths = [zip_path, xml_path]
+    options = ParseOptions(include_chikugai=True)
+    expected = [
+        b.to_bytes()
+        for b in SingleThreadExecutor(options).iter_batches(
+            iter_content_sources(src_paths)
+        )
+    ]
+    for executor_cls in [ProcessPoolExecutor, ThreadPoolExecutor]:
+        executor = executor_cls(
+            options, max_workers=2, largest_first=True, split_bytes=50000
+        )
+        results = list(executor.iter_results(iter_content_sources(src_paths)))
+        assert sorted(r.batch.to_bytes() for r in results) == sorted(expected)
+        assert all(r.stats.bytes_in == xml_path.stat().st_size for r in results)
+    # 展開した一時ファイルや、ワーカーと共有する表のファイルは残らない
+    assert not list(Path(tempfile.gettempdir()).glob("mojxml-*.xml"))
+    assert not list(Path(tempfile.gettempdir()).glob("mojxml-*.tables"))
+
+    # 大きいソースから順に、分割したものは部分ごとにタスクにする
+    tasks = list(plan_tasks([b"<small/>", XMLFileSource(xml_path)], True, 50000, []))
+    parts = [task for task in tasks if isinstance(task, PartTask)]
+    assert len(parts) == len(tasks) - 1
+    # 筆は空間属性の部分をすべて解析してから、主題属性の部分ごとに組み立てる
+    assert all(part.fude_parts == parts[0].fude_parts for part in parts)
+    assert tasks[-1] == b"<small/>"
+
+
 def test_iter_features():
     """Test iter_features."""
     for filename, props in _FILENAMES.items():
@@ -85,3 +177,373 @@ def test_iter_features_chikugai():
             found_chikugai = True
     assert count == 27247
     assert found_chikugai
+
+
+def test_arrow_writer(tmp_path):
+    """The columnar writer produces GeoParquet and OGR formats."""
+    pytest.importorskip("pyarrow")
+    pytest.importorskip("pyogrio")
+    import pyarrow.parquet as pq
+
+    src_path = Path("testdata") / "12103-0400-76.zip"
+    options = ParseOptions()
+    dst_path = tmp_path / "output.parquet"
+    files_to_ogr_file(
+        [src_path], dst_path, SingleThreadExecutor(options), writer="arrow"
+    )
+    table = pq.read_table(dst_path)
+    assert table.num_rows == 1
+    assert table.column("地番").to_pylist() == ["194-1"]
+    assert b"geo" in table.schema.metadata
+
+    dst_path = tmp_path / "output.gpkg"
+    files_to_ogr_file(
+        [src_path], dst_path, SingleThreadExecutor(options), writer="arrow"
+    )
+    with fiona.open(dst_path) as f:
+        [record] = list(f)
+    [expected] = files_to_feature_iter([src_path], SingleThreadExecutor(options))
+    assert expected["geometry"] is not None
+    assert record.properties["筆ID"] == expected["properties"]["筆ID"]
+    assert record.geometry.coordinates == expected["geometry"]["coordinates"]
+
+
+def test_geojsonseq_writer(tmp_path):
+    """The GeoJSONSeq writer encodes the same features as to_features()."""
+    src_path = Path("testdata") / "12103-0400-76.zip"
+    options = ParseOptions()
+    expected = [
+        json.dumps(feature, ensure_ascii=False, separators=(",", ":"))
+        for feature in files_to_feature_iter([src_path], SingleThreadExecutor(options))
+    ]
+    for executor in (
+        SingleThreadExecutor(options),
+        ProcessPoolExecutor(options, max_workers=2),
+    ):
+        dst_path = tmp_path / "output.geojsonl"
+        files_to_ogr_file([src_path], dst_path, executor, writer="geojsonseq")
+        assert dst_path.read_text(encoding="utf-8").splitlines() == expected
+
+
+def test_layers(tmp_path):
+    """Several layers go into one GeoPackage, or into one file each."""
+    src_path = Path("testdata") / "12103-0400-76.zip"
+    options = ParseOptions(layers=("筆", "筆界点", "筆図郭"))
+    counts = {"筆": 1, "筆界点": 4, "筆図郭": 1}
+    for writer in ("fiona", "arrow"):
+        if writer == "arrow":
+            pytest.importorskip("pyarrow")
+            pytest.importorskip("pyogrio")
+        dst_path = tmp_path / f"{writer}.gpkg"
+        for _ in range(2):
+            # 既存のファイルは作り直される
+            files_to_ogr_file(
+                [src_path], dst_path, ProcessPoolExecutor(options), writer=writer
+            )
+        assert fiona.listlayers(dst_path) == list(counts)
+        for name, count in counts.items():
+            with fiona.open(dst_path, layer=name) as f:
+                assert len(f) == count
+
+    dst_path = tmp_path / "output.geojsonl"
+    files_to_ogr_file(
+        [src_path], dst_path, SingleThreadExecutor(options), writer="geojsonseq"
+    )
+    for name, count in counts.items():
+        path = layer_path(dst_path, name)
+        lines = path.read_text(encoding="utf-8").splitlines()
+        assert len(lines) == count
+    assert layer_path(dst_path, "筆") == dst_path
+    assert layer_path(dst_path, "筆界点") == tmp_path / "output_筆界点.geojsonl"
+
+
+def test_manifest(tmp_path):
+    """Unchanged zip members are reused from the manifest on re-runs."""
+    src_paths = [Path("testdata") / "12103-0400-76.zip"]
+    options = ParseOptions(include_chikugai=True)
+    manifest_path = tmp_path / "manifest.sqlite"
+    expected = list(files_to_feature_iter(src_paths, SingleThreadExecutor(options)))
+
+    def fude_id(feature):
+        return str(feature["properties"]["筆ID"])
+
+    results = []
+    stats_list = []
+    for _ in range(2):
+        with Manifest(manifest_path, options) as manifest:
+            batches = manifest.iter_batches(
+                SingleThreadExecutor(options), iter_content_sources(src_paths)
+            )
+            results.append([f for b in batches for f in b.to_features()])
+            stats_list.append(manifest.stats)
+    stats = stats_list[-1]
+    assert stats.parsed == 0
+    assert stats.reused == 1
+    for features in results:
+        assert sorted(features, key=fude_id) == sorted(expected, key=fude_id)
+
+    # parse options are part of the key
+    with Manifest(manifest_path, ParseOptions()) as manifest:
+        for _ in manifest.iter_batches(
+            SingleThreadExecutor(ParseOptions()), iter_content_sources(src_paths)
+        ):
+            pass
+        assert manifest.stats.reused == 0
+
+
+def test_manifest_order_and_prune(tmp_path):
+    """Cached and parsed members keep the source order; removed ones are pruned."""
+    [content] = iter_content_xmls([Path("testdata") / "12103-0400-76.zip"])
+    zip_path = tmp_path / "archive.zip"
+    manifest_path = tmp_path / "manifest.sqlite"
+    options = ParseOptions()
+
+    def run(members):
+        with zipfile.ZipFile(zip_path, "w") as zf:
+            for name, data in members.items():
+                zf.writestr(name, data)
+        executor = ThreadPoolExecutor(options, max_workers=2, ordered=True)
+        with Manifest(manifest_path, options) as manifest:
+            results = manifest.iter_results(
+                executor, iter_content_sources([zip_path]), prune=True
+            )
+            sources = [r.source for r in results]
+            names = [s.member for s in sources if isinstance(s, ZipMemberSource)]
+            return (names, manifest.stats)
+
+    run({"a.xml": content, "b.xml": content, "c.xml": content})
+    # a を更新し、c を削除して d を追加する (キャッシュされた b は間に出力される)
+    (names, stats) = run({"a.xml": content + b"\n", "b.xml": content, "d.xml": content})
+    assert names == ["a.xml", "b.xml", "d.xml"]
+    assert (stats.reused, stats.parsed, stats.pruned) == (1, 2, 1)
+    with sqlite3.connect(manifest_path) as conn:
+        members = {row[0] for row in conn.execute("SELECT member FROM members")}
+    assert members == {"a.xml", "b.xml", "d.xml"}
+
+
+def test_stats(tmp_path):
+    """Per-file stats are collected in the parent and reported."""
+    src_path = Path("testdata") / "12103-0400-76.zip"
+    received = []
+    stats = StatsCollector(callback=received.append)
+    executor = ProcessPoolExecutor(
+        ParseOptions(), max_workers=1, profile_dir=tmp_path / "prof"
+    )
+    files_to_ogr_file([src_path], tmp_path / "output.fgb", executor, stats=stats)
+
+    [file_stats] = received
+    assert file_stats.name == "12103-0400-76.xml"
+    assert file_stats.features == 1
+    assert file_stats.surfaces == 1
+    assert file_stats.bytes_in > 0
+    assert {"read", "parse", "serialize", "deserialize", "write"} <= set(
+        file_stats.times
+    )
+    report = stats.to_dict()
+    assert report["files"] == 1
+    assert report["features"] == 1
+    assert len(list((tmp_path / "prof").glob("worker-*.prof"))) == 1
+
+
+def test_partitioned_output(tmp_path):
+    """Workers write shards per 市区町村コード, which can be merged."""
+    src_paths = [Path("testdata") / "12103-0400-76.zip"] * 3
+    options = ParseOptions(include_chikugai=True)
+    executor = ProcessPoolExecutor(options, max_workers=2)
+
+    dst_path = tmp_path / "output.geojsonl"
+    shards = files_to_partitioned_output(
+        src_paths, dst_path, executor, files_per_shard=2
+    )
+    assert [s.path.relative_to(dst_path).as_posix() for s in shards] == [
+        "city_code=12103/part-00000.geojsonl",
+        "city_code=12103/part-00001.geojsonl",
+    ]
+    assert [s.num_features for s in shards] == [2, 1]
+
+    for name in ["merged.geojsonl", "merged.gpkg"]:
+        stats = StatsCollector()
+        dst_path = tmp_path / name
+        files_to_partitioned_output(
+            src_paths,
+            dst_path,
+            executor,
+            partition_by="files",
+            files_per_shard=2,
+            merge=True,
+            stats=stats,
+        )
+        with fiona.open(dst_path) as f:
+            assert [r.properties["地番"] for r in f] == ["194-1"] * 3
+        assert not dst_path.with_name(name + ".parts").exists()
+        assert stats.num_files == 3
+        assert stats.times["merge"] > 0
+
+    # TopoJSON のシャードは結合できない
+    with pytest.raises(ValueError):
+        files_to_partitioned_output(
+            src_paths,
+            tmp_path / "merged.topojson",
+            executor,
+            writer="topojson",
+            merge=True,
+        )
+
+
+def _copy_sample(tmp_path, names):
+    [content] = iter_content_xmls([Path("testdata") / "12103-0400-76.zip"])
+    paths = []
+    for name in names:
+        path = tmp_path / name
+        path.write_bytes(content)
+        paths.append(path)
+    return paths
+
+
+def test_shards():
+    """Every XML is assigned to exactly one shard, by name or 市区町村コード."""
+    sources = [
+        XMLFileSource(Path(f"{city}-0400-{i}.xml"))
+        for city in ("12103", "13101", "14103")
+        for i in range(20)
+    ]
+    for by in ("name", "city"):
+        shards = [ShardSpec.parse(f"{i}/3", by) for i in range(1, 4)]
+        selected = [list(shard.select(sources)) for shard in shards]
+        assert sorted(sum(selected, []), key=sources.index) == sources
+        if by == "city":
+            # 同じ市区町村のファイルは同じシャードに入る
+            for city in ("12103", "13101", "14103"):
+                assert sum(any(s.name[:5] == city for s in ss) for ss in selected) == 1
+    with pytest.raises(ValueError):
+        ShardSpec.parse("0/3")
+
+
+def test_checkpoint_resume(tmp_path):
+    """An interrupted conversion is resumed from the checkpoint."""
+    src_paths = _copy_sample(tmp_path, [f"12103-0400-{i}.xml" for i in range(4)])
+    executor = SingleThreadExecutor(ParseOptions())
+    expected_path = tmp_path / "expected.geojsonl"
+    files_to_ogr_file(src_paths, expected_path, executor, writer="geojsonseq")
+
+    # GeoJSONSeq: 書きかけの行は捨てて続きから書き出す
+    checkpoint_path = tmp_path / "checkpoint.sqlite"
+    dst_path = tmp_path / "output.geojsonl"
+    kwargs = {"writer": "geojsonseq", "checkpoint_path": checkpoint_path}
+    files_to_ogr_file(src_paths[:2], dst_path, executor, **kwargs)
+    with open(dst_path, "ab") as f:
+        f.write(b'{"type":"Feat')
+    files_to_ogr_file(src_paths, dst_path, executor, **kwargs)
+    assert dst_path.read_bytes() == expected_path.read_bytes()
+
+    # 分割出力: 完了したタスクのシャードは残し、書きかけのものは消す
+    dst_path = tmp_path / "shards.geojsonl"
+    kwargs = {
+        "writer": "geojsonseq",
+        "partition_by": "files",
+        "files_per_shard": 1,
+        "checkpoint_path": checkpoint_path,
+    }
+    files_to_partitioned_output(src_paths[:2], dst_path, executor, **kwargs)
+    (dst_path / "part-00002.geojsonl").write_bytes(b"{")
+    shards = files_to_partitioned_output(src_paths, dst_path, executor, **kwargs)
+    assert [s.path.name for s in shards] == [f"part-{i:05d}.geojsonl" for i in range(4)]
+    assert sorted(p.name for p in dst_path.iterdir()) == [s.path.name for s in shards]
+    with pytest.raises(FileExistsError):
+        files_to_partitioned_output(src_paths, dst_path, executor, writer="geojsonseq")
+
+
+def test_hilbert_sort(tmp_path):
+    """Features are reordered along the Hilbert curve, spilling runs to disk."""
+    # 原点の 4x4 のセルはキー 0-15 を占め、隣り合うキーのセルは隣接する
+    cells = np.array([(x, y) for x in range(4) for y in range(4)], dtype=np.uint64)
+    keys = _hilbert_index(cells[:, 0], cells[:, 1])
+    assert sorted(keys.tolist()) == list(range(16))
+    path = cells[np.argsort(keys)].astype(np.int64)
+    assert (np.abs(np.diff(path, axis=0)).sum(axis=1) == 1).all()
+
+    [content] = iter_content_xmls([Path("testdata") / "12103-0400-76.zip"])
+    feature = parse_batch(content, ParseOptions())
+    rng = np.random.default_rng(0)
+    batches = []
+    for dx, dy in rng.uniform(-0.5, 0.5, (20, 2)):
+        batches.append(
+            FeatureBatch(
+                feature.fields,
+                feature.strings,
+                feature.properties,
+                feature.coords + (dx, dy),
+                feature.ring_offsets,
+                feature.feature_offsets,
+            )
+        )
+    in_memory = FeatureBatch.concat(list(sort_batches(batches)))
+    keys = hilbert_keys(in_memory.bounds())
+    assert (keys[1:] >= keys[:-1]).all()
+    expected = FeatureBatch.concat(batches).to_features()
+    assert sorted(map(repr, in_memory.to_features())) == sorted(map(repr, expected))
+
+    # 地物ごとに一時ファイルに書き出してから結合しても同じ順になる
+    spilled = FeatureBatch.concat(list(sort_batches(batches, 1, tmp_path)))
+    assert spilled.to_features() == in_memory.to_features()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_async_iterators():
+    """Async iterators yield the same features and stop cleanly when closed."""
+    src_paths = [Path("testdata") / "12103-0400-76.zip"] * 6
+    options = ParseOptions(include_chikugai=True)
+    [expected] = files_to_feature_iter(src_paths[:1], SingleThreadExecutor(options))
+
+    async def collect():
+        stats = StatsCollector()
+        executor = ProcessPoolExecutor(options, max_workers=2)
+        features = [
+            f async for f in files_to_feature_aiter(src_paths, executor, stats=stats)
+        ]
+        return (features, stats.num_files)
+
+    (features, num_files) = asyncio.run(collect())
+    assert features == [expected] * 6
+    assert num_files == 6
+
+    async def stop_early():
+        executor = ThreadPoolExecutor(options, max_workers=1, prefetch=0)
+        results = aiter_results(src_paths, executor, max_pending=1)
+        async for result in results:
+            assert result.stats.features == 1
+            break
+        await results.aclose()
+        return threading.active_count()
+
+    num_threads = threading.active_count()
+    assert asyncio.run(stop_early()) <= num_threads + 1
+
+
+def test_tiles_writer(tmp_path):
+    """Vector tiles are written into MBTiles and PMTiles."""
+    pytest.importorskip("pyarrow")
+    pyogrio = pytest.importorskip("pyogrio")
+    import sqlite3
+
+    from mojxml.process.tiles import write_tiles
+
+    src_path = Path("testdata") / "12103-0400-76.zip"
+    options = ParseOptions()
+    dst_path = tmp_path / "output.mbtiles"
+    writer = functools.partial(write_tiles, min_zoom=12, max_zoom=13)
+    files_to_ogr_file(
+        [src_path], dst_path, SingleThreadExecutor(options), writer=writer
+    )
+    with sqlite3.connect(dst_path) as conn:
+        zooms = conn.execute("SELECT DISTINCT zoom_level FROM tiles").fetchall()
+        metadata = dict(conn.execute("SELECT name, value FROM metadata"))
+    assert sorted(zooms) == [(12,), (13,)]
+    assert (metadata["minzoom"], metadata["maxzoom"]) == ("12", "13")
+
+    if "PMTiles" in pyogrio.list_drivers():
+        dst_path = tmp_path / "output.pmtiles"
+        files_to_ogr_file(
+            [src_path], dst_path, SingleThreadExecutor(options), writer="tiles"
+        )
+        assert pyogrio.list_layers(dst_path)[0][0] == "筆"
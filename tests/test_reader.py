@@ -1,10 +1,11 @@
 """Tests for reader.py."""
 
+import zipfile
 from pathlib import Path
 
 import pytest
 
-from mojxml.reader import iter_content_xmls
+from mojxml.reader import ZipMemberSource, iter_content_sources, iter_content_xmls
 
 
 def test_reader():
@@ -13,3 +14,35 @@ def test_reader():
         src_path = Path("testdata") / "foobar.png"  # invalid extension
         for _ in iter_content_xmls([src_path]):
             pass
+
+
+def test_sources():
+    """Zip members are referenced without being decompressed."""
+    src_path = Path("testdata") / "12103-0400-76.zip"
+    [src] = iter_content_sources([src_path])
+    assert src == ZipMemberSource(src_path, "12103-0400-76.xml")
+    assert src.name == "12103-0400-76.xml"
+    assert [src.read()] == list(iter_content_xmls([src_path]))
+
+
+def test_open_sources(tmp_path):
+    """Sources are streamed from mapped files and stored or nested members."""
+    [content] = iter_content_xmls([Path("testdata") / "12103-0400-76.zip"])
+    xml_path = tmp_path / "12103-0400-76.xml"
+    xml_path.write_bytes(content)
+    nested_path = tmp_path / "nested.zip"
+    with zipfile.ZipFile(nested_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("nested.xml", content)
+    stored_path = tmp_path / "stored.zip"
+    with zipfile.ZipFile(stored_path, "w", zipfile.ZIP_STORED) as zf:
+        zf.writestr("12103-0400-76.xml", content)
+        zf.write(nested_path, "nested.zip")
+
+    srcs = list(iter_content_sources([xml_path, stored_path]))
+    assert len(srcs) == 3
+    for src in srcs:
+        with src.open() as f:
+            assert f.read(100) == content[:100]
+            assert f.read() == content[100:]
+            assert f.tell() == len(content)
+        assert src.read() == content
@@ -0,0 +1,63 @@
+"""Tests for scan.py."""
+
+import csv
+import re
+from pathlib import Path
+
+from click.testing import CliRunner
+
+from mojxml.__main__ import scan
+from mojxml.parse import ParseOptions, parse_batch
+from mojxml.reader import iter_content_xmls
+from mojxml.scan import scan_xml
+
+
+def test_scan_xml():
+    """Scan an XML without parsing its geometries."""
+    content = next(iter(iter_content_xmls([Path("testdata") / "12103-0400-76.zip"])))
+    record = scan_xml(content)
+    assert record.header["市区町村コード"] == "12103"
+    assert record.header["座標系"] == "公共座標9系"
+    assert record.num_fude == 1
+    assert record.num_points and record.num_curves and record.num_surfaces
+
+    # 座標の範囲は筆を含む
+    assert record.bounds is not None
+    bounds = parse_batch(content, ParseOptions()).bounds()[0]
+    assert record.bounds[0] <= bounds[0] and bounds[2] <= record.bounds[2]
+    assert record.bounds[1] <= bounds[1] and bounds[3] <= record.bounds[3]
+
+    header = scan_xml(content, header_only=True)
+    assert header.header == record.header
+    assert header.num_fude is None and header.bounds is None
+
+
+def test_scan_header_only_stops_at_section():
+    """Stop reading the header at the first section, even if a field is missing."""
+    content = next(iter(iter_content_xmls([Path("testdata") / "12103-0400-76.zip"])))
+    content = re.sub("<測地系判別>.*?</測地系判別>".encode(), b"", content)
+    # 空間属性より後は読まれないので、壊れていてもよい
+    start = "<空間属性>".encode()
+    content = content[: content.index(start) + len(start)] + b"<broken"
+    record = scan_xml(content, header_only=True)
+    assert record.header["市区町村コード"] == "12103"
+    assert record.header["測地系判別"] is None
+
+
+def test_scan_command(tmp_path):
+    """Write a catalogue with the scan command."""
+    dst_path = tmp_path / "catalogue.csv"
+    runner = CliRunner()
+    result = runner.invoke(
+        scan,
+        [str(dst_path), "testdata/12103-0400-76.zip", "--worker", "single"],
+    )
+    assert result.exit_code == 0
+    with open(dst_path, encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 1
+    assert rows[0]["file"] == "12103-0400-76.xml"
+    assert rows[0]["archive"].endswith("12103-0400-76.zip")
+    assert rows[0]["市区町村名"] == "千葉市稲毛区"
+    assert rows[0]["num_fude"] == "1"
+    assert float(rows[0]["bytes"]) > 0
@@ -0,0 +1,27 @@
+"""Tests for tables.py."""
+
+from mojxml.tables import CoordinateTable, SurfaceTable
+
+
+def test_tables():
+    """Surfaces are resolved into closed rings of curve indices."""
+    curves = CoordinateTable()
+    for i, (x, y) in enumerate([(0.1234567891234, -1.0), (1.5, -0.9999999999)]):
+        curves.append(f"C{i}", x, y)
+    surfaces = SurfaceTable()
+    surfaces.append("F0", [[0, 1], [1, 0]])
+    curves.freeze()
+    surfaces.freeze()
+    curves.truncate()
+
+    assert curves.x.tolist() == [0.123456789, 1.5]
+    assert curves.y.tolist() == [-1.0, -0.999999999]
+    assert [ring.tolist() for ring in surfaces.rings("F0")] == [[0, 1, 0], [1, 0, 1]]
+
+    # IDを持たない表 (分割したXMLの解析で共有するもの) は番号で引く
+    shared = SurfaceTable.from_arrays(
+        surfaces.curve_indices, surfaces.ring_offsets, surfaces.surface_offsets
+    )
+    assert len(shared) == 1
+    assert [ring.tolist() for ring in shared.rings_at(0)] == [[0, 1, 0], [1, 0, 1]]
+    assert len(CoordinateTable.from_arrays([], curves.x, curves.y)) == 2
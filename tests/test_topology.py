@@ -0,0 +1,85 @@
+"""Tests for topology.py."""
+
+from pathlib import Path
+
+import fiona
+import numpy as np
+
+from mojxml.batch import FeatureBatchBuilder
+from mojxml.parse import ParseOptions
+from mojxml.process import files_to_feature_iter, files_to_ogr_file
+from mojxml.process.executor import SingleThreadExecutor
+from mojxml.topology import build_topology
+
+
+def _two_squares():
+    # (0,0)-(1,0)-(1,1)-(0,1) と (1,0)-(2,0)-(2,1)-(1,1) は辺を共有する
+    x = [0.0, 1.0, 1.0, 0.0, 2.0, 2.0, 0.5, 0.6, 0.6]
+    y = [0.0, 0.0, 1.0, 1.0, 0.0, 1.0, 0.5, 0.5, 0.6]
+    builder = FeatureBatchBuilder(["name"])
+
+    def ring(*indices):
+        return np.array(indices, dtype=np.int64)
+
+    builder.add({"name": "a"}, [ring(0, 1, 2, 3, 0), ring(6, 8, 7, 6)])
+    builder.add({"name": "b"}, [ring(1, 4, 5, 2, 1)])
+    builder.add({"name": "c"}, [ring(6, 7, 8, 6)])
+    builder.add({"name": "d"}, [])
+    return builder.build(np.array(x), np.array(y))
+
+
+def _decode(topology, refs):
+    coords = []
+    for ref in refs:
+        arc = topology.arc(ref if ref >= 0 else ~ref).tolist()
+        arc = arc if ref >= 0 else arc[::-1]
+        coords.extend(arc if not coords else arc[1:])
+    return coords
+
+
+def _normalize(ring):
+    ring = [tuple(c) for c in ring[:-1]]
+    start = ring.index(min(ring))
+    return ring[start:] + ring[:start]
+
+
+def test_build_topology():
+    """Shared boundaries become one arc referenced by both rings."""
+    batch = _two_squares()
+    topology = build_topology(batch)
+    # 共有する辺、それぞれの残りの部分、穴とそれを埋める筆の1つ
+    assert topology.num_arcs == 4
+    [[a_exterior, a_hole], [b_exterior], [c_exterior], []] = topology.rings
+    assert c_exterior == [~a_hole[0]]
+    shared = set(a_exterior) & {~ref for ref in b_exterior}
+    assert len(shared) == 1
+
+    features = batch.to_features()
+    for feature, rings in zip(features, topology.rings):
+        if not rings:
+            assert feature["geometry"] is None
+            continue
+        assert feature["geometry"] is not None
+        [polygon] = feature["geometry"]["coordinates"]
+        for ring, refs in zip(polygon, rings):
+            assert _normalize(_decode(topology, refs)) == _normalize(ring)
+
+
+def test_topojson_writer(tmp_path):
+    """TopoJSON output is read back as the same polygons."""
+    src_paths = [Path("testdata") / "12103-0400-76.zip"] * 2
+    options = ParseOptions()
+    dst_path = tmp_path / "output.topojson"
+    files_to_ogr_file(
+        src_paths, dst_path, SingleThreadExecutor(options), writer="topojson"
+    )
+    expected = list(files_to_feature_iter(src_paths, SingleThreadExecutor(options)))
+    with fiona.open(dst_path, driver="TopoJSON") as f:
+        records = list(f)
+    assert len(records) == 2
+    for record, feature in zip(records, expected):
+        assert record.properties["筆ID"] == feature["properties"]["筆ID"]
+        [[ring]] = record.geometry.coordinates
+        assert feature["geometry"] is not None
+        [[expected_ring]] = feature["geometry"]["coordinates"]
+        assert _normalize(ring) == _normalize(expected_ring)
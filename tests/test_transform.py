@@ -0,0 +1,29 @@
+"""Tests for transform.py."""
+
+import threading
+
+from mojxml.transform import (
+    clear_transformer_cache,
+    get_transformer,
+    get_transformer_cache_stats,
+    warm_transformers,
+)
+
+
+def test_transformer_cache():
+    """Transformers are cached per thread and hits/misses are counted."""
+    clear_transformer_cache()
+    warm_transformers(["epsg:2451"])
+    transformer = get_transformer("epsg:2451")
+    assert get_transformer("epsg:2451") is transformer
+    stats = get_transformer_cache_stats()
+    assert (stats.hits, stats.misses) == (2, 1)
+
+    others = []
+    thread = threading.Thread(
+        target=lambda: others.append(get_transformer("epsg:2451"))
+    )
+    thread.start()
+    thread.join()
+    assert others[0] is not transformer
+    assert get_transformer_cache_stats().misses == 2